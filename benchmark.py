@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bet_game import Game
+from bet_game.parser import get_arcaea_info, get_phigros_info
+from bet_game.player import PlayerManager
+from bet_game.pool_cache import QuestPoolCache
+from bet_game.quest import QuestPool
+from bet_game.song import ArcaeaSongPackageManager, PhigrosSongPackageManager
+from bet_game.utils import Logger
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+LOBBY_SIZES = [2, 6, 10, 50, 200, 1000]
+
+arcaea_quests = [
+    '7', 1.0, '8', 2.0, '9', 3.0, '9+', 3.0, '10', 2.0, '10+', 1.0, '11', 0.0, '12', 0.0,
+    'ban', 'dropdead', 'ban', 'fallensquare', 'ban', 'altale', 'ban', 'ifi',
+]
+phigros_quests = [
+    '7', 0.0, '14', 1.5, '15', 1.5, '16', 1.0,
+    'ban', 'Break Over', 'ban', 'Introduction',
+]
+
+def timeit(fn, setup=None, min_time=0.5, repeat=7):
+    # seconds per call: best of repeat runs, each long enough to be measurable
+    number = 1
+    while True:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def bench_import(results, repeat=7):
+    # fresh interpreters; the time of an empty interpreter is subtracted
+    root = os.path.dirname(os.path.abspath(__file__))
+    def run(code):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    empty = run('pass')
+    results['import.bet_game'] = max(run('import bet_game') - empty, 0.0)
+    results['import.bet_game.player'] = max(run('from bet_game.player import PlayerManager') - empty, 0.0)
+    results['import.Game'] = max(run('from bet_game import Game') - empty, 0.0)
+    results['import.Game.construct'] = max(run(
+        'from bet_game import Game\nfrom bet_game.utils import Logger\n'
+        'Game(logger=Logger.headless())') - empty, 0.0)
+
+def bench_catalog(results):
+    results['get_arcaea_info'] = timeit(get_arcaea_info)
+    results['get_phigros_info'] = timeit(get_phigros_info)
+
+def bench_add_quest_list(results):
+    for name, manager, quests in (
+        ('arcaea', ArcaeaSongPackageManager(), arcaea_quests),
+        ('phigros', PhigrosSongPackageManager(), phigros_quests),
+    ):
+        manager.enable_all_packages()
+        manager.enable_all_difficulties()
+        # cold: the view of the selection is filtered from the catalog (no view is cached
+        # on it yet), warm: the manager reuses its view
+        results[f'add_quest_list.{name}.cold'] = timeit(
+            lambda: (manager.catalog.views.clear(), manager.enable_all_packages(), manager.add_quest_list(quests)))
+        results[f'add_quest_list.{name}.warm'] = timeit(lambda: manager.add_quest_list(quests))
+
+def bench_draw_quest(results):
+    manager = ArcaeaSongPackageManager()
+    manager.enable_all_packages()
+    manager.enable_all_difficulties()
+    quest_list = manager.add_quest_list(arcaea_quests)
+    pool = QuestPool(list(quest_list), seed=0)
+    results['draw_quest.single'] = timeit(pool.draw_quest)
+
+    def redraw():
+        # what Game.draw_quest does on a redraw: drop the current quest, draw again;
+        # the quest is put back so that the pool keeps its size
+        quest = pool.draw_quest()
+        pool.remove_quest(quest)
+        pool.draw_quest()
+        pool.add_quest(quest)
+    results['draw_quest.redraw'] = timeit(redraw)
+
+def bench_quest_delta(results):
+    game = Game('arcaea', logger=Logger.headless(), seed=0)
+    game.enable_all()
+    game.add_quest(arcaea_quests)
+    weights = iter(range(1 << 62))
+    # live tuning touches only the songs of one level / one song
+    results['quest_delta.set_weight'] = timeit(lambda: game.set_quest_weight('9', float(next(weights) % 3 + 1)))
+    results['quest_delta.ban_unban'] = timeit(lambda: (game.ban_quest('grievouslady'), game.unban_quest('grievouslady')))
+    # a whole configuration: only the levels that differ from 1.0 are written
+    results['quest_delta.add_quest'] = timeit(lambda: game.add_quest(arcaea_quests))
+
+def bench_pool_cache(results):
+    catalog = get_arcaea_info()
+    directory = tempfile.mkdtemp()
+    try:
+        game = Game('arcaea', logger=Logger.headless(), seed=0, catalog=catalog, pool_cache=QuestPoolCache(directory))
+        game.enable_all()
+        game.add_quest(arcaea_quests)
+        results['pool_cache.add_quest.memory'] = timeit(lambda: game.add_quest(arcaea_quests))
+        # a new process: no quest views on the catalog, the pool is read from its file
+        def cold():
+            catalog.views.clear()
+            game.song_manager.enable_all_packages()
+            game.add_quest(arcaea_quests)
+        game.set_pool_cache(QuestPoolCache(directory, memory_entries=0))
+        results['pool_cache.add_quest.file'] = timeit(cold)
+        game.set_pool_cache(None)
+        results['pool_cache.add_quest.build'] = timeit(cold)
+    finally:
+        shutil.rmtree(directory)
+
+def bench_trie(results):
+    manager = PlayerManager()
+    ids = [f'player{i:05d}' for i in range(1000)]
+    for id in ids:
+        manager.add_player(id)
+    rng = random.Random(0)
+    sample = [rng.choice(ids) for _ in range(100)]
+    results['trie.find.full_id'] = timeit(lambda: [manager.find_player(id) for id in sample]) / len(sample)
+    manager = PlayerManager()
+    for id in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank'):
+        manager.add_player(id)
+    results['trie.find.prefix'] = timeit(lambda: [manager.find_player(id) for id in ('al', 'b', 'c', 'd', 'e', 'f')]) / 6
+
+def bench_turn(results, lobby_sizes):
+    catalog = get_arcaea_info()
+    for n in lobby_sizes:
+        game = Game('arcaea', turns=1 << 30, logger=Logger.headless(), seed=0, catalog=catalog)
+        game.enable_all()
+        game.add_quest(arcaea_quests)
+        ids = [f'p{i:04d}' for i in range(n)]
+        for id in ids:
+            game.enroll(id)
+        game.start()
+        rng = random.Random(n)
+        bets = [(id, rng.choice([other for other in ids[:50] if other != id] + [None]), rng.randint(1, 3)) for id in ids]
+        scores = [(id, rng.randrange(9000000, 10000000)) for id in ids]
+
+        def turn():
+            game.draw_event()
+            game.draw_quest()
+            game.verify()
+            for bet in bets:
+                game.bet(*bet)
+            for score in scores:
+                game.play(*score)
+            game.evaluate_preprocess()
+            game.evaluate_score()
+            game.evaluate_bet()
+            game.end_turn()
+        results[f'turn.players_{n}'] = timeit(turn)
+
+def run(lobby_sizes):
+    results = {}
+    bench_import(results)
+    bench_catalog(results)
+    bench_add_quest_list(results)
+    bench_draw_quest(results)
+    bench_quest_delta(results)
+    bench_pool_cache(results)
+    bench_trie(results)
+    bench_turn(results, lobby_sizes)
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f'{"benchmark":<32} {"time":>12} {"baseline":>12} {"ratio":>7}')
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base:
+            ratio = value / base
+            flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+            print(f'{name:<32} {value*1e6:>10.2f}us {base*1e6:>10.2f}us {ratio:>7.2f}{flag}')
+            if flag:
+                regressions.append(name)
+        else:
+            # a benchmark added (or renamed) without saving the baseline again
+            print(f'{name:<32} {value*1e6:>10.2f}us {"-":>12} {"-":>7}  MISSING')
+            regressions.append(name)
+    for name in baseline:
+        if not name in results:
+            print(f'{name:<32} {"-":>12} {baseline[name]*1e6:>10.2f}us {"-":>7}  MISSING')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the bet_game hot paths')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--baseline', default=BASELINE, help='JSON results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with these results')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown before reporting a regression')
+    parser.add_argument('--lobby-sizes', type=int, nargs='+', default=LOBBY_SIZES)
+    args = parser.parse_args()
+
+    results = run(args.lobby_sizes)
+    document = {
+        'python': sys.version.split()[0],
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f'{len(regressions)} regression(s) or benchmark(s) missing from the baseline: {", ".join(regressions)}')
+        sys.exit(1)
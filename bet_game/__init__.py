@@ -1 +1,21 @@
-from .game import Game
+import importlib
+
+# public names -> submodule; submodules are imported on first access so that
+# `import bet_game` does not pay for the game, the song catalog or numpy
+_LAZY = {
+    'Game': '.game',
+    'GameJournal': '.journal',
+    'GameReplay': '.journal',
+}
+
+__all__ = list(_LAZY)
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,245 @@
+import math
+import random
+from functools import lru_cache
+from .game import Game
+from .utils import GameplayError
+
+# Expected point change of every bet option of a player. A bet on t pays when t
+# has the highest score after the playing stage (ties included), so the only
+# unknown is the finishing order of the quest. The outcome model is either
+#   - uniform: every finishing order is equally likely, or
+#   - weights: Plackett-Luce, the next rank goes to a remaining player with
+#     probability proportional to its weight (e.g. derived from skill).
+# Under the uniform model the probabilities are exact up to UNIFORM_EXACT_LIMIT
+# players (counting, O(n^3 log n)), under weights up to EXACT_LIMIT players
+# (dynamic programming over the set of ranked players); both are sampled above.
+
+EXACT_LIMIT = 12
+UNIFORM_EXACT_LIMIT = 64
+
+def rank_points(rule:str, n:int):
+    # points for rank i (0 = best) of the playing stage, rule is the name of the
+    # rank_to_score function in RandomEvent.get_effects()
+    if rule == 'winner_takes_all_rank_to_score':
+        return [(n+1)//2] + [0] * (n-1)
+    elif rule == 'normal_distribution_rank_to_score':
+        if n % 2 == 0:
+            return [n//2 - min(abs(i - n//2), abs(i - (n//2-1))) for i in range(n)]
+        return [n//2 - abs(i - n//2) for i in range(n)]
+    return [max((n+1)//2 - i, 0) for i in range(n)]
+
+
+def _uniform_success(points, base, deduct):
+    # For t at rank r every other player j may only take the ranks k != r with
+    # base[j] + points[k] <= base[t] - deduct + points[r]. These allowed sets are
+    # nested (thresholds on the same points), so the number of valid orders is
+    # the product of (allowed - already placed) over players sorted by allowed.
+    n = len(base)
+    result = []
+    for t in range(n):
+        count = 0
+        for r in range(n):
+            top = base[t] - deduct + points[r]
+            rest = sorted(points[:r] + points[r+1:])
+            allowed = sorted(_count_at_most(rest, top - base[j]) for j in range(n) if j != t)
+            ways = 1
+            for placed, a in enumerate(allowed):
+                ways *= a - placed
+                if ways <= 0:
+                    break
+            count += max(ways, 0)
+        result.append(count / math.factorial(n))
+    return result
+
+def _count_at_most(sorted_values, limit):
+    lo, hi = 0, len(sorted_values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sorted_values[mid] <= limit:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _weighted_success(points, base, deduct, weights):
+    # ranks are given out best first; the state is (set of ranked players, bound):
+    # before t is ranked bound is the best total so far, afterwards it is t's total
+    n = len(base)
+    full = (1 << n) - 1
+    remaining = [0.0] * (1 << n)
+    for mask in range(1 << n):
+        remaining[mask] = sum(weights[p] for p in range(n) if not mask >> p & 1)
+    best_after = [max(points[k:]) for k in range(n)]
+    result = []
+    for t in range(n):
+        tbit = 1 << t
+        states = {(0, None): 1.0}
+        for k in range(n):
+            next_states = {}
+            for (mask, bound), prob in states.items():
+                if not mask & tbit and bound is not None and bound > base[t] - deduct + best_after[k]:
+                    continue
+                scale = prob / remaining[mask]
+                for p in range(n):
+                    bit = 1 << p
+                    if mask & bit:
+                        continue
+                    total = base[p] + points[k]
+                    if p == t:
+                        total -= deduct
+                        if bound is not None and total < bound:
+                            continue
+                        key = (mask | bit, total)
+                    elif mask & tbit:
+                        if total > bound:
+                            continue
+                        key = (mask | bit, bound)
+                    else:
+                        key = (mask | bit, total if bound is None else max(bound, total))
+                    next_states[key] = next_states.get(key, 0.0) + scale * weights[p]
+            states = next_states
+        result.append(sum(prob for (mask, _), prob in states.items() if mask == full))
+    return result
+
+
+def _sampled_success(points, base, deduct, weights, samples, rng):
+    n = len(base)
+    wins = [0] * n
+    players = list(range(n))
+    for _ in range(samples):
+        if weights is None:
+            rng.shuffle(players)
+            order = players
+        else:
+            # Plackett-Luce order: sort by u ** (1 / w)
+            order = sorted(players, key=lambda p: -rng.random() ** (1 / weights[p]))
+        total = [0] * n
+        for rank, p in enumerate(order):
+            total[p] = base[p] + points[rank]
+        top = max(total)
+        if total.count(top) > 1:
+            second = top
+        else:
+            second = max((v for v in total if v != top), default=top)
+        for i in range(n):
+            # the best of the others; our own bet on i deducts one more point from i
+            rest = second if total[i] == top else top
+            if total[i] - deduct >= rest:
+                wins[i] += 1
+    return [w / samples for w in wins]
+
+
+@lru_cache(maxsize=4096)
+def success_probabilities(rule:str, deduct:int, base:tuple, weights:tuple=None, samples=20000):
+    # probability that a bet on player i (base[i]: score after the bets already
+    # placed) pays; base should be shifted to min 0 by the caller for cache hits
+    n = len(base)
+    points = rank_points(rule, n)
+    if weights is None and n <= UNIFORM_EXACT_LIMIT:
+        return tuple(_uniform_success(points, list(base), deduct))
+    elif weights is not None and n <= EXACT_LIMIT:
+        return tuple(_weighted_success(points, list(base), deduct, weights))
+    # seeded by the arguments so that the cached value does not depend on call order
+    rng = random.Random(repr((rule, deduct, base, weights)))
+    return tuple(_sampled_success(points, list(base), deduct, weights, samples, rng))
+
+
+class BetAdvisor:
+    def __init__(self, weights:dict=None, samples=20000):
+        # weights: player id -> strength for the Plackett-Luce model, None for uniform
+        # samples: finishing orders sampled above the exact limits
+        self.weights = weights
+        self.samples = samples
+
+    def advise(self, game:Game, player_id:str):
+        # [(target id, probability that the bet pays, expected points per stake)],
+        # best first; not betting (None) is always worth 0
+        players = game.players
+        ids = [p.id for p in players]
+        if not player_id in ids:
+            raise GameplayError(f'Invalid player id: {player_id}')
+        effects = game.effects
+        deduct = 1 if effects['betted_deduct'] else 0
+        index = {id: i for i, id in enumerate(ids)}
+        base = [p.score for p in players]
+        for p in players:
+            if p.bet_id and p.id != player_id:
+                base[index[p.bet_id]] -= deduct
+        low = min(base)
+        weights = None
+        if self.weights is not None:
+            weights = tuple(float(self.weights.get(id, 1.0)) for id in ids)
+        probabilities = success_probabilities(effects['rank_to_score'], deduct,
+            tuple(b - low for b in base), weights, self.samples)
+
+        reward = 2 if effects['double_reward'] else 1
+        loss = 1 if effects['bet_failed_deduct'] else 0
+        options = [(id, p, p * reward - (1 - p) * loss)
+            for id, p in zip(ids, probabilities) if id != player_id]
+        options.sort(key=lambda option: -option[2])
+        return options
+
+    def best(self, game:Game, player_id:str, max_stake:int=None):
+        # (target, stake, expected point change); stakes are linear, so the best
+        # bet uses the largest stake, and no bet is placed when nothing pays on average
+        options = self.advise(game, player_id)
+        if not options or options[0][2] <= 0:
+            return None, 1, 0.0
+        stake = len(game.players) if max_stake is None else min(max_stake, len(game.players))
+        target, _, expected = options[0]
+        return target, stake, expected * stake
+
+
+def _brute_force(points, base, deduct, weights=None):
+    from itertools import permutations
+    n = len(base)
+    result = [0.0] * n
+    for order in permutations(range(n)):
+        prob = 1.0
+        if weights is not None:
+            left = sum(weights)
+            for p in order:
+                prob *= weights[p] / left
+                left -= weights[p]
+        else:
+            prob = 1 / math.factorial(n)
+        total = [0] * n
+        for rank, p in enumerate(order):
+            total[p] = base[p] + points[rank]
+        for t in range(n):
+            if total[t] - deduct >= max((total[j] for j in range(n) if j != t), default=total[t]):
+                result[t] += prob
+    return result
+
+
+if __name__ == '__main__':
+    import time
+    rng = random.Random(0)
+    for n in range(2, 8):
+        for rule in ('default_rank_to_score', 'winner_takes_all_rank_to_score', 'normal_distribution_rank_to_score'):
+            for _ in range(20):
+                base = [rng.randint(-3, 6) for _ in range(n)]
+                weights = [rng.uniform(0.2, 3.0) for _ in range(n)]
+                deduct = rng.randint(0, 1)
+                points = rank_points(rule, n)
+                for got, expected in (
+                    (_uniform_success(points, base, deduct), _brute_force(points, base, deduct)),
+                    (_weighted_success(points, base, deduct, weights), _brute_force(points, base, deduct, weights)),
+                ):
+                    if any(abs(a - b) > 1e-9 for a, b in zip(got, expected)):
+                        raise AssertionError(f'{rule} {base} {deduct}: {got} != {expected}')
+    print('advisor matches brute force enumeration')
+
+    for n in (6, 12, 50):
+        base = tuple(rng.randint(0, 8) for _ in range(n))
+        weights = tuple(rng.uniform(0.5, 2.0) for _ in range(n))
+        for name, w in (('uniform', None), ('weights', weights)):
+            success_probabilities.cache_clear()
+            start = time.perf_counter()
+            success_probabilities('default_rank_to_score', 1, base, w)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            success_probabilities('default_rank_to_score', 1, base, w)
+            warm = time.perf_counter() - start
+            print(f'n={n:<3} {name:<8} cold {cold*1000:8.2f}ms warm {warm*1e6:6.2f}us')
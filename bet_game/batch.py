@@ -0,0 +1,230 @@
+import json
+import sys
+import time
+from .game import Game
+from .parser import get_arcaea_info, get_phigros_info
+from .pool_cache import QuestPoolCache
+from .utils import GameplayError, ParseError, Logger
+
+# Headless runner for scripted games, e.g. regression scripts or score imports.
+# One command per line, '#' starts a comment, arguments are separated by spaces:
+#   game arcaea 5 [seed]        a new game (game type, turns), the previous one is dropped
+#   enable core / disable ftr / enable_all / disable_all
+#   quests 7 1.0 9+ 3.0 ban ifi quest configuration, as the args of Game.add_quest
+#   weight 9 2.0                change one level weight
+#   ban <song> / unban <song>   the rest of the line is the song id (arcaea) or name (phigros)
+#   reset 2 / enroll p1 / remove p1 / start
+#   event [names]               draw the events of the turn, or apply the named ones
+#   quest [description]         draw (or redraw) the quest, or take the described one
+#   verify
+#   bet p1 p3 [stake] / bet p4 none
+#   play p1 9950000
+#   result                      evaluate the turn and end it
+#   undo / redo                 take back (or reapply) the latest bet or score of the turn
+#   rollback 103                undo the bets and scores made since the turn reached a status
+#   expire                      the deadline of the phase passed: missing bets are none, missing
+#                               scores 0 and the turn is evaluated and ended after the scores
+# The helper names of init_arc.py (add for enroll) work as well. Commands before
+# the first game command play on an arcaea game of 5 turns. A game that is
+# started without quest configuration draws from every enabled song; quests
+# are drawn from all packages (all difficulties) when none of them is enabled.
+# A failing command is reported with its line and skipped, the batch goes on.
+# Every finished round is one JSON line of output:
+#   {"game": n, "line": l, "winner": "...", "scores": {"p1": 3, ...}}
+
+# command -> (Game method, argument converters)
+_COMMANDS = {
+    'enroll': ('enroll', (str,)),
+    'add': ('enroll', (str,)),
+    'remove': ('remove', (str,)),
+    'reset': ('reset_round', (int,)),
+    'enable': ('enable', (str,)),
+    'disable': ('disable', (str,)),
+    'enable_all': ('enable_all', ()),
+    'disable_all': ('disable_all', ()),
+    'weight': ('set_quest_weight', (str, float)),
+    'verify': ('verify', ()),
+    'play': ('play', (str, int)),
+    'undo': ('undo', ()),
+    'redo': ('redo', ()),
+    'rollback': ('rollback', (int,)),
+    'expire': ('expire', ()),
+}
+# commands that take the rest of the line as one argument
+_REST_OF_LINE = {'quest', 'ban', 'unban'}
+
+def _quest_args(tokens:list):
+    # level weight pairs and ban / unban pairs
+    if len(tokens) % 2:
+        raise ParseError('quests takes pairs of arguments')
+    args = []
+    for key, value in zip(tokens[::2], tokens[1::2]):
+        args += [key, value if key in ('ban', 'unban') else float(value)]
+    return args
+
+
+class BatchRunner:
+    def __init__(self, output=None, logger_factory=Logger.headless, batch_lines=256, pool_cache=None, profiler=None):
+        # output: stream for the result lines, stdout by default
+        # logger_factory: loggers of the games, headless (quiet) by default
+        # pool_cache: QuestPoolCache of the quest pools, pools are built per game when None
+        # profiler: MemoryProfiler tracking the games of the batch
+        self.output = output if output else sys.stdout
+        self.logger_factory = logger_factory
+        self.batch_lines = batch_lines
+        self.pool_cache = pool_cache
+        self.profiler = profiler
+        self.game = None
+        self.games = 0
+        self.rounds = 0
+        self.commands = 0
+        self.errors = []        # (script:line, line, error)
+        self.__catalogs = {}    # game type -> catalog shared by the games of the batch
+        self.__configured = False
+        self.__pending = []
+
+    def new_game(self, game_type='arcaea', turns=5, seed=None):
+        if not game_type in self.__catalogs:
+            if game_type == 'arcaea':
+                self.__catalogs[game_type] = get_arcaea_info()
+            elif game_type == 'phigros':
+                self.__catalogs[game_type] = get_phigros_info()
+            else:
+                raise GameplayError("Currently Only Support arcaea and phigros")
+        if self.game:
+            self.game.close()
+        self.game = Game(game_type, turns=turns, logger=self.logger_factory(), seed=seed,
+            catalog=self.__catalogs[game_type], pool_cache=self.pool_cache)
+        if self.profiler:
+            self.game.enable_profiling(self.profiler)
+        self.games += 1
+        self.__configured = False
+
+    def run(self, lines, name='<batch>'):
+        # lines: any iterable of lines (file, stdin, list); returns the number of errors
+        errors = len(self.errors)
+        for number, line in enumerate(lines, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            self.commands += 1
+            try:
+                self.execute(line, number)
+            except (GameplayError, ParseError, ValueError, TypeError) as e:
+                self.errors.append((f'{name}:{number}', line, f'{type(e).__name__}: {e}'))
+        self.flush()
+        return len(self.errors) - errors
+
+    def execute(self, line:str, number:int=0):
+        cmd, _, rest = line.partition(' ')
+        rest = rest.strip()
+        args = [rest] if cmd in _REST_OF_LINE and rest else rest.split()
+        if cmd == 'game':
+            if len(args) > 3:
+                raise ParseError('game takes up to 3 arguments')
+            converters = (str, int, int)
+            self.new_game(*[convert(arg) for convert, arg in zip(converters, args)])
+            return
+        if self.game is None:
+            self.new_game()
+        game = self.game
+        finished = game.finished
+
+        if cmd in _COMMANDS:
+            method, converters = _COMMANDS[cmd]
+            if len(args) != len(converters):
+                raise ParseError(f'{cmd} takes {len(converters)} argument(s)')
+            getattr(game, method)(*[convert(arg) for convert, arg in zip(converters, args)])
+        elif cmd == 'quests':
+            self.__add_quest(game, _quest_args(args))
+        elif cmd == 'ban':
+            game.ban_quest(*args)
+        elif cmd == 'unban':
+            game.unban_quest(*args)
+        elif cmd == 'start':
+            if not self.__configured:
+                self.__add_quest(game, [])
+            game.start()
+        elif cmd == 'event':
+            game.draw_event(args if args else None)
+        elif cmd == 'quest':
+            game.draw_quest(args[0] if args else None)
+        elif cmd == 'bet':
+            if not len(args) in (2, 3):
+                raise ParseError('bet takes 2 or 3 arguments')
+            target = None if args[1].lower() in ('none', '-') else args[1]
+            game.bet(args[0], target, int(args[2]) if len(args) == 3 else 1)
+        elif cmd == 'result':
+            game.evaluate_preprocess()
+            game.evaluate_score()
+            game.evaluate_bet()
+            game.end_turn()
+        else:
+            raise ParseError(f'Invalid command: {cmd}')
+        # any command that ends a turn (result, expire) may end the round
+        if game.finished and not finished:
+            self.__round_over(game, number)
+
+    def __round_over(self, game:Game, number:int):
+        self.rounds += 1
+        self.__pending.append(json.dumps({
+            'game': self.games, 'line': number, 'winner': game.winner,
+            'scores': {player.id: player.score for player in game.players},
+        }, ensure_ascii=False, separators=(',', ':')))
+        if len(self.__pending) >= self.batch_lines:
+            self.flush()
+
+    def __add_quest(self, game:Game, args:list):
+        # all packages / all difficulties when none of them is enabled
+        manager = game.song_manager
+        game.enable_all(not manager.available_packages, not manager.available_difficulties)
+        game.add_quest(args)
+        self.__configured = True
+
+    def flush(self):
+        if self.__pending:
+            self.output.write('\n'.join(self.__pending) + '\n')
+            self.__pending = []
+        self.output.flush()
+
+    def report(self):
+        return '\n'.join(f'{where}: {line}: {error}' for where, line, error in self.errors)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run scripted games headless, one command per line')
+    parser.add_argument('scripts', nargs='*', help='command files, stdin when none is given')
+    parser.add_argument('--verbose', action='store_true', help='print the game logs')
+    parser.add_argument('--pool-cache', metavar='DIR', help='directory of prebuilt quest pools')
+    parser.add_argument('--memory', action='store_true', help='report the memory of the games and the allocations of the batch')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.memory:
+        from .memory import MemoryProfiler
+        profiler = MemoryProfiler()
+    runner = BatchRunner(logger_factory=(lambda: Logger(log_dir=None, threaded=False)) if args.verbose else Logger.headless,
+        pool_cache=QuestPoolCache(args.pool_cache), profiler=profiler)
+    if runner.profiler:
+        runner.profiler.snapshot()
+    start = time.perf_counter()
+    if args.scripts:
+        for script in args.scripts:
+            # every script starts from scratch
+            if runner.game:
+                runner.game.close()
+            runner.game = None
+            with open(script, encoding='utf8') as f:
+                runner.run(f, script)
+    else:
+        runner.run(sys.stdin, '<stdin>')
+    elapsed = time.perf_counter() - start
+    if runner.errors:
+        print(runner.report(), file=sys.stderr)
+    if runner.profiler:
+        runner.profiler.collect()
+        print(runner.profiler.report(), file=sys.stderr)
+    print(f'{runner.commands} commands, {runner.rounds} rounds of {runner.games} games in {elapsed:.2f}s '
+        f'({runner.commands/elapsed:.0f} commands/s), {len(runner.errors)} error(s)', file=sys.stderr)
+    sys.exit(1 if runner.errors else 0)
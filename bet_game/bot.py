@@ -0,0 +1,141 @@
+import asyncio
+import random
+import time
+from .game import Game
+from .instrument import Instrumentation
+from .server import LobbyServer
+from .simulation import Strategy, RandomBetStrategy, LeaderBetStrategy, ExpectedValueBetStrategy
+from .utils import GameplayError
+
+# policy name -> Strategy class, see simulation.py
+POLICIES = {
+    'random': RandomBetStrategy,
+    'greedy': LeaderBetStrategy,
+    'ev': ExpectedValueBetStrategy,
+    'none': Strategy,
+}
+
+def make_policy(policy):
+    if isinstance(policy, Strategy):
+        return policy
+    if not policy in POLICIES:
+        raise GameplayError(f'Invalid bot policy: {policy}')
+    return POLICIES[policy]()
+
+
+class Bot:
+    # a player whose bets and scores come from a Strategy
+    def __init__(self, player_id:str, policy='random', seed=None):
+        self.id = player_id
+        self.policy = make_policy(policy)
+        self.rng = random.Random(seed)
+
+    def bet_args(self, game:Game):
+        return (self.id, *self.policy.bet(game, self.id, self.rng))
+
+    def play_args(self, game:Game):
+        return (self.id, self.policy.score(game, self.id, self.rng))
+
+    def bet(self, game:Game):
+        game.bet(*self.bet_args(game))
+
+    def play(self, game:Game):
+        game.play(*self.play_args(game))
+
+    def __repr__(self):
+        return f'Bot({self.id}, {self.policy!r})'
+
+
+def fill_lobby(game:Game, players:int, policy='random', prefix='bot', seed=None):
+    # enroll bots until the game has the given number of players, e.g. for solo
+    # practice: fill_lobby(game, 4, 'ev'), then bot.bet(game) / bot.play(game)
+    rng = random.Random(seed)
+    taken = {player.id for player in game.players}
+    bots = []
+    i = 0
+    while len(taken) < players:
+        i += 1
+        id = f'{prefix}{i}'
+        if id in taken:
+            continue
+        game.enroll(id)
+        taken.add(id)
+        bots.append(Bot(id, policy, rng.randrange(1 << 30)))
+    return bots
+
+
+class BotDriver:
+    # Plays bot-filled games on in-process lobbies (LobbyServer), games run
+    # concurrently and the bots of a game bet and play concurrently. The latency
+    # of every lobby command is recorded per phase as 'bot.<command>', the whole
+    # turns and games as 'bot.turn' / 'bot.game'.
+    def __init__(
+        self,
+        policies:list,
+        game_type='arcaea',
+        turns=5,
+        quests:list=None,
+        server:LobbyServer=None
+    ):
+        # policies: one policy (name or Strategy) per seat, cycled over the players
+        if not policies:
+            raise GameplayError('At least one bot policy is needed')
+        self.policies = list(policies)
+        self.game_type = game_type
+        self.turns = turns
+        self.quests = quests if quests else []
+        self.server = server if server else LobbyServer()
+        self.instrumentation = Instrumentation()
+
+    async def __submit(self, lobby, cmd, *args):
+        histogram = self.instrumentation.histogram(f'bot.{cmd}')
+        start = time.perf_counter_ns()
+        try:
+            return await lobby.submit(cmd, *args)
+        finally:
+            histogram.add(time.perf_counter_ns() - start)
+
+    async def play_game(self, players:int, seed=None):
+        rng = random.Random(seed)
+        start = time.perf_counter_ns()
+        lobby = self.server.create_lobby(None, self.game_type, self.turns, rng.randrange(1 << 30))
+        try:
+            bots = [Bot(f'bot{i}', self.policies[i % len(self.policies)], rng.randrange(1 << 30))
+                for i in range(players)]
+            await self.__submit(lobby, 'enable_all')
+            await self.__submit(lobby, 'add_quest', self.quests)
+            for bot in bots:
+                await self.__submit(lobby, 'enroll', bot.id)
+            await self.__submit(lobby, 'start')
+            return await self.play_lobby(lobby, bots)
+        finally:
+            await self.server.close_lobby(lobby.id)
+            self.instrumentation.histogram('bot.game').add(time.perf_counter_ns() - start)
+
+    async def play_lobby(self, lobby, bots:list):
+        # play the turns of a started game until it is over, returns the winner
+        game = lobby.game
+        turn = self.instrumentation.histogram('bot.turn')
+        while not game.finished:
+            turn_start = time.perf_counter_ns()
+            for cmd in ('draw_event', 'draw_quest', 'verify'):
+                await self.__submit(lobby, cmd)
+            await asyncio.gather(*[self.__submit(lobby, 'bet', *bot.bet_args(game)) for bot in bots])
+            await asyncio.gather(*[self.__submit(lobby, 'play', *bot.play_args(game)) for bot in bots])
+            for cmd in ('evaluate_preprocess', 'evaluate_score', 'evaluate_bet', 'end_turn'):
+                await self.__submit(lobby, cmd)
+            turn.add(time.perf_counter_ns() - turn_start)
+        return game.winner
+
+    async def run(self, games:int, players:int, concurrency=100, seed=0):
+        # returns the winners of the games, in order
+        rng = random.Random(seed)
+        seeds = [rng.randrange(1 << 30) for _ in range(games)]
+        limit = asyncio.Semaphore(concurrency)
+        async def one(game_seed):
+            async with limit:
+                return await self.play_game(players, game_seed)
+        return await asyncio.gather(*[one(game_seed) for game_seed in seeds])
+
+    def report(self):
+        return self.instrumentation.report()
@@ -0,0 +1,194 @@
+import asyncio
+import math
+
+# Hashed timer wheel for the phase deadlines of many lobbies on one event loop.
+# Scheduling and cancelling are O(1) dict operations on a slot, and the loop
+# holds one handle per wheel (armed only while timers are pending) instead of
+# one per lobby. Timers fire on the first tick at or after their deadline, so at
+# most one tick late; a timer further away than a turn of the wheel waits for
+# the slot to come round again (rounds).
+
+class Timer:
+    __slots__ = ('wheel', 'when', 'callback', 'args', 'slot', 'rounds')
+
+    def __init__(self, wheel, when, callback, args):
+        self.wheel = wheel
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.slot = None
+        self.rounds = 0
+
+    @property
+    def pending(self):
+        return self.slot is not None
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    def __init__(self, tick=0.25, slots=512):
+        # tick: resolution in seconds, slots: ticks in a turn of the wheel
+        self.tick = tick
+        self.__slots = [{} for _ in range(slots)]   # timer -> None, in scheduling order
+        self.__cursor = 0                           # slot of the next tick
+        self.__time = None                          # loop time of the next tick
+        self.__handle = None
+        self.__loop = None
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def schedule(self, delay:float, callback, *args):
+        # callback(*args) in delay seconds, on the running event loop
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.__handle is None:
+            self.__loop = loop
+            self.__time = now + self.tick
+            self.__handle = loop.call_at(self.__time, self.__advance)
+        timer = Timer(self, now + delay, callback, args)
+        ticks = max(0, math.ceil((timer.when - self.__time) / self.tick - 1e-9))
+        timer.rounds, offset = divmod(ticks, len(self.__slots))
+        timer.slot = (self.__cursor + offset) % len(self.__slots)
+        self.__slots[timer.slot][timer] = None
+        self.__count += 1
+        return timer
+
+    def cancel(self, timer:Timer):
+        if timer.slot is not None:
+            del self.__slots[timer.slot][timer]
+            timer.slot = None
+            self.__count -= 1
+            if not self.__count and self.__handle:
+                self.__handle.cancel()
+                self.__handle = None
+
+    def __advance(self):
+        # a busy loop may call late: every tick that passed is processed
+        now = self.__loop.time()
+        while self.__count and self.__time <= now:
+            slot = self.__slots[self.__cursor]
+            expired = []
+            for timer in slot:
+                if timer.rounds:
+                    timer.rounds -= 1
+                else:
+                    expired.append(timer)
+            for timer in expired:
+                del slot[timer]
+                timer.slot = None
+                self.__count -= 1
+            self.__cursor = (self.__cursor + 1) % len(self.__slots)
+            self.__time += self.tick
+            for timer in expired:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    self.__loop.call_exception_handler({'message': 'Timer callback failed', 'exception': e})
+        if self.__count:
+            self.__handle = self.__loop.call_at(self.__time, self.__advance)
+        else:
+            self.__handle = None
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import time
+    from .game import Game
+    from .parser import get_arcaea_info
+    from .utils import Logger
+
+    parser = argparse.ArgumentParser(description='Check Game.expire in every status, check and time the timer wheel against one loop handle per timer')
+    parser.add_argument('--timers', type=int, default=20000)
+    parser.add_argument('--tick', type=float, default=0.01)
+    args = parser.parse_args()
+
+    async def wheel_run(delays):
+        wheel = TimerWheel(tick=args.tick, slots=64)
+        loop = asyncio.get_running_loop()
+        late = []
+        done = loop.create_future()
+        def fire(when):
+            late.append(loop.time() - when)
+            if len(late) == len(delays) // 2 and not done.done():
+                done.set_result(None)
+        start = time.perf_counter()
+        timers = [wheel.schedule(delay, fire, loop.time() + delay) for delay in delays]
+        scheduled = time.perf_counter() - start
+        start = time.perf_counter()
+        # half of the lobbies finish their phase before the deadline
+        for timer in timers[::2]:
+            timer.cancel()
+        cancelled = time.perf_counter() - start
+        await done
+        return scheduled, cancelled, late
+
+    async def handle_run(delays):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        handles = [loop.call_later(delay, lambda: None) for delay in delays]
+        scheduled = time.perf_counter() - start
+        start = time.perf_counter()
+        for handle in handles[::2]:
+            handle.cancel()
+        cancelled = time.perf_counter() - start
+        for handle in handles:
+            handle.cancel()
+        return scheduled, cancelled
+
+    catalog = get_arcaea_info()
+    def game_at(status, turns=2):
+        # a game that just reached status
+        game = Game('arcaea', turns=turns, logger=Logger.headless(), seed=1, catalog=catalog)
+        game.enable_all()
+        game.add_quest([])
+        for id in 'abc':
+            game.enroll(id)
+        steps = [game.start, game.draw_event, game.draw_quest, game.verify,
+            lambda: [game.bet(id, 'b' if id == 'a' else None, 1) for id in 'abc'],
+            lambda: [game.play(id, 9900000 - i) for i, id in enumerate('abc')],
+            game.evaluate_preprocess, game.evaluate_score, game.evaluate_bet, game.end_turn]
+        for step in steps:
+            if game.status == status:
+                break
+            step()
+        return game
+
+    # status -> (status after the expiry, turn after it, players missing)
+    expected = {
+        Game.STATUS_000_UNAVAILABLE: (0, 1, []),
+        Game.STATUS_100_DRAW_EVENT: (100, 1, []),
+        Game.STATUS_101_DRAW_QUEST: (101, 1, []),
+        Game.STATUS_102_VERIFY: (102, 1, []),
+        Game.STATUS_103_BET: (104, 1, ['a', 'b', 'c']),
+        Game.STATUS_104_PLAY: (100, 2, ['a', 'b', 'c']),
+        Game.STATUS_105_PREPROCESS: (100, 2, []),
+        Game.STATUS_106_EVALUATE_SCORE: (100, 2, []),
+        Game.STATUS_107_EVALUATE_BET: (100, 2, []),
+        Game.STATUS_108_END_TURN: (100, 2, []),
+    }
+    for status, (after, turn, missing) in expected.items():
+        game = game_at(status)
+        if game.status != status:
+            raise AssertionError(f'could not reach status {status}')
+        result = game.expire()
+        if (game.status, game.turn, result) != (after, turn, missing):
+            raise AssertionError(f'expiry in status {status}: status {game.status}, turn {game.turn}, missing {result}')
+    game = game_at(Game.STATUS_200_FINISHED, turns=1)
+    if game.expire() != [] or not game.finished:
+        raise AssertionError('expiry of a finished game')
+
+    rng = random.Random(1)
+    # some deadlines beyond a turn of the wheel (64 ticks)
+    delays = [rng.uniform(0, 1.0) for _ in range(args.timers)]
+    scheduled, cancelled, late = asyncio.run(wheel_run(delays))
+    if min(late) < -1e-6 or max(late) > args.tick + 0.05:
+        raise AssertionError(f'timers fired {min(late):.4f}s to {max(late):.4f}s after their deadline')
+    handle_scheduled, handle_cancelled = asyncio.run(handle_run(delays))
+    print(f'{args.timers} timers: wheel schedule {scheduled/args.timers*1e6:.2f}us, cancel {cancelled/(args.timers//2)*1e6:.2f}us, '
+        f'fired {min(late)*1000:.1f}ms to {max(late)*1000:.1f}ms late; '
+        f'call_later {handle_scheduled/args.timers*1e6:.2f}us, cancel {handle_cancelled/(args.timers//2)*1e6:.2f}us')
@@ -1,16 +1,27 @@
 from .player import PlayerManager
-from .utils import GameplayError, Logger
+from .utils import GameplayError, Logger, INFO
 import random
 
+# effects that can be pending in PlayerManager after an event is drawn
+_EFFECTS = {
+    'winner_takes_all_rank_to_score',
+    'normal_distribution_rank_to_score',
+    'traffic_collision_end',
+    'popular_player_end',
+    'be_patient_end',
+}
+
 class RandomEvent:
     def __init__(
         self,
         pm:PlayerManager,
         logger:Logger,
-        game_type='arcaea'
+        game_type='arcaea',
+        seed=None
     ):
         self.__player_manager = pm
         self.__logger = logger
+        self.rng = random.Random(seed)
         self.event = [
             # 若无特殊说明，event效果只在一个turn内生效
             self.absolute_zero,
@@ -60,23 +71,68 @@ class RandomEvent:
             self.event.extend(self.phi_event)
         else:
             raise GameplayError("Currently Only Support arcaea and phigros")
+        self.__event_dict = {event.__name__: event for event in self.event}
         self.reset()
 
     def reset(self):
         self.double_event = False
 
-    def draw_event(self):
-        if self.double_event:
+    def draw_event(self, names=None):
+        # names: replay the given events instead of drawing randomly
+        if not names is None:
+            for name in names:
+                if not name in self.__event_dict:
+                    raise GameplayError(f'Invalid event name: {name}')
+            event_list = [self.__event_dict[name] for name in names]
+            self.double_event = False
+        elif self.double_event:
             self.double_event = False
-            event_list = random.sample(self.event, 2)
-            for event in event_list:
-                event()
+            event_list = self.rng.sample(self.event, 2)
         else:
-            event = random.choice(self.event)
+            event_list = [self.rng.choice(self.event)]
+        for event in event_list:
             event()
+        return [event.__name__ for event in event_list]
+
+    # pending effects of the drawn events as data instead of closures (see Game.snapshot)
+    def get_effects(self):
+        pm = self.__player_manager
+        return {
+            'double_event': self.double_event,
+            'betted_deduct': pm.betted_deduct,
+            'bet_failed_deduct': pm.bet_failed_deduct,
+            'double_reward': pm.double_reward,
+            'rank_to_score': pm.rank_to_score.__name__,
+            'after_event': [event.__name__ for event in pm.after_event],
+        }
+
+    def set_effects(self, effects:dict):
+        pm = self.__player_manager
+        self.double_event = effects['double_event']
+        pm.betted_deduct = effects['betted_deduct']
+        pm.bet_failed_deduct = effects['bet_failed_deduct']
+        pm.double_reward = effects['double_reward']
+        if effects['rank_to_score'] == pm.default_rank_to_score.__name__:
+            pm.rank_to_score = pm.default_rank_to_score
+        else:
+            pm.rank_to_score = self.__effect(effects['rank_to_score'])
+        pm.after_event = [self.__effect(name) for name in effects['after_event']]
 
-    def log(self, s, file=True):
-        self.__logger.log(s, file)
+    def __effect(self, name):
+        if not name in _EFFECTS:
+            raise GameplayError(f'Invalid event effect: {name}')
+        return getattr(self, name)
+
+    def get_rng_state(self):
+        version, state, gauss = self.rng.getstate()
+        return [version, list(state), gauss]
+
+    def set_rng_state(self, state):
+        version, internal, gauss = state
+        self.rng.setstate((version, tuple(internal), gauss))
+
+    def log(self, s, file=True, level=INFO):
+        self.__logger.log(s, file, level)
 
     def absolute_zero(self):
         self.log("-----------------------------------------------")
@@ -102,38 +158,40 @@ class RandomEvent:
         self.log("Event: winner takes all")
         self.log("Only the first player in the game stage can get ceil(n/2) points")
         self.log("        and the rest get 0 points")
-        def winner_takes_all_rank_to_score(member):
-            pt = (len(member)+1)//2
-            for i, player in enumerate(member):
-                player.rank = i
-                player.cur_pt = pt
-                player.score += pt
-                if pt > 0:
-                    pt = 0
-        self.__player_manager.rank_to_score = winner_takes_all_rank_to_score
+        self.__player_manager.rank_to_score = self.winner_takes_all_rank_to_score
+
+    def winner_takes_all_rank_to_score(self, member):
+        pt = (len(member)+1)//2
+        for i, player in enumerate(member):
+            player.rank = i
+            player.cur_pt = pt
+            player.score += pt
+            if pt > 0:
+                pt = 0
 
     def normal_distribution(self):
         self.log("-----------------------------------------------")
         self.log("Event: normal distribution")
         self.log("The player who is closest to the middle of the playing stage gets floor(n/2 points)")
         self.log("        after that, every player outside gets 1 less points")
-        def normal_distribution_rank_to_score(member):
-            n = self.__player_manager.player_num
-            if n % 2 == 0:
-                max_posi = [n//2, n//2-1]
-                for i, player in enumerate(member):
-                    pt = n//2 - min(abs(i-max_posi[0]), abs(i-max_posi[1]))
-                    player.rank = i
-                    player.cur_pt = pt
-                    player.score += pt
-            else:
-                max_posi = n // 2
-                for i, player in enumerate(member):
-                    pt = n//2 - abs(i-max_posi)
-                    player.rank = i
-                    player.cur_pt = pt
-                    player.score += pt
-        self.__player_manager.rank_to_score = normal_distribution_rank_to_score
+        self.__player_manager.rank_to_score = self.normal_distribution_rank_to_score
+
+    def normal_distribution_rank_to_score(self, member):
+        n = self.__player_manager.player_num
+        if n % 2 == 0:
+            max_posi = [n//2, n//2-1]
+            for i, player in enumerate(member):
+                pt = n//2 - min(abs(i-max_posi[0]), abs(i-max_posi[1]))
+                player.rank = i
+                player.cur_pt = pt
+                player.score += pt
+        else:
+            max_posi = n // 2
+            for i, player in enumerate(member):
+                pt = n//2 - abs(i-max_posi)
+                player.rank = i
+                player.cur_pt = pt
+                player.score += pt
 
     def poverty_relief(self):
         self.log("-----------------------------------------------")
@@ -158,40 +216,41 @@ class RandomEvent:
         self.log("Event: traffic collsion")
         self.log("At the end of the turn, if x players bet on the same player")
         self.log("        each player will deduct x-1 points")
-        def traffic_collision_inner():
-            betted_dict = {}
-            most_betted = None
-            for player in self.__player_manager.player_list:
-                if not player.bet_id is None:
-                    if not player.bet_id in betted_dict.keys():
-                        betted_dict[player.bet_id] = 0
-                    betted_dict[player.bet_id] += 1
-                    if most_betted is None or betted_dict[player.bet_id] > most_betted:
-                        most_betted = betted_dict[player.bet_id]
+        self.__player_manager.after_event.append(self.traffic_collision_end)
+
+    def traffic_collision_end(self):
+        betted_dict = {}
+        most_betted = None
+        for player in self.__player_manager.player_list:
+            if not player.bet_id is None:
+                if not player.bet_id in betted_dict.keys():
+                    betted_dict[player.bet_id] = 0
+                betted_dict[player.bet_id] += 1
+                if most_betted is None or betted_dict[player.bet_id] > most_betted:
+                    most_betted = betted_dict[player.bet_id]
+
+        for player in self.__player_manager.player_list:
+            if not player.bet_id is None:
+                if betted_dict[player.bet_id] == most_betted:
+                    player.score -= (betted_dict[player.bet_id] - 1)
 
-            for player in self.__player_manager.player_list:
-                if not player.bet_id is None:
-                    if betted_dict[player.bet_id] == most_betted:
-                        player.score -= (betted_dict[player.bet_id] - 1)
-            
-        self.__player_manager.after_event.append(traffic_collision_inner)
-    
     def popular_player(self):
         self.log("-----------------------------------------------")
         self.log("Event: popular player")
         self.log("At the end of the turn, the player with the most bets targets gets 2*x points")
         self.log("        where x is the number of bets targets")
-        def popular_player_inner():
-            most_betted = -1
+        self.__player_manager.after_event.append(self.popular_player_end)
+
+    def popular_player_end(self):
+        most_betted = -1
+        for player in self.__player_manager.player_list:
+            if not player.betted is None and player.betted > most_betted:
+                most_betted = player.betted
+
+        if not most_betted is None:
             for player in self.__player_manager.player_list:
-                if not player.betted is None and player.betted > most_betted:
-                    most_betted = player.betted
-                    
-            if not most_betted is None:
-                for player in self.__player_manager.player_list:
-                    if player.betted == most_betted:
-                        player.score += 2 * most_betted
-        self.__player_manager.after_event.append(popular_player_inner)
+                if player.betted == most_betted:
+                    player.score += 2 * most_betted
 
     def see_you_next_time(self):
         self.log("-----------------------------------------------")
@@ -203,15 +262,16 @@ class RandomEvent:
         self.log("-----------------------------------------------")
         self.log("Event: be patient")
         self.log("All players with the lowest score get n points at end of the turn")
-        def be_patient_inner():
-            lowest_score = None
-            for player in self.__player_manager.player_list:
-                if lowest_score is None or player.score < lowest_score:
-                    lowest_score = player.score
-            for player in self.__player_manager.player_list:
-                if player.score == lowest_score:
-                    player.score += self.__player_manager.player_num
-        self.__player_manager.after_event.append(be_patient_inner)
+        self.__player_manager.after_event.append(self.be_patient_end)
+
+    def be_patient_end(self):
+        lowest_score = None
+        for player in self.__player_manager.player_list:
+            if lowest_score is None or player.score < lowest_score:
+                lowest_score = player.score
+        for player in self.__player_manager.player_list:
+            if player.score == lowest_score:
+                player.score += self.__player_manager.player_num
 
     def sing_along(self):
         self.log("-----------------------------------------------")
@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as _np
+from .event import RandomEvent
+from .player import PlayerManager
+from .utils import Logger, TrieNode
+from .vectorized import GameBatch
+
+# Differential fuzzing of the turn rules: random lobbies, bets, scores and event
+# sequences are played through the reference rules (PlayerManager + RandomEvent,
+# the way Game drives them) and through accelerated engines, and the final scores
+# must match exactly.
+#
+# A case is one game: player ids and, per turn, the drawn events and for every
+# player the bet target (index, -1 for no bet), the stake and the playing score.
+# Cases are generated in chunks of games with the same number of players and
+# turns, as arrays of shape (turns, games, ...), so that engines can take whole
+# chunks. Ids are random and of the same length: the list order, not the ids,
+# decides full ties (default_score_cmp returns a bool, which is never negative).
+
+_EVENT_NAMES = {}
+
+def event_names(game_type='arcaea'):
+    if not game_type in _EVENT_NAMES:
+        _EVENT_NAMES[game_type] = [event.__name__ for event in
+            RandomEvent(PlayerManager(), Logger.headless(), game_type).event]
+    return _EVENT_NAMES[game_type]
+
+
+class Chunk:
+    def __init__(self, game_type, ids, events, targets, stakes, scores):
+        self.game_type = game_type
+        self.ids = ids              # [games][players]
+        self.events = events        # (turns, games, 2) event indexes, -1 for none
+        self.targets = targets      # (turns, games, players)
+        self.stakes = stakes        # (turns, games, players)
+        self.scores = scores        # (turns, games, players)
+
+    @property
+    def games(self):
+        return len(self.ids)
+
+    def case(self, g:int, turns:int=None):
+        # game g (first turns only) as a chunk of its own
+        turns = len(self.events) if turns is None else turns
+        pick = lambda a: a[:turns, g:g+1]
+        return Chunk(self.game_type, self.ids[g:g+1], pick(self.events), pick(self.targets),
+            pick(self.stakes), pick(self.scores))
+
+    def to_json(self):
+        names = event_names(self.game_type)
+        return json.dumps({
+            'game_type': self.game_type,
+            'ids': self.ids,
+            'turns': [{
+                'events': [[names[e] for e in row if e >= 0] for row in self.events[t].tolist()],
+                'targets': self.targets[t].tolist(),
+                'stakes': self.stakes[t].tolist(),
+                'scores': self.scores[t].tolist(),
+            } for t in range(len(self.events))],
+        })
+
+
+def generate_chunk(rng:_np.random.Generator, games:int, game_type='arcaea'):
+    # lobby size, number of turns and the style of bets and scores vary per chunk
+    players = int(rng.choice([2, 2, 3, 3, 4, 4, 5, 6, 7, 8, 9, 10, 11, 12, 16, 30]))
+    turns = int(rng.integers(1, 9))
+    n_events = len(event_names(game_type))
+    letters = _np.array(list(string.ascii_lowercase))
+    ids = [[''.join(row) for row in rng.choice(letters, size=(players, 8))] for _ in range(games)]
+    for g in range(games):
+        while len(set(ids[g])) < players:
+            ids[g] = [''.join(rng.choice(letters, size=8)) for _ in range(players)]
+
+    shape = (turns, games, players)
+    # one or two distinct events per turn
+    first = rng.integers(0, n_events, size=(turns, games))
+    second = (first + rng.integers(1, n_events, size=(turns, games))) % n_events
+    events = _np.stack([first, _np.where(rng.random((turns, games)) < 0.3, second, -1)], axis=2)
+
+    # bets: nobody, some or everybody bets, sometimes all on the same player
+    p_bet = rng.choice([0.0, 0.3, 0.7, 1.0])
+    targets = (_np.arange(players) + rng.integers(1, players, size=shape)) % players
+    if rng.random() < 0.2:
+        favourite = rng.integers(0, players, size=(turns, games, 1))
+        other = (favourite + 1) % players
+        targets = _np.where(_np.arange(players) == favourite, other, favourite)
+    targets = _np.where(rng.random(shape) < p_bet, targets, -1)
+    # stakes outside [1, n] are clamped by Game.bet
+    stakes = rng.integers(-1, players + 3, size=shape)
+
+    # playing scores: few levels provoke ties, sometimes everybody ties
+    levels = int(rng.choice([1, 2, 3, 5, 1000]))
+    scores = 9000000 + 1000 * rng.integers(0, levels, size=shape)
+    return Chunk(game_type, ids, events, targets, stakes, scores)
+
+
+# engines: chunk -> final scores, (games, players) array in the order of chunk.ids
+
+class _Reference:
+    # PlayerManager + RandomEvent as Game drives them, reused between games
+    def __init__(self, game_type):
+        self.pm = PlayerManager()
+        self.event = RandomEvent(self.pm, Logger.headless(), game_type)
+
+    def play(self, ids, names, turn_inputs):
+        # a fresh enrollment: player_list in the order of ids
+        pm = self.pm
+        pm.player_list = []
+        pm.player_id_trie = TrieNode()
+        for id in ids:
+            pm.add_player(id)
+        players = list(pm.player_list)
+        n = len(players)
+        pm.reset_round()
+        for events, targets, stakes, scores in turn_inputs:
+            self.event.draw_event([names[e] for e in events if e >= 0])
+            # Game.bet and Game.play
+            for player, target, stake in zip(players, targets, stakes):
+                player.took_bet = True
+                if target >= 0:
+                    player.bet_id = ids[target]
+                    player.stake = max(min(stake, n), 1)
+                else:
+                    player.bet_id = None
+            for player, score in zip(players, scores):
+                pm.set_score(player, score)
+                player.played = True
+            pm.preprocess_bet_score()
+            pm.evaluate_playing_score()
+            pm.evaluate_bet_score()
+            pm.evaluate_end_event()
+            pm.reset_turn()
+        return [player.score for player in players]
+
+_references = {}
+
+def reference_engine(chunk:Chunk):
+    names = event_names(chunk.game_type)
+    if not chunk.game_type in _references:
+        _references[chunk.game_type] = _Reference(chunk.game_type)
+    reference = _references[chunk.game_type]
+    events = chunk.events.transpose(1, 0, 2).tolist()
+    targets = chunk.targets.transpose(1, 0, 2).tolist()
+    stakes = chunk.stakes.transpose(1, 0, 2).tolist()
+    scores = chunk.scores.transpose(1, 0, 2).tolist()
+    return _np.array([
+        reference.play(chunk.ids[g], names, zip(events[g], targets[g], stakes[g], scores[g]))
+        for g in range(chunk.games)], dtype=_np.int64)
+
+def vectorized_engine(chunk:Chunk):
+    batch = GameBatch(chunk.games, len(chunk.ids[0]), chunk.game_type, turns=len(chunk.events))
+    for t in range(len(chunk.events)):
+        batch.play_turn(chunk.targets[t], chunk.stakes[t], chunk.scores[t], chunk.events[t])
+    return batch.scores
+
+_games = {}
+
+def game_engine(chunk:Chunk):
+    # the whole Game state machine; slow, meant for a sample of the chunks
+    from .game import Game
+    names = event_names(chunk.game_type)
+    if not chunk.game_type in _games:
+        game = Game(chunk.game_type, turns=1, logger=Logger.headless())
+        game.enable_all()
+        game.add_quest([])
+        _games[chunk.game_type] = game
+    game = _games[chunk.game_type]
+    turns = len(chunk.events)
+    result = []
+    for g, ids in enumerate(chunk.ids):
+        for player in list(game.players):
+            game.remove(player.id)
+        for id in ids:
+            game.enroll(id)
+        game.reset_round(turns)
+        game.start()
+        for t in range(turns):
+            game.draw_event([names[e] for e in chunk.events[t, g].tolist() if e >= 0])
+            game.draw_quest()
+            game.verify()
+            for id, target, stake in zip(ids, chunk.targets[t, g].tolist(), chunk.stakes[t, g].tolist()):
+                game.bet(id, ids[target] if target >= 0 else None, stake)
+            for id, score in zip(ids, chunk.scores[t, g].tolist()):
+                game.play(id, score)
+            game.evaluate_preprocess()
+            game.evaluate_score()
+            game.evaluate_bet()
+            game.end_turn()
+        scores = {player.id: player.score for player in game.players}
+        result.append([scores[id] for id in ids])
+    return _np.array(result, dtype=_np.int64)
+
+ENGINES = {
+    'vectorized': vectorized_engine,
+    'game': game_engine,
+}
+
+
+def check_chunk(chunk:Chunk, engine, max_failures=3):
+    # failing cases, shrunk to the shortest failing prefix of turns, as JSON
+    expected = reference_engine(chunk)
+    got = engine(chunk)
+    failures = []
+    for g in _np.nonzero((expected != got).any(axis=1))[0].tolist()[:max_failures]:
+        turns = len(chunk.events)
+        for prefix in range(1, turns + 1):
+            case = chunk.case(g, prefix)
+            if (reference_engine(case) != engine(case)).any():
+                break
+        failures.append(case.to_json())
+    return failures
+
+
+def _run_chunk(engine_names, game_type, games, seed):
+    rng = _np.random.default_rng(seed)
+    chunk = generate_chunk(rng, games, game_type)
+    failures = []
+    for name in engine_names:
+        failures += [f'{name}: {case}' for case in check_chunk(chunk, ENGINES[name])]
+    return chunk.games, failures
+
+
+def fuzz(games=100000, engines=('vectorized',), game_type='arcaea', seed=0, chunk_size=1000, workers=1):
+    # returns (games checked, failures); chunks are independent seed streams of seed
+    seeds = _np.random.SeedSequence(seed).spawn(math.ceil(games / chunk_size))
+    sizes = [min(chunk_size, games - i * chunk_size) for i in range(len(seeds))]
+    args = [(list(engines), game_type, size, child) for size, child in zip(sizes, seeds)]
+    checked, failures = 0, []
+    if workers == 1:
+        results = (_run_chunk(*arg) for arg in args)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_run_chunk, *zip(*args))
+    for count, chunk_failures in results:
+        checked += count
+        failures += chunk_failures
+    if workers != 1:
+        executor.shutdown()
+    return checked, failures
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Differential fuzzing of accelerated engines against the reference rules')
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--engines', nargs='+', default=['vectorized'], choices=sorted(ENGINES))
+    parser.add_argument('--game-type', default='arcaea')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    checked, failures = fuzz(args.games, args.engines, args.game_type, args.seed, args.chunk_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f'{checked} games checked against {", ".join(args.engines)} in {elapsed:.1f}s ({checked/elapsed:.0f} games/s)')
+    for failure in failures:
+        print(failure)
+    if failures:
+        print(f'{len(failures)} mismatch(es)')
+        sys.exit(1)
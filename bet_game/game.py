@@ -2,8 +2,40 @@ from .player import PlayerManager
 from .song  import *
 from .quest import QuestPool
 from .event import RandomEvent
-from .utils import GameplayError, Logger
+from .instrument import Instrumentation
+from .utils import GameplayError, Logger, INFO, WARNING
 from functools import cmp_to_key
+from operator import attrgetter
+
+# metrics recorded by Game.enable_instrumentation: method name -> metric name
+_INSTRUMENTED_PHASES = {
+    'start': 'game.status_000.start',
+    'draw_event': 'game.status_100.draw_event',
+    'draw_quest': 'game.status_101.draw_quest',
+    'verify': 'game.status_102.verify',
+    'bet': 'game.status_103.bet',
+    'play': 'game.status_104.play',
+    'evaluate_preprocess': 'game.status_105.evaluate_preprocess',
+    'evaluate_score': 'game.status_106.evaluate_score',
+    'evaluate_bet': 'game.status_107.evaluate_bet',
+    'end_turn': 'game.status_108.end_turn',
+}
+_INSTRUMENTED_PLAYER_MANAGER = {
+    name: f'player_manager.{name}' for name in (
+        'find_player', 'add_player', 'remove_player', 'reset_turn', 'preprocess_bet_score',
+        'evaluate_playing_score', 'evaluate_bet_score', 'evaluate_end_event')
+}
+_INSTRUMENTED_QUEST_POOL = {
+    name: f'quest_pool.{name}' for name in (
+        'set_quest_list', 'set_table', 'set_weight', 'draw_quest', 'remove_quest', 'find_quest')
+}
+_INSTRUMENTED_LOGGER = {'log': 'logger.log', 'flush': 'logger.flush'}
+# player fields kept by the undo journal of the turn, per operation
+_BET_FIELDS = ('took_bet', 'bet_id', 'stake')
+_PLAY_FIELDS = ('played', 'playing_score')
+_EVALUATE_FIELDS = ('score', 'betted', 'rank', 'cur_pt', 'bet_reward')
+_ROW_GETTERS = {fields: attrgetter(*fields) for fields in (_BET_FIELDS, _PLAY_FIELDS, _EVALUATE_FIELDS)}
+_COLUMN_GETTERS = {field: attrgetter(field) for field in _BET_FIELDS + _PLAY_FIELDS + _EVALUATE_FIELDS}
 
 class Game:
     STATUS_000_UNAVAILABLE = 0
@@ -18,21 +50,83 @@ class Game:
     STATUS_108_END_TURN = 108
     STATUS_200_FINISHED = 200
 
-    def __init__(self, game_type='arcaea', turns=5):
+    def __init__(self, game_type='arcaea', turns=5, logger:Logger=None, journal=None, seed=None, catalog=None, history=None, pool_cache=None):
         self.__game_type = game_type
         if self.__game_type == "arcaea":
-            self.song_manager = ArcaeaSongPackageManager()
+            self.song_manager = ArcaeaSongPackageManager(catalog)
         elif self.__game_type == "phigros":
-            self.song_manager = PhigrosSongPackageManager()
+            self.song_manager = PhigrosSongPackageManager(catalog)
         else:
             raise GameplayError("Currently Only Support arcaea and phigros")
         self.__play_manager = PlayerManager()
-        self.__quest_pool = QuestPool()
-        self.__logger = Logger()
-        self.__random_event = RandomEvent(self.__play_manager, logger=self.__logger, game_type=game_type)
+        self.__quest_pool = QuestPool(seed=seed)
+        self.__quest_config = None
+        self.__quest_view = None        # QuestView the quest pool was built from
+        self.__quest_weights = None     # level -> weight
+        self.__banned = None            # song keys
+        self.__pool_cache = pool_cache  # QuestPoolCache of prebuilt pools
+        self.__logger = logger if logger else Logger()
+        self.__random_event = RandomEvent(self.__play_manager, logger=self.__logger, game_type=game_type, seed=seed)
 
         self.__turns = turns
-        self.reset_round(turns)
+        self.player_num = 0
+        self.__journal = None
+        self.__history = history
+        self.__instrumentation = None
+        self.__feed = None              # SpectatorFeed, started by the first subscribe
+        self.__profiler = None          # MemoryProfiler tracking this game
+        self.__closed = False
+        self.__undo = []                # (op, fields, state before) of the turn, see __turn_state
+        self.__redo = []                # (undo entry, state after)
+        self.__reset_round(turns)
+
+        if journal:
+            self.set_journal(journal)
+            journal.record('game', game_type, turns, seed)
+
+    @property
+    def game_type(self):
+        return self.__game_type
+
+    @property
+    def status(self):
+        return self.__status
+
+    @property
+    def turn(self):
+        return self.__cur_turn
+
+    @property
+    def turns(self):
+        return self.__turns
+
+    @property
+    def players(self):
+        # read only view for bots and tools, use enroll/bet/play to change players
+        return self.__play_manager.player_list
+
+    @property
+    def effects(self):
+        # pending effects of the events of this turn, see RandomEvent.get_effects
+        return self.__random_event.get_effects()
+
+    @property
+    def events(self):
+        # names of the events drawn this turn
+        return self.__events
+
+    @property
+    def current_quest(self):
+        return self.__current_quest
+
+    @property
+    def quest_pool(self):
+        return self.__quest_pool
+
+    def seed(self, seed):
+        self.__random_event.rng.seed(seed)
+        self.__quest_pool.seed(seed)
+        self.record('seed', seed)
 
     @property
     def finished(self):
@@ -58,6 +152,11 @@ class Game:
             return ""
 
     def reset_round(self, turn):
+        self.__reset_round(turn)
+        self.record('reset_round', turn)
+        self.__publish('reset_round')
+
+    def __reset_round(self, turn):
         self.__turns = turn
         self.__cur_turn = 1
         self.__winner = None
@@ -69,11 +168,204 @@ class Game:
     def reset_turn(self):
         self.__play_manager.reset_turn()
         self.__current_quest = None
+        self.__events = []
         self.__bet_num = 0
         self.__gameplay_num = 0
+        self.__undo.clear()
+        self.__redo.clear()
+
+    @property
+    def logger(self):
+        return self.__logger
+
+    def log(self, s, file=True, level=INFO):
+        self.__logger.log(s, file, level)
+
+    def flush_log(self):
+        self.__logger.flush()
+
+    @property
+    def instrumentation(self):
+        return self.__instrumentation
+
+    def enable_instrumentation(self, instrumentation:Instrumentation=None):
+        # time every phase and the hot calls of the player manager, quest pool and
+        # logger; an Instrumentation can be shared to aggregate several games
+        self.disable_instrumentation()
+        self.__instrumentation = instrumentation if instrumentation else Instrumentation()
+        self.__instrumentation.wrap(self, _INSTRUMENTED_PHASES)
+        self.__instrumentation.wrap(self.__play_manager, _INSTRUMENTED_PLAYER_MANAGER)
+        self.__instrumentation.wrap(self.__quest_pool, _INSTRUMENTED_QUEST_POOL)
+        self.__instrumentation.wrap(self.__logger, _INSTRUMENTED_LOGGER)
+        return self.__instrumentation
+
+    def disable_instrumentation(self):
+        if self.__instrumentation:
+            self.__instrumentation.unwrap(self, self.__play_manager, self.__quest_pool, self.__logger)
+            self.__instrumentation = None
 
-    def log(self, s:str, file=True):
-        self.__logger.log(s, file)
+    @property
+    def profiler(self):
+        return self.__profiler
+
+    def enable_profiling(self, profiler=None):
+        # memory use of the subsystems of this game and leak detection, see
+        # memory.py; a MemoryProfiler can be shared to watch several games
+        self.disable_profiling()
+        if profiler is None:
+            from .memory import MemoryProfiler
+            profiler = MemoryProfiler()
+        self.__profiler = profiler
+        self.__profiler.track(self)
+        return self.__profiler
+
+    def disable_profiling(self):
+        if self.__profiler:
+            self.__profiler.untrack(self)
+            self.__profiler = None
+
+    def memory_roots(self):
+        # subsystem -> objects owning its memory, for MemoryProfiler.measure
+        return {
+            'catalog': self.song_manager,
+            'quest_pool': self.__quest_pool,
+            'players': self.__play_manager,
+            'events': self.__random_event,
+            'logger': self.__logger,
+            'feed': self.__feed,
+            'undo': (self.__undo, self.__redo),
+        }
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def close(self):
+        # release what a game would otherwise keep until it is garbage collected:
+        # the log file and writer thread, the spectator feed (which references the
+        # game) and the effects pending in after_event; not playable afterwards
+        if self.__closed:
+            return
+        self.__closed = True
+        self.disable_instrumentation()
+        if self.__feed:
+            self.__feed.close()
+            self.__feed = None
+        self.__play_manager.after_event.clear()
+        self.__undo.clear()
+        self.__redo.clear()
+        self.__logger.close()
+        if self.__profiler:
+            self.__profiler.closed(self)
+
+    @property
+    def journal(self):
+        return self.__journal
+
+    def set_journal(self, journal):
+        self.__journal = journal
+
+    @property
+    def history(self):
+        return self.__history
+
+    def set_history(self, history):
+        # history: HistoryStore receiving the results of every turn and game
+        self.__history = history
+
+    @property
+    def pool_cache(self):
+        return self.__pool_cache
+
+    def set_pool_cache(self, pool_cache):
+        # pool_cache: QuestPoolCache shared by games with the same catalog
+        self.__pool_cache = pool_cache
+
+    def record(self, op, *args):
+        if self.__journal:
+            self.__journal.record(op, *args)
+
+    @property
+    def feed(self):
+        return self.__feed
+
+    def subscribe(self, callback=None):
+        # spectator of the game: a Subscription to poll, or callback(message)
+        # with the encoded snapshot and then every diff, see spectate.py
+        if self.__feed is None or self.__feed.closed:
+            # imported on the first subscriber, like numpy by the quest pool
+            from .spectate import SpectatorFeed
+            self.__feed = SpectatorFeed(self)
+        return self.__feed.subscribe(callback)
+
+    def __publish(self, op, players=None):
+        if self.__feed:
+            self.__feed.publish(op, players)
+
+    # Snapshot of the whole game state as plain data (JSON compatible), including the
+    # pending event effects and the RNG states. The quest pool is stored as its
+    # configuration plus the quests removed since then; restoring into a game with the
+    # same configuration only filters the pool, otherwise the pool is rebuilt.
+    def snapshot(self):
+        return {
+            'game_type': self.__game_type,
+            'status': self.__status,
+            'turns': self.__turns,
+            'cur_turn': self.__cur_turn,
+            'winner': self.__winner,
+            'player_num': self.player_num,
+            'bet_num': self.__bet_num,
+            'gameplay_num': self.__gameplay_num,
+            'players': self.__play_manager.get_players(),
+            'effects': self.__random_event.get_effects(),
+            'quest_config': self.__quest_config,
+            'removed_quests': self.__quest_pool.removed_quests,
+            'quest': None if self.__current_quest is None else self.__current_quest.description,
+            'events': self.__events,
+            'rng': [self.__random_event.get_rng_state(), self.__quest_pool.get_rng_state()],
+        }
+
+    def restore(self, state:dict):
+        if state['game_type'] != self.__game_type:
+            raise GameplayError(f'Cannot restore a {state["game_type"]} game into a {self.__game_type} game')
+        if state['quest_config'] != self.__quest_config:
+            self.__set_quest_config(state['quest_config'])
+        self.__quest_pool.set_removed_quests(state['removed_quests'])
+        if state['quest'] is None:
+            self.__current_quest = None
+        else:
+            # the current quest may have been banned after it was drawn
+            self.__current_quest = self.__quest_pool.find_quest(state['quest'], weighted=False)
+
+        self.__events = list(state.get('events', []))
+        self.__undo.clear()
+        self.__redo.clear()
+        self.__status = state['status']
+        self.__turns = state['turns']
+        self.__cur_turn = state['cur_turn']
+        self.__winner = state['winner']
+        self.player_num = state['player_num']
+        self.__bet_num = state['bet_num']
+        self.__gameplay_num = state['gameplay_num']
+        self.__play_manager.set_players(state['players'])
+        self.__play_manager.reset_turn_effects()
+        self.__random_event.set_effects(state['effects'])
+        event_rng, quest_rng = state['rng']
+        self.__random_event.set_rng_state(event_rng)
+        self.__quest_pool.set_rng_state(quest_rng)
+        self.__publish('restore')
+
+    def __set_quest_config(self, config):
+        if config is None:
+            self.__quest_config = None
+            self.__quest_view = None
+            self.__quest_pool.set_quest_list([])
+            return
+        self.song_manager.disable_all_packages()
+        self.song_manager.disable_all_difficulties()
+        for pac in config['packages'] + config['difficulties']:
+            self.song_manager.enable(pac)
+        self.__add_quest(config['quests'])
 
     # helper function
     def check_status(self, status):
@@ -83,31 +375,124 @@ class Game:
     # player and init
     def enroll(self, id:str):
         self.__play_manager.add_player(id)
+        self.__undo.clear()
+        self.__redo.clear()
+        self.record('enroll', id)
+        self.__publish('enroll')
 
     def remove(self, id:str):
         self.__play_manager.remove_player(id)
+        self.__undo.clear()
+        self.__redo.clear()
+        self.record('remove', id)
+        self.__publish('remove')
 
     def add_quest(self, quest_list:list):
-        cur_quest_list = self.song_manager.add_quest_list(quest_list)
-        self.__quest_pool.set_quest_list(cur_quest_list)
+        self.__add_quest(quest_list)
+        self.record('add_quest', quest_list)
+
+    def __add_quest(self, quest_list:list):
+        # the pool holds every song of the view, songs that are not configured
+        # weigh 0, so that weights and bans can be changed slot by slot
+        config = {
+            'packages': sorted(self.song_manager.available_packages),
+            'difficulties': sorted(self.song_manager.available_difficulties),
+            'quests': list(quest_list),
+        }
+        cache = self.__pool_cache
+        table = None
+        if cache:
+            version = self.song_manager.catalog.version
+            table = cache.get(self.__game_type, version, config)
+        if table is None:
+            view = self.song_manager.quest_view()
+            weights, banned = self.song_manager.quest_config(view.levels, quest_list)
+            self.__quest_view = view
+            self.__quest_weights = weights
+            self.__banned = banned
+            self.__quest_pool.set_quest_list(view.quests, view.weights(weights, banned))
+            if cache:
+                cache.put(self.__game_type, version, config, self.__quest_pool.get_table())
+        else:
+            # the view, weights and bans are only needed to change the configuration
+            self.__quest_pool.set_table(*table)
+            self.__quest_view = None
+        self.__quest_config = config
+
+    def __quest_state(self):
+        if self.__quest_config is None:
+            raise GameplayError('No quests yet, please add quests first')
+        if self.__quest_view is None:
+            config = self.__quest_config
+            view = self.song_manager.quest_view(config['packages'], config['difficulties'])
+            self.__quest_weights, self.__banned = self.song_manager.quest_config(view.levels, config['quests'])
+            self.__quest_view = view
+        return self.__quest_view
+
+    def __slot_weight(self, slot):
+        if self.__quest_view.key(slot) in self.__banned:
+            return 0.0
+        return self.__quest_weights.get(self.__quest_view.level(slot), 0.0)
+
+    def __update_quests(self, args:list):
+        # apply quest args (see add_quest) on top of the current configuration,
+        # re-weighting only the songs of the changed levels and bans
+        view = self.__quest_state()
+        weights, banned = self.song_manager.quest_config(self.__quest_weights, args, self.__banned)
+        slots = set()
+        for level in set(weights) | set(self.__quest_weights):
+            if weights.get(level) != self.__quest_weights.get(level):
+                slots.update(view.by_level.get(level, ()))
+        for key in banned ^ self.__banned:
+            slots.update(view.by_song.get(key, ()))
+        self.__quest_weights = weights
+        self.__banned = banned
+        for slot in sorted(slots):
+            self.__quest_pool.set_weight(slot, self.__slot_weight(slot))
+        # the configuration of the snapshots stays one arg per changed level and ban
+        quests = []
+        for level in sorted(level for level in set(weights) | set(view.levels) if level is not None):
+            if weights.get(level, 0.0) != view.levels.get(level):
+                quests += [level, weights.get(level, 0.0)]
+        for key in sorted(banned):
+            quests += ['ban', key]
+        self.__quest_config = dict(self.__quest_config, quests=quests)
+
+    def set_quest_weight(self, level, weight:float):
+        # weight 0 takes the level out of the pool
+        self.__update_quests([level, weight])
+        self.record('set_quest_weight', level, weight)
+
+    def ban_quest(self, song:str):
+        # song: song id (arcaea) or song name (phigros)
+        self.__update_quests(['ban', song])
+        self.record('ban_quest', song)
+
+    def unban_quest(self, song:str):
+        self.__update_quests(['unban', song])
+        self.record('unban_quest', song)
 
     def enable_all(self, en_package=True, en_difficulties=True):
         if en_package:
             self.song_manager.enable_all_packages()
         if en_difficulties:
             self.song_manager.enable_all_difficulties()
+        self.record('enable_all', en_package, en_difficulties)
 
     def disable_all(self, dis_package=True, dis_difficulties=True):
         if dis_package:
             self.song_manager.disable_all_packages()
         if dis_difficulties:
             self.song_manager.disable_all_difficulties()
+        self.record('disable_all', dis_package, dis_difficulties)
 
     def enable(self, pac:str):
         self.song_manager.enable(pac)
+        self.record('enable', pac)
 
     def disable(self, pac:str):
         self.song_manager.disable(pac)
+        self.record('disable', pac)
 
     # game play
     def start(self):
@@ -117,16 +502,36 @@ class Game:
         if self.player_num < 2:
             raise GameplayError("At least two players are needed!")
         self.__status = self.STATUS_100_DRAW_EVENT
-        self.log(f'Starting {self.__game_type} game with {self.__turns} turns.')
-
-    def draw_event(self):
+        self.record('start')
+        if self.__journal:
+            self.__journal.start(self)
+        self.__publish('start')
+        self.log(lambda: f'Starting {self.__game_type} game with {self.__turns} turns.')
+
+    def draw_event(self, events:list=None, drawn=False):
+        # events: names of the events to apply instead of a random draw (replay)
+        # drawn: the events were drawn at random, they are drawn again so that the
+        # RNG advances as it did (replay from a snapshot of the RNG)
         self.check_status(self.STATUS_100_DRAW_EVENT)
-        self.__random_event.draw_event()
+        drawn = drawn or events is None
+        if drawn:
+            names = self.__random_event.draw_event()
+            if events is not None and names != events:
+                raise GameplayError(f'Drew the events {names} instead of {events}')
+            events = names
+        else:
+            events = self.__random_event.draw_event(events)
+        self.__events = events
         self.__status = self.STATUS_101_DRAW_QUEST
+        self.record('draw_event', events, drawn)
+        self.__publish('draw_event')
         self.log(f'-----------------------------------------------', False)
         self.log(f'Plaese start to draw the quest', False)
+        return events
 
-    def draw_quest(self):
+    def draw_quest(self, quest:str=None, drawn=False):
+        # quest: description of the quest to take instead of a random draw (replay)
+        # drawn: as for draw_event
         if self.__status == self.STATUS_102_VERIFY:
             if self.__bet_num > 0:
                 raise GameplayError(f'Cannot redraw quests. Some players have already bet')
@@ -136,18 +541,29 @@ class Game:
             self.check_status(self.STATUS_101_DRAW_QUEST)
             redraw = False
 
-        self.__current_quest = self.__quest_pool.draw_quest()
+        drawn = drawn or quest is None
+        if drawn:
+            self.__current_quest = self.__quest_pool.draw_quest()
+            if quest is not None and self.__current_quest.description != quest:
+                raise GameplayError(f'Drew the quest {self.__current_quest.description} instead of {quest}')
+        else:
+            self.__current_quest = self.__quest_pool.find_quest(quest)
         self.__status = self.STATUS_102_VERIFY
+        self.record('draw_quest', self.__current_quest.description, drawn)
+        self.__publish('draw_quest')
 
         self.log(f'-----------------------------------------------', False)
         if redraw:
-            self.log(f'Redrawing quest: {self.__current_quest.description}.', False)
+            self.log(lambda: f'Redrawing quest: {self.__current_quest.description}.', False)
         else:
-            self.log(f'Drawing quest: {self.__current_quest.description}.', False)
+            self.log(lambda: f'Drawing quest: {self.__current_quest.description}.', False)
+        return self.__current_quest.description
 
     def verify(self):
         self.check_status(self.STATUS_102_VERIFY)
         self.__status = self.STATUS_103_BET
+        self.record('verify')
+        self.__publish('verify')
 
     def bet(self, player_id, bet_id, stake=1):
         if self.__status == self.STATUS_104_PLAY:
@@ -157,69 +573,200 @@ class Game:
             self.check_status(self.STATUS_103_BET)
     
         player = self.__play_manager.find_player(player_id)
+        bet_player = self.__play_manager.find_player(bet_id) if bet_id else None
+        if bet_player and bet_player.id == player.id:
+            raise GameplayError(f'Cannoe bet oneself: {bet_player.id}')
+        before = self.__turn_state(_BET_FIELDS, (player,))
         if not player.took_bet:
             self.__bet_num += 1
             player.took_bet = True
 
-        if bet_id:
-            bet_player = self.__play_manager.find_player(bet_id)
-            if (bet_player.id == player.id):
-                raise GameplayError(f'Cannoe bet oneself: {bet_player.id}')
+        if bet_player:
             player.bet_id = bet_player.id
             player.stake = max(min(stake, self.player_num), 1)
         else:
             player.bet_id = None
+        self.record('bet', player.id, player.bet_id, player.stake if player.bet_id else None)
 
-
-        
         if self.__bet_num == self.player_num:
             self.__status = self.STATUS_104_PLAY
             self.log(f'All players\' bet are set', False)
+        self.__push_undo('bet', _BET_FIELDS, before)
+        self.__publish('bet', (player,))
 
     def play(self, player_id, score):
         if (self.__status != self.STATUS_105_PREPROCESS):
             self.check_status(self.STATUS_104_PLAY)
         player = self.__play_manager.find_player(player_id)
+        before = self.__turn_state(_PLAY_FIELDS, (player,))
         self.__play_manager.set_score(player, score)
         if not player.played:
             player.played = True
             self.__gameplay_num += 1
-        
+        self.record('play', player.id, score)
+
         if self.__gameplay_num == self.player_num:
             self.__status = self.STATUS_105_PREPROCESS
             self.log(f'All players\' playing score are set', False)
+        self.__push_undo('play', _PLAY_FIELDS, before)
+        self.__publish('play', (player,))
 
     def evaluate_preprocess(self):
         self.check_status(self.STATUS_105_PREPROCESS)
+        before = self.__turn_state(_EVALUATE_FIELDS, tuple(self.__play_manager.player_list), order=True)
         self.__play_manager.preprocess_bet_score()
-        self.log(str(self))
+        self.log(self.__str__)
         self.__status = self.STATUS_106_EVALUATE_SCORE
+        self.record('evaluate_preprocess')
+        self.__push_undo('evaluate_preprocess', _EVALUATE_FIELDS, before)
+        self.__publish('evaluate_preprocess')
 
     def evaluate_score(self):
         self.check_status(self.STATUS_106_EVALUATE_SCORE)
+        before = self.__turn_state(_EVALUATE_FIELDS, tuple(self.__play_manager.player_list), order=True)
         self.__play_manager.evaluate_playing_score()
-        self.log(str(self))
+        self.log(self.__str__)
         self.__status = self.STATUS_107_EVALUATE_BET
+        self.record('evaluate_score')
+        self.__push_undo('evaluate_score', _EVALUATE_FIELDS, before)
+        self.__publish('evaluate_score')
 
     def evaluate_bet(self):
         self.check_status(self.STATUS_107_EVALUATE_BET)
+        before = self.__turn_state(_EVALUATE_FIELDS, tuple(self.__play_manager.player_list), order=True)
         self.__play_manager.evaluate_bet_score()
-        self.log(str(self))
+        self.log(self.__str__)
         self.__status = self.STATUS_108_END_TURN
+        self.record('evaluate_bet')
+        self.__push_undo('evaluate_bet', _EVALUATE_FIELDS, before)
+        self.__publish('evaluate_bet')
+
+    def expire(self, default_score=0):
+        # the deadline of the phase passed (see deadline.py): the missing bets are
+        # None; the missing scores are default_score and the turn is evaluated and
+        # ended, as it is when the evaluation itself is late. Made of the regular
+        # operations, so that the journal replays it as is. Returns the ids of the
+        # players that got the default bet or score.
+        # An evaluation phase (105 to 108) goes on from where it stopped; the other
+        # statuses wait on nobody (draws, verify, finished game) and are left as is.
+        missing = []
+        status = self.__status
+        if status == self.STATUS_103_BET:
+            for player in list(self.__play_manager.player_list):
+                if not player.took_bet:
+                    missing.append(player.id)
+                    self.bet(player.id, None)
+            return missing
+        if status == self.STATUS_104_PLAY:
+            for player in list(self.__play_manager.player_list):
+                if not player.played:
+                    missing.append(player.id)
+                    self.play(player.id, default_score)
+        elif not self.STATUS_105_PREPROCESS <= status <= self.STATUS_108_END_TURN:
+            return missing
+        if self.__status == self.STATUS_105_PREPROCESS:
+            self.evaluate_preprocess()
+        if self.__status == self.STATUS_106_EVALUATE_SCORE:
+            self.evaluate_score()
+        if self.__status == self.STATUS_107_EVALUATE_BET:
+            self.evaluate_bet()
+        self.end_turn()
+        return missing
+
+    # Undo journal of the turn: an operation keeps the fields it changes of the
+    # players it touches, so bets and scores take O(1) to undo and redo; the
+    # evaluation phases touch every player and the order of the player list,
+    # which they sort. The state to redo is taken when undoing, as nothing can
+    # change it before the redo. The journal starts again with every turn.
+    def __turn_state(self, fields, players, order=False):
+        # values: field by field, player by player (flat, to keep the phases cheap)
+        if len(players) == 1:
+            values = _ROW_GETTERS[fields](players[0])
+        else:
+            values = []
+            for field in fields:
+                values.extend(map(_COLUMN_GETTERS[field], players))
+        return (players, values, order, self.__bet_num, self.__gameplay_num, self.__status)
+
+    def __set_turn_state(self, fields, state):
+        players, values, order, self.__bet_num, self.__gameplay_num, self.__status = state
+        n = len(players)
+        for i, field in enumerate(fields):
+            for player, value in zip(players, values[i*n:(i+1)*n]):
+                setattr(player, field, value)
+        if order:
+            self.__play_manager.player_list = list(players)
+
+    def __push_undo(self, op, fields, before):
+        self.__undo.append((op, fields, before))
+        if self.__redo:
+            self.__redo.clear()
+
+    @property
+    def undo_ops(self):
+        # operations that undo would take back, latest last
+        return [entry[0] for entry in self.__undo]
+
+    def undo(self):
+        # take back the latest bet, score or evaluation phase of the turn
+        if not self.__undo:
+            raise GameplayError('Nothing to undo in this turn')
+        entry = op, fields, before = self.__undo.pop()
+        after = self.__turn_state(fields, tuple(self.__play_manager.player_list) if before[2] else before[0], before[2])
+        self.__set_turn_state(fields, before)
+        self.__redo.append((entry, after))
+        self.record('undo')
+        self.__publish('undo', None if before[2] else before[0])
+        self.log(f'Undo {op}', False)
+        return op
+
+    def redo(self):
+        if not self.__redo:
+            raise GameplayError('Nothing to redo')
+        entry, after = self.__redo.pop()
+        self.__set_turn_state(entry[1], after)
+        self.__undo.append(entry)
+        self.record('redo')
+        self.__publish('redo', None if after[2] else after[0])
+        self.log(f'Redo {entry[0]}', False)
+        return entry[0]
+
+    def rollback(self, status:int):
+        # undo everything done in the turn since the game reached status, e.g.
+        # STATUS_105_PREPROCESS takes back the evaluations to correct a score
+        ops = []
+        while self.__undo and self.__undo[-1][2][5] >= status:
+            ops.append(self.undo())
+        return ops
 
     def end_turn(self):
         self.check_status(self.STATUS_108_END_TURN)
         self.__play_manager.evaluate_end_event()
+        if self.__history:
+            # only buffered, written below once the turn is over
+            self.__history.record_turn(self)
         self.reset_turn()
-        self.log(str(self))
+        self.record('end_turn')
+        self.log(self.__str__)
         self.__cur_turn += 1
         if self.__cur_turn > self.__turns:
             self.__status = self.STATUS_200_FINISHED
             self.log(f'-----------------------------------------------')
-            self.log(f'The game is over. Congrats to the winner:{self.winner}!')
+            self.log(lambda: f'The game is over. Congrats to the winner:{self.winner}!')
             self.log(f'-----------------------------------------------')
         else:
             self.__status = self.STATUS_100_DRAW_EVENT
+        if self.__journal:
+            self.__journal.end_turn(self)
+        self.__publish('end_turn')
+        if self.__history:
+            # the turn has ended whatever happens to the store, the rows it could
+            # not write are kept for its next write
+            try:
+                self.__history.write_turn(self)
+            except Exception as e:
+                self.log(f'History not written: {type(e).__name__}: {e}', False, WARNING)
+        self.__logger.flush()
 
     def __str__(self):
         turn = f'-----------------------------------------------\n'
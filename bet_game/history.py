@@ -0,0 +1,245 @@
+import json
+import sqlite3
+import time
+import weakref
+from .utils import GameplayError
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    game_type TEXT NOT NULL,
+    turns INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    winner TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    game_id INTEGER NOT NULL,
+    turn INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    quest TEXT,
+    events TEXT NOT NULL,
+    playing_score INTEGER,
+    rank INTEGER,
+    points INTEGER,
+    bet_id TEXT,
+    stake INTEGER,
+    bet_reward INTEGER,
+    betted INTEGER,
+    score INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_player ON turns (player, game_id);
+CREATE INDEX IF NOT EXISTS turns_quest ON turns (quest);
+CREATE INDEX IF NOT EXISTS turns_game ON turns (game_id, turn);
+CREATE TABLE IF NOT EXISTS ratings (
+    player TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL,
+    wins REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS head_to_head (
+    player TEXT NOT NULL,
+    opponent TEXT NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    PRIMARY KEY (player, opponent)
+);
+'''
+
+class _Round:
+    # the games row of a round, id once it is written
+    __slots__ = ('id', 'row')
+
+    def __init__(self, row):
+        self.id = None
+        self.row = row
+
+
+class HistoryStore:
+    # SQLite store of turn results, ratings and head-to-head records.
+    # Game.end_turn hands over whole turns: the games row of a new round and the
+    # turn rows are buffered and written with one executemany per batch_turns
+    # turns, in one transaction; a finished game is written with the rest of the
+    # buffer, its ratings and head-to-head stats in one transaction as well.
+    # Nothing is dropped when a write fails, the next one retries it.
+    # A store is meant to be shared by all lobbies of a process; several
+    # processes may share the file (WAL mode, ratings are read inside the
+    # transaction that updates them).
+    INITIAL_RATING = 1500.0
+    K = 32.0
+
+    def __init__(self, path=':memory:', batch_turns=16, timeout=30.0):
+        self.__db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        if path != ':memory:':
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.executescript(_SCHEMA)
+        self.batch_turns = batch_turns
+        self.__pending = []         # (round, turn row without the game id) not written yet
+        self.__pending_turns = 0
+        self.__finished = []        # (round, finished, winner, scores, winners) not written yet
+        self.__rounds = weakref.WeakKeyDictionary()     # Game -> _Round of its current round
+
+    @property
+    def db(self):
+        return self.__db
+
+    def game_id(self, game):
+        self.flush()
+        round = self.__rounds.get(game)
+        return None if round is None else round.id
+
+    def record_turn(self, game):
+        # called by Game.end_turn before the players are reset for the next turn,
+        # only buffers the turn (see write_turn)
+        if game.turn == 1 or not game in self.__rounds:
+            self.__rounds[game] = _Round((game.game_type, game.turns, len(game.players), time.time()))
+        round = self.__rounds[game]
+        quest = None if game.current_quest is None else game.current_quest.description
+        events = json.dumps(game.events)
+        turn = game.turn
+        self.__pending.extend(
+            (round, (turn, p.id, quest, events, p.playing_score, p.rank, p.cur_pt,
+                p.bet_id, p.stake if p.bet_id else None, p.bet_reward, p.betted, p.score))
+            for p in game.players)
+        self.__pending_turns += 1
+
+    def write_turn(self, game):
+        # called by Game.end_turn once the turn is over: writes the buffer when it
+        # is full or the game is over
+        if game.finished:
+            self.end_game(game)
+        elif self.__pending_turns >= self.batch_turns:
+            self.flush()
+
+    def flush(self):
+        if not self.__pending and not self.__finished:
+            return
+        written = []
+        try:
+            with self.__transaction():
+                self.__write(written)
+        except BaseException:
+            # rolled back, the rounds are inserted again by the next write
+            for round in written:
+                round.id = None
+            raise
+        self.__pending = []
+        self.__pending_turns = 0
+        self.__finished = []
+
+    def __write(self, written:list):
+        rows = []
+        for round, row in self.__pending:
+            if round.id is None:
+                round.id = self.__db.execute(
+                    'INSERT INTO games (game_type, turns, players, started) VALUES (?, ?, ?, ?)', round.row).lastrowid
+                written.append(round)
+            rows.append((round.id, *row))
+        self.__db.executemany('INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        for round, finished, winner, scores, winners in self.__finished:
+            if round is not None and round.id is not None:
+                self.__db.execute('UPDATE games SET finished = ?, winner = ? WHERE id = ?', (finished, winner, round.id))
+            self.__update_ratings(scores, winners)
+
+    def end_game(self, game):
+        # called by Game.end_turn when the game is over
+        self.__finished.append((self.__rounds.pop(game, None), time.time(), game.winner,
+            {p.id: p.score for p in game.players}, game.winner.split(', ')))
+        self.flush()
+
+    def __transaction(self):
+        return _Transaction(self.__db)
+
+    def __update_ratings(self, scores:dict, winners:list):
+        # multiplayer Elo: every pair of players is one match decided by the final
+        # score, the rating change is scaled by 1 / (n - 1)
+        ids = list(scores)
+        n = len(ids)
+        if n < 2:
+            return
+        placeholders = ', '.join('?' * n)
+        ratings = {id: self.INITIAL_RATING for id in ids}
+        for id, rating in self.__db.execute(
+                f'SELECT player, rating FROM ratings WHERE player IN ({placeholders})', ids):
+            ratings[id] = rating
+        delta = {id: 0.0 for id in ids}
+        matches = []
+        for i, a in enumerate(ids):
+            for b in ids[i+1:]:
+                expected = 1 / (1 + 10 ** ((ratings[b] - ratings[a]) / 400))
+                if scores[a] > scores[b]:
+                    actual, result = 1.0, (1, 0, 0)
+                elif scores[a] < scores[b]:
+                    actual, result = 0.0, (0, 1, 0)
+                else:
+                    actual, result = 0.5, (0, 0, 1)
+                delta[a] += actual - expected
+                delta[b] -= actual - expected
+                matches.append((a, b, *result))
+                matches.append((b, a, result[1], result[0], result[2]))
+        share = 1 / len(winners)
+        self.__db.executemany(
+            'INSERT INTO ratings (player, rating, games, wins) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (player) DO UPDATE SET rating = excluded.rating, '
+            'games = games + 1, wins = wins + excluded.wins',
+            [(id, ratings[id] + self.K * delta[id] / (n - 1), share if id in winners else 0.0) for id in ids])
+        self.__db.executemany(
+            'INSERT INTO head_to_head (player, opponent, wins, losses, draws) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (player, opponent) DO UPDATE SET wins = wins + excluded.wins, '
+            'losses = losses + excluded.losses, draws = draws + excluded.draws',
+            matches)
+
+    # queries
+    def rating(self, player:str):
+        row = self.__db.execute('SELECT rating, games, wins FROM ratings WHERE player = ?', (player,)).fetchone()
+        if row is None:
+            return self.INITIAL_RATING, 0, 0.0
+        return row
+
+    def leaderboard(self, limit=10):
+        return self.__db.execute(
+            'SELECT player, rating, games, wins FROM ratings ORDER BY rating DESC LIMIT ?', (limit,)).fetchall()
+
+    def head_to_head(self, player:str, opponent:str):
+        row = self.__db.execute('SELECT wins, losses, draws FROM head_to_head WHERE player = ? AND opponent = ?',
+            (player, opponent)).fetchone()
+        return row if row else (0, 0, 0)
+
+    def player_turns(self, player:str, limit=20):
+        # latest turns of a player: (game id, turn, quest, playing score, rank, bet reward, score)
+        self.flush()
+        return self.__db.execute(
+            'SELECT game_id, turn, quest, playing_score, rank, bet_reward, score FROM turns '
+            'WHERE player = ? ORDER BY game_id DESC, turn DESC LIMIT ?', (player, limit)).fetchall()
+
+    def song_stats(self, quest:str):
+        # (times played, mean playing score, best playing score, best player) of a quest
+        self.flush()
+        count, mean, best = self.__db.execute(
+            'SELECT COUNT(*), AVG(playing_score), MAX(playing_score) FROM turns WHERE quest = ?', (quest,)).fetchone()
+        if not count:
+            raise GameplayError(f'No history for quest: {quest}')
+        player = self.__db.execute('SELECT player FROM turns WHERE quest = ? AND playing_score = ? LIMIT 1',
+            (quest, best)).fetchone()[0]
+        return count, mean, best, player
+
+    def close(self):
+        self.flush()
+        self.__db.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE ... COMMIT / ROLLBACK on a connection in autocommit mode
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        return False
@@ -0,0 +1,142 @@
+import json
+import time
+
+class Histogram:
+    # call count and wall time, bucketed log-linearly: every power of two of
+    # nanoseconds is split in SUB_BUCKETS buckets of equal width
+    SUB_BITS = 3
+    SUB_BUCKETS = 1 << SUB_BITS
+    BUCKETS = 48 * SUB_BUCKETS
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.buckets = [0] * self.BUCKETS
+
+    @classmethod
+    def bucket(cls, ns:int):
+        # below SUB_BUCKETS every value has its bucket
+        if ns < cls.SUB_BUCKETS:
+            return ns
+        shift = ns.bit_length() - 1 - cls.SUB_BITS
+        return min(((shift + 1) << cls.SUB_BITS) + (ns >> shift) - cls.SUB_BUCKETS, cls.BUCKETS - 1)
+
+    @classmethod
+    def bounds(cls, i:int):
+        # [lower, upper) of bucket i
+        if i < cls.SUB_BUCKETS:
+            return i, i + 1
+        shift = (i >> cls.SUB_BITS) - 1
+        lower = (cls.SUB_BUCKETS + (i & (cls.SUB_BUCKETS - 1))) << shift
+        return lower, lower + (1 << shift)
+
+    def add(self, ns:int):
+        self.count += 1
+        self.total_ns += ns
+        if self.min_ns is None or ns < self.min_ns:
+            self.min_ns = ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.buckets[self.bucket(ns)] += 1
+
+    def percentile(self, q:float):
+        # interpolated linearly inside the bucket holding the q-quantile, so off by
+        # at most the bucket width (1/SUB_BUCKETS of the value)
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower, upper = self.bounds(i)
+                value = round(lower + (upper - lower) * (rank - seen) / n)
+                return min(max(value, self.min_ns), self.max_ns)
+            seen += n
+        return self.max_ns
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total_ns': self.total_ns,
+            'mean_ns': self.total_ns / self.count if self.count else 0,
+            'min_ns': self.min_ns or 0,
+            'max_ns': self.max_ns,
+            'p50_ns': self.percentile(0.5),
+            'p90_ns': self.percentile(0.9),
+            'p99_ns': self.percentile(0.99),
+            # {bucket upper bound in ns: calls}
+            'buckets': {self.bounds(i)[1]: n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+def _timed(histogram:Histogram, fn):
+    perf_counter_ns = time.perf_counter_ns
+    def timed(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.add(perf_counter_ns() - start)
+    timed.__wrapped__ = fn
+    return timed
+
+
+class Instrumentation:
+    # Timing wrappers are set as instance attributes over the methods of the
+    # instrumented objects and deleted again by unwrap, so an object that is not
+    # instrumented runs its plain methods without any check.
+    def __init__(self):
+        self.histograms = {}
+        self.__wrapped = []     # (object, method names)
+
+    def histogram(self, name:str):
+        if not name in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def wrap(self, obj, methods:dict):
+        # methods: method name -> metric name
+        for method, metric in methods.items():
+            setattr(obj, method, _timed(self.histogram(metric), getattr(obj, method)))
+        self.__wrapped.append((obj, list(methods)))
+
+    def unwrap(self, *objects):
+        # only these objects, the others sharing the instrumentation stay timed
+        remaining = []
+        for obj, methods in self.__wrapped:
+            if any(obj is other for other in objects):
+                for method in methods:
+                    if method in vars(obj):
+                        delattr(obj, method)
+            else:
+                remaining.append((obj, methods))
+        self.__wrapped = remaining
+
+    def unwrap_all(self):
+        self.unwrap(*[obj for obj, _ in self.__wrapped])
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def snapshot(self):
+        return {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())}
+
+    def export_json(self, file=None):
+        data = json.dumps(self.snapshot(), indent=2)
+        if file is None:
+            return data
+        with open(file, 'w') as f:
+            f.write(data)
+
+    def report(self):
+        lines = [f'{"metric":<40} {"calls":>8} {"mean":>10} {"p50":>10} {"p99":>10} {"max":>10}']
+        for name, s in self.snapshot().items():
+            lines.append(f'{name:<40} {s["count"]:>8} {s["mean_ns"]/1000:>8.1f}us {s["p50_ns"]/1000:>8.1f}us '
+                f'{s["p99_ns"]/1000:>8.1f}us {s["max_ns"]/1000:>8.1f}us')
+        return '\n'.join(lines)
@@ -0,0 +1,152 @@
+import json
+from .game import Game
+from .utils import GameplayError, ParseError, Logger
+
+_GAME_OPS = {
+    'enable', 'disable', 'enable_all', 'disable_all', 'add_quest', 'set_quest_weight', 'ban_quest', 'unban_quest',
+    'seed', 'reset_round', 'enroll', 'remove', 'start', 'draw_event', 'draw_quest', 'verify',
+    'bet', 'play', 'evaluate_preprocess', 'evaluate_score', 'evaluate_bet', 'end_turn', 'undo', 'redo'
+}
+
+class GameJournal:
+    # Append-only JSONL journal. Every line is a list [op, *args]; the first line is
+    # ['game', game_type, turns, seed] and ['snapshot', Game.snapshot()] lines are written
+    # when the game starts and every snapshot_interval turns. Random draws are
+    # replayed from the RNG states of the snapshots, see Game.draw_event.
+    def __init__(self, file, snapshot_interval=5, append=False):
+        if isinstance(file, str):
+            self.__file = open(file, 'a' if append else 'w', encoding='utf8')
+            self.__own_file = True
+        else:
+            self.__file = file
+            self.__own_file = False
+        self.snapshot_interval = snapshot_interval
+        self.__turns_since_snapshot = 0
+
+    def record(self, op, *args):
+        self.__file.write(json.dumps([op, *args], ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def start(self, game:Game):
+        self.record('snapshot', game.snapshot())
+        self.__turns_since_snapshot = 0
+
+    def end_turn(self, game:Game):
+        self.__turns_since_snapshot += 1
+        if self.snapshot_interval and self.__turns_since_snapshot >= self.snapshot_interval:
+            self.record('snapshot', game.snapshot())
+            self.__turns_since_snapshot = 0
+        self.flush()
+
+    def flush(self):
+        self.__file.flush()
+
+    def close(self):
+        if self.__own_file and not self.__file.closed:
+            self.__file.close()
+
+
+class GameReplay:
+    def __init__(self, file):
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                data = f.read()
+        else:
+            data = file.read()
+            if isinstance(data, str):
+                data = data.encode('utf8')
+        lines = data.split(b'\n')
+
+        self.__records = []     # game operations, without header and snapshots
+        self.__snapshots = []   # (number of operations before the snapshot, state)
+        self.__valid_size = 0   # bytes up to the end of the last complete record, a crash may leave half a line
+        header = None
+        offset = 0
+        for i, line in enumerate(lines):
+            offset += len(line) + 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if i >= len(lines) - 2:
+                    break   # truncated last line
+                raise ParseError(f'Invalid journal line {i+1}')
+            # the last record may miss its newline only
+            self.__valid_size = min(offset, len(data))
+            if header is None:
+                if record[0] != 'game':
+                    raise ParseError('The journal should start with a game record')
+                header = record
+            elif record[0] == 'snapshot':
+                self.__snapshots.append((len(self.__records), record[1]))
+            elif record[0] in _GAME_OPS:
+                self.__records.append(record)
+            else:
+                raise ParseError(f'Invalid journal operation: {record[0]}')
+        if header is None:
+            raise ParseError('Empty journal')
+        _, self.game_type, self.turns, *seed = header
+        self.seed = seed[0] if seed else None
+
+    def __len__(self):
+        return len(self.__records)
+
+    @property
+    def records(self):
+        return self.__records
+
+    def new_game(self):
+        return Game(self.game_type, turns=self.turns, logger=Logger.headless(), seed=self.seed)
+
+    def turn_index(self, turn:int, round:int=-1):
+        # number of operations applied at the start of the turn (status 100)
+        rounds = []
+        for i, (op, *_) in enumerate(self.__records):
+            if op == 'start':
+                rounds.append([i+1])
+            elif op == 'end_turn' and rounds:
+                rounds[-1].append(i+1)
+        if not rounds:
+            raise GameplayError('The journal contains no started game')
+        turn_starts = rounds[round]
+        if turn < 1 or turn > len(turn_starts):
+            raise GameplayError(f'Turn {turn} is not in the journal')
+        return turn_starts[turn-1]
+
+    def seek(self, index:int=None, game:Game=None):
+        # rebuild the state after the first index operations, starting from the
+        # latest snapshot before it so that only the delta is replayed
+        if index is None:
+            index = len(self.__records)
+        if index < 0 or index > len(self.__records):
+            raise GameplayError(f'Invalid journal index {index}')
+        if game is None:
+            game = self.new_game()
+
+        start = 0
+        for snapshot_index, state in reversed(self.__snapshots):
+            if snapshot_index <= index:
+                game.restore(state)
+                start = snapshot_index
+                break
+        for op, *args in self.__records[start:index]:
+            getattr(game, op)(*args)
+        return game
+
+    def seek_turn(self, turn:int, round:int=-1):
+        return self.seek(self.turn_index(turn, round))
+
+    @classmethod
+    def recover(cls, path:str, snapshot_interval=5, logger:Logger=None):
+        # rebuild a crashed game from its journal and keep appending to it
+        replay = cls(path)
+        with open(path, 'rb+') as f:
+            f.truncate(replay.__valid_size)
+            if replay.__valid_size:
+                f.seek(replay.__valid_size - 1)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        game = replay.seek(game=Game(replay.game_type, turns=replay.turns,
+            logger=logger if logger else Logger.headless(), seed=replay.seed))
+        game.set_journal(GameJournal(path, snapshot_interval=snapshot_interval, append=True))
+        return game
@@ -0,0 +1,240 @@
+import gc
+import io
+import sys
+import time
+import traceback
+import tracemalloc
+import types
+import weakref
+
+# Memory use of long running hosts (servers, batch runners), opt-in per game with
+# Game.enable_profiling. measure walks the objects owned by every subsystem of a
+# game (Game.memory_roots) and sums sys.getsizeof, which is approximate: buffers
+# of C objects are only counted where getsizeof reports them, shared memory
+# segments not at all. Objects reached from several subsystems or games are
+# counted once, for the first one measured; the catalog is usually shared by the
+# games of a host and so counted with the first game.
+# Games are expected to be closed (Game.close); a tracked game that is garbage
+# collected without it is reported in leaks, with the log file it left open if
+# its logger is still alive, and where the game was created. tracemalloc
+# snapshots are taken on demand, diff compares the latest two.
+
+# not followed: code, classes and modules are shared by everything
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.CodeType, types.FrameType)
+# concrete classes, isinstance on the io ABCs would fill their caches with every type walked
+_FILES = (io.TextIOWrapper, io.BufferedWriter, io.BufferedReader, io.BufferedRandom, io.FileIO)
+
+def _walk(root, stop:set, seen:set):
+    # objects and bytes reachable from root, without the objects in stop or seen
+    objects = 0
+    size = 0
+    files = []
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or id(obj) in stop or isinstance(obj, _OPAQUE):
+            continue
+        seen.add(id(obj))
+        objects += 1
+        size += sys.getsizeof(obj)
+        if isinstance(obj, _FILES) and not obj.closed:
+            files.append(getattr(obj, 'name', repr(obj)))
+        pending.extend(gc.get_referents(obj))
+    return objects, size, files
+
+
+class MemoryProfiler:
+    def __init__(self, trace=False, frames=8):
+        # trace: start tracemalloc now (slows allocations down), else with the first snapshot
+        # frames: stack depth kept by tracemalloc and by the creation traceback of the games
+        self.frames = frames
+        self.leaks = []                             # records of the games collected without close
+        self.closed_games = 0
+        self.__records = {}                         # id(game) -> record
+        self.__games = weakref.WeakValueDictionary()
+        self.__snapshots = []
+        if trace:
+            self.start_tracing()
+
+    # tracking
+    def track(self, game):
+        key = id(game)
+        self.__records[key] = {
+            'game_type': game.game_type,
+            'created': time.time(),
+            # source lines are only read when reported
+            'where': traceback.StackSummary.extract(traceback.walk_stack(sys._getframe(2)), limit=self.frames, lookup_lines=False),
+            'logger': weakref.ref(game.logger),
+            'finalizer': weakref.finalize(game, self.__collected, key),
+        }
+        self.__games[key] = game
+
+    def untrack(self, game):
+        record = self.__records.pop(id(game), None)
+        if record:
+            record['finalizer'].detach()
+            self.__games.pop(id(game), None)
+
+    def closed(self, game):
+        self.untrack(game)
+        self.closed_games += 1
+
+    def __collected(self, key):
+        # the game is being freed, its attributes (logger) are not yet unless the
+        # game was in a reference cycle: the collector clears the weak references
+        # to all the garbage first
+        record = self.__records.pop(key)
+        logger = record.pop('logger')()
+        record['log_file'] = None if logger is None else logger.file_name
+        record['freed_by_gc'] = logger is None
+        record['collected'] = time.time()
+        del record['finalizer']
+        self.leaks.append(record)
+
+    def open_games(self):
+        # tracked games that are alive and not closed yet, oldest first
+        now = time.time()
+        games = []
+        for key, game in list(self.__games.items()):
+            record = self.__records[key]
+            games.append({'game': game, 'game_type': record['game_type'], 'age': now - record['created'],
+                'status': game.status, 'finished': game.finished, 'where': record['where']})
+        return sorted(games, key=lambda game: -game['age'])
+
+    def collect(self):
+        # leaks after a full collection, games in reference cycles are found as well
+        gc.collect()
+        return self.leaks
+
+    # sizes
+    def measure(self, game, seen:set=None):
+        # subsystem -> {'objects', 'bytes'}, and the open files and pending after_event effects
+        seen = set() if seen is None else seen
+        roots = game.memory_roots()
+        stop = {id(game), id(self)} | {id(root) for root in roots.values()}
+        result = {}
+        files = []
+        for name, root in roots.items():
+            if root is None:
+                result[name] = {'objects': 0, 'bytes': 0}
+                continue
+            stop.discard(id(root))
+            objects, size, open_files = _walk(root, stop, seen)
+            stop.add(id(root))
+            result[name] = {'objects': objects, 'bytes': size}
+            files += open_files
+        result['open_files'] = files
+        result['after_event'] = len(roots['players'].after_event)
+        return result
+
+    def measure_all(self):
+        # every open game, objects shared by games are counted once
+        seen = set()
+        return [(game['game'], self.measure(game['game'], seen)) for game in self.open_games()]
+
+    # tracemalloc
+    def start_tracing(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop_tracing(self):
+        self.__snapshots.clear()
+        tracemalloc.stop()
+
+    def snapshot(self):
+        # only allocations made while tracing are in a snapshot
+        self.start_tracing()
+        snapshot = tracemalloc.take_snapshot()
+        self.__snapshots = self.__snapshots[-1:] + [snapshot]
+        return snapshot
+
+    def diff(self, limit=10, key_type='lineno'):
+        # allocations that grew the most between the latest two snapshots
+        if len(self.__snapshots) < 2:
+            self.snapshot()
+        if len(self.__snapshots) < 2:
+            return []
+        return self.__snapshots[-1].compare_to(self.__snapshots[-2], key_type)[:limit]
+
+    def report(self, limit=10):
+        lines = [f'{"game":<24} {"subsystem":<12} {"objects":>10} {"KiB":>10}']
+        total = 0
+        for game, result in self.measure_all():
+            name = f'{game.game_type} {id(game):x}'
+            for subsystem, value in result.items():
+                if isinstance(value, dict):
+                    total += value['bytes']
+                    lines.append(f'{name:<24} {subsystem:<12} {value["objects"]:>10} {value["bytes"]/1024:>10.1f}')
+            if result['open_files'] or result['after_event']:
+                lines.append(f'{name:<24} {len(result["open_files"])} open file(s), {result["after_event"]} pending effect(s)')
+        lines.append(f'{len(self.__games)} open game(s), {total/1024:.1f} KiB, {self.closed_games} closed, {len(self.leaks)} leaked')
+        for leak in self.leaks[-limit:]:
+            freed = 'by the garbage collector' if leak['freed_by_gc'] else f'with log file {leak["log_file"]}'
+            lines.append(f'leaked {leak["game_type"]} game, freed {freed}, created at:')
+            lines.append(''.join(traceback.format_list(list(reversed(leak['where'])))).rstrip())
+        if tracemalloc.is_tracing() and self.__snapshots:
+            for stat in self.diff(limit):
+                lines.append(str(stat))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import shutil
+    import tempfile
+    from .game import Game
+    from .parser import get_arcaea_info
+    from .utils import Logger
+
+    parser = argparse.ArgumentParser(description='Profile the memory of a host that forgets to close some games')
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=8)
+    args = parser.parse_args()
+
+    catalog = get_arcaea_info()
+    log_dir = tempfile.mkdtemp()
+    profiler = MemoryProfiler()
+
+    def host_game(i):
+        game = Game('arcaea', turns=2, logger=Logger(echo=False, log_dir=log_dir, threaded=False), seed=i, catalog=catalog)
+        game.enable_profiling(profiler)
+        game.enable_all()
+        game.add_quest([])
+        for j in range(args.players):
+            game.enroll(f'p{j}')
+        if i % 2:
+            # the feed and the game reference each other
+            game.subscribe()
+        game.start()
+        game.draw_event()
+        game.draw_quest()
+        game.verify()
+        return game
+
+    try:
+        # the first game fills the caches of the modules it uses
+        host_game(args.games).close()
+        profiler.closed_games = 0
+        profiler.snapshot()
+        games = [host_game(i) for i in range(args.games)]
+        measured = profiler.measure_all()
+        first, rest = measured[0][1], measured[1][1]
+        print(f'{len(measured)} games: first {sum(v["bytes"] for v in first.values() if isinstance(v, dict))/1024:.0f} KiB '
+            f'(catalog {first["catalog"]["bytes"]/1024:.0f} KiB), others '
+            f'{sum(v["bytes"] for v in rest.values() if isinstance(v, dict))/1024:.0f} KiB each')
+        # a third is closed, the others are dropped
+        for game in games[::3]:
+            game.close()
+        dropped = len(games) - len(games[::3])
+        del games, measured, game
+        leaks = profiler.collect()
+        if profiler.closed_games != (args.games + 2) // 3 or len(leaks) != dropped:
+            raise AssertionError(f'{profiler.closed_games} closed and {len(leaks)} leaked games, expected {dropped} leaks')
+        print(f'{profiler.closed_games} closed, {len(leaks)} leaked: '
+            f'{sum(1 for leak in leaks if leak["log_file"])} with their log file open when freed, '
+            f'{sum(1 for leak in leaks if leak["freed_by_gc"])} freed by the garbage collector')
+        print('\n'.join(str(stat) for stat in profiler.diff(5)))
+    finally:
+        profiler.stop_tracing()
+        gc.collect()
+        shutil.rmtree(log_dir)
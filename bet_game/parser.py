@@ -1,14 +1,47 @@
 import os
+import hashlib
 import json
 import re
 
 from .utils import ParseError
 from .quest import ArcaeaQuestInfo, PhigrosQuestInfo
 
+class SongCatalog(tuple):
+    # (songs, packages, difficulties) as before, plus indexes built once at load
+    # time and shared by every manager that uses the catalog:
+    #   song_levels[i]   weight level of song i (integer bucket for phigros)
+    #   levels           level -> song indexes, in catalog order
+    #   groups           (package, difficulty) -> song indexes, in catalog order
+    #   views            quest views by selection, filled by the song managers
+    #   version          hash of the song data, e.g. for caches of quest pools
+    def __new__(cls, songs, packages, difficulties, level_key=float, version=None):
+        catalog = super().__new__(cls, (songs, packages, difficulties))
+        catalog.level_key = level_key
+        if version is None:
+            data = json.dumps(songs, sort_keys=True, ensure_ascii=False, default=dict)
+            version = hashlib.sha1(data.encode('utf8')).hexdigest()
+        catalog.version = version
+        catalog.song_levels = tuple(level_key(song['level']) for song in songs)
+        levels = {}
+        groups = {}
+        for i, song in enumerate(songs):
+            levels.setdefault(catalog.song_levels[i], []).append(i)
+            groups.setdefault((song['package'], song['difficulty']), []).append(i)
+        catalog.levels = {level: tuple(indexes) for level, indexes in levels.items()}
+        catalog.groups = {group: tuple(indexes) for group, indexes in groups.items()}
+        catalog.views = {}
+        return catalog
+
+    def __reduce__(self):
+        # indexes are rebuilt, cached views are not copied
+        return (SongCatalog, (*self, self.level_key, self.version))
+
+
 def get_arcaea_info():
     _song_info_file = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + '/song_info/arcaea_songlist'
-    with open(_song_info_file, 'r', encoding='utf8') as f:
-        _song_info_raw = json.load(f)
+    with open(_song_info_file, 'rb') as f:
+        _raw = f.read()
+        _song_info_raw = json.loads(_raw)
         _song_info = []
         _package_info = set()
         _difficulty_list = ['pst', 'prs', 'ftr', 'byd']
@@ -30,7 +63,7 @@ def get_arcaea_info():
                     _dif_info['name'] = _dif['title_localized']['en']
                 _song_info.append(_dif_info)
             _package_info.add(_song['set'].lower())
-    return _song_info, _package_info, set(('pst', 'prs', 'ftr', 'byd'))
+    return SongCatalog(_song_info, _package_info, set(('pst', 'prs', 'ftr', 'byd')), float, hashlib.sha1(_raw).hexdigest())
     
 
 def arcaea_level(value):
@@ -50,8 +83,18 @@ def arcaea_level(value):
         raise ParseError(f'Invalid arcaea level: {value}')
 
 
-def set_arcaea_quest(level_weights:dict, songs:list, args:list):
-    ban_song_id = set()
+def arcaea_song_key(song:dict):
+    # songs are banned by id
+    return song['id']
+
+
+def arcaea_quest_config(level_weights:dict, args:list, banned=()):
+    # apply quest args on top of level weights and banned songs, without changing them:
+    #   level, weight    set the weight of a level, 0 removes the level
+    #   'ban', id        ban a song
+    #   'unban', id      lift a ban
+    level_weights = dict(level_weights)
+    banned = set(banned)
     for i in range(0, len(args), 2):
         _arg1, _arg2 = args[i], args[i+1]
         if isinstance(_arg2, float) or isinstance(_arg2, int):
@@ -61,12 +104,19 @@ def set_arcaea_quest(level_weights:dict, songs:list, args:list):
                 del(level_weights[arcaea_level(_arg1)])
         elif isinstance(_arg2, str):
             # ban song
-            if _arg1 != "ban":
+            if _arg1 == "ban":
+                banned.add(_arg2)
+            elif _arg1 == "unban":
+                banned.discard(_arg2)
+            else:
                 raise ParseError(f'Invalid args: {_arg1}, {_arg2}')
-            ban_song_id.add(_arg2)
         else:
             raise ParseError(f'Invalid args: {_arg1}, {_arg2}')
+    return level_weights, banned
+
 
+def set_arcaea_quest(level_weights:dict, songs:list, args:list):
+    level_weights, ban_song_id = arcaea_quest_config(level_weights, args)
     quests = []
     for song in songs:
         if song['id'] not in ban_song_id and song['level'] in level_weights.keys():
@@ -76,8 +126,9 @@ def set_arcaea_quest(level_weights:dict, songs:list, args:list):
 # phigros
 def get_phigros_info():
     _song_info_file = os.path.dirname(os.path.abspath(__file__)) + os.path.sep + '/song_info/phigros_songlist'
-    with open(_song_info_file, 'r', encoding='utf8') as f:
-        _song_info_raw = json.load(f)
+    with open(_song_info_file, 'rb') as f:
+        _raw = f.read()
+        _song_info_raw = json.loads(_raw)
         _song_info = []
         _package_info = set()
         diffname_list = ['EZ', 'HD', 'IN', 'AT']
@@ -98,7 +149,7 @@ def get_phigros_info():
                     }
                     _song_info.append(_dif_info)
             _package_info.add(_song['Pack'].lower())
-        return _song_info, _package_info, set(('ez', 'hd', 'in', 'at'))
+        return SongCatalog(_song_info, _package_info, set(('ez', 'hd', 'in', 'at')), int, hashlib.sha1(_raw).hexdigest())
 
 
 def phigros_diff_split(diff_str):
@@ -109,8 +160,15 @@ def phigros_diff_split(diff_str):
         return None
 
 
-def set_phigros_quest(level_weights:dict, songs:list, args:list):
-    ban_song_id = set()
+def phigros_song_key(song:dict):
+    # phigros songs have no id, they are banned by name
+    return song['name']
+
+
+def phigros_quest_config(level_weights:dict, args:list, banned=()):
+    # see arcaea_quest_config, levels are integers
+    level_weights = dict(level_weights)
+    banned = set(banned)
     for i in range(0, len(args), 2):
         _arg1, _arg2 = args[i], args[i+1]
         if isinstance(_arg2, float) or isinstance(_arg2, int):
@@ -123,14 +181,21 @@ def set_phigros_quest(level_weights:dict, songs:list, args:list):
                 print(f'{_arg1} is not a valid level!')
         elif isinstance(_arg2, str):
             # ban song
-            if _arg1 != "ban":
+            if _arg1 == "ban":
+                banned.add(_arg2)
+            elif _arg1 == "unban":
+                banned.discard(_arg2)
+            else:
                 raise ParseError(f'Invalid args: {_arg1}, {_arg2}')
-            ban_song_id.add(_arg2)
         else:
             raise ParseError(f'Invalid args: {_arg1}, {_arg2}')
+    return level_weights, banned
+
 
+def set_phigros_quest(level_weights:dict, songs:list, args:list):
+    level_weights, ban_song_name = phigros_quest_config(level_weights, args)
     quests = []
     for song in songs:
-        if song['id'] not in ban_song_id and int(song['level']) in level_weights.keys():
+        if phigros_song_key(song) not in ban_song_name and int(song['level']) in level_weights.keys():
             quests.append(PhigrosQuestInfo(song=song, weight=level_weights[int(song['level'])]))
     return quests
@@ -23,6 +23,14 @@ class Player:
         self.rank = None # The player's rank in this turn's playing.
         self.cur_pt = None # Points that the player earned in this turn's playing.
 
+    def get_state(self):
+        return [self.id, self.score, self.took_bet, self.bet_id, self.stake, self.betted,
+            self.bet_reward, self.played, self.playing_score, self.rank, self.cur_pt]
+
+    def set_state(self, state:list):
+        (self.id, self.score, self.took_bet, self.bet_id, self.stake, self.betted,
+            self.bet_reward, self.played, self.playing_score, self.rank, self.cur_pt) = state
+
     def __lt__(self, other):
         return self.score < other.score
 
@@ -60,6 +68,9 @@ class PlayerManager:
     def reset_turn(self):
         for player in self.player_list:
             player.reset_turn()
+        self.reset_turn_effects()
+
+    def reset_turn_effects(self):
         self.betted_deduct = True # if players get betted, the score will be deducted
         self.after_event = [] # event at the end of the turn
         self.bet_failed_deduct = True # if players bets failed, the score will be deducted
@@ -84,6 +95,19 @@ class PlayerManager:
         self.player_list.append(player)
         self.player_id_trie.insert(id, player)
 
+    def get_players(self):
+        return [player.get_state() for player in self.player_list]
+
+    def set_players(self, players:list):
+        # rebuild the players from Player.get_state() lists, keeping the given order
+        self.player_list = []
+        self.player_id_trie = TrieNode()
+        for state in players:
+            player = Player(state[0])
+            player.set_state(state)
+            self.player_list.append(player)
+            self.player_id_trie.insert(player.id, player)
+
     def remove_player(self, id:str):
         _, player_id = self.player_id_trie.delete(id) 
         for i, player in enumerate(self.player_list):
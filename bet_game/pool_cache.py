@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import struct
+from array import array
+from collections import OrderedDict
+from .quest import QuestInfo
+
+# Precomputed quest pools, so that hosts reusing the same few quest configurations
+# (packages, difficulties, level weights and bans, e.g. regular_quests of
+# init_arc.py) do not filter the catalog and build the sampler of the pool again
+# on every add_quest. A pool is keyed by a hash of the game type, the catalog
+# version and the configuration, and kept in memory (least recently used first
+# out) and, with a directory, in one file per pool:
+#   header       magic, key, number of quests, length of the descriptions
+#   weights      float64 weight of every slot
+#   tree         float64 Fenwick tree of the weights, quests + 1 entries
+#   descriptions utf8 JSON list of the quest descriptions
+# Files are named <game type>-<catalog version>-<key>.pool; the first lookup
+# with a catalog version removes the files of the other versions of the game type.
+
+_MAGIC = b'BETPOOL1'
+_HEADER = struct.Struct('<8s40sQQ')
+
+class QuestPoolCache:
+    def __init__(self, directory:str=None, memory_entries=64):
+        # directory: where the pools are persisted, only kept in memory when None
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__tables = OrderedDict()   # key -> (game type, catalog version, table)
+        self.__versions = set()         # (game type, catalog version) already evicted for
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(game_type:str, version:str, config:dict):
+        # config: quest configuration of a game (packages, difficulties, quests)
+        data = json.dumps([game_type, version, config['packages'], config['difficulties'], config['quests']],
+            ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+    def path(self, game_type:str, version:str, key:str):
+        return os.path.join(self.directory, f'{game_type}-{version[:16]}-{key[:16]}.pool')
+
+    def get(self, game_type:str, version:str, config:dict):
+        # table of QuestPool.set_table, None when the pool has to be built
+        key = self.key(game_type, version, config)
+        if key in self.__tables:
+            self.__tables.move_to_end(key)
+            self.hits += 1
+            return self.__tables[key][2]
+        if self.directory:
+            self.__evict(game_type, version)
+            table = self.__read(self.path(game_type, version, key), key)
+            if table is not None:
+                self.__remember(key, game_type, version, table)
+                self.hits += 1
+                return table
+        self.misses += 1
+        return None
+
+    def put(self, game_type:str, version:str, config:dict, table:tuple):
+        # table: QuestPool.get_table() of a pool built from the configuration
+        key = self.key(game_type, version, config)
+        quests, weights, tree, slots = table
+        self.__remember(key, game_type, version, (tuple(quests), list(weights), list(tree), dict(slots)))
+        if self.directory:
+            path = self.path(game_type, version, key)
+            if not os.path.exists(path):
+                self.__write(path, key, quests, weights, tree)
+
+    def clear(self):
+        self.__tables.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pool'):
+                    self.__remove(os.path.join(self.directory, name))
+
+    def __remember(self, key, game_type, version, table):
+        self.__tables[key] = (game_type, version, table)
+        self.__tables.move_to_end(key)
+        while len(self.__tables) > self.memory_entries:
+            self.__tables.popitem(last=False)
+
+    def __evict(self, game_type, version):
+        # a new catalog version makes the pools of the old one stale
+        if (game_type, version) in self.__versions:
+            return
+        self.__versions.add((game_type, version))
+        for key, (other_type, other_version, _) in list(self.__tables.items()):
+            if other_type == game_type and other_version != version:
+                del self.__tables[key]
+        current = f'{game_type}-{version[:16]}-'
+        for name in os.listdir(self.directory):
+            if name.startswith(f'{game_type}-') and name.endswith('.pool') and not name.startswith(current):
+                self.__remove(os.path.join(self.directory, name))
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+            self.evictions += 1
+        except OSError:
+            pass
+
+    def __write(self, path, key, quests, weights, tree):
+        descriptions = json.dumps([quest.description for quest in quests], ensure_ascii=False).encode('utf8')
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, key.encode('ascii'), len(quests), len(descriptions)))
+            f.write(array('d', weights).tobytes())
+            f.write(array('d', tree).tobytes())
+            f.write(descriptions)
+        # readers see the whole file or none
+        os.replace(tmp, path)
+
+    def __read(self, path, key):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            magic, stored, n, size = _HEADER.unpack_from(data, 0)
+            if magic != _MAGIC or stored != key.encode('ascii'):
+                raise ValueError('not a pool of this configuration')
+            offset = _HEADER.size
+            weights = array('d')
+            weights.frombytes(data[offset:offset + 8 * n])
+            offset += 8 * n
+            tree = array('d')
+            tree.frombytes(data[offset:offset + 8 * (n + 1)])
+            offset += 8 * (n + 1)
+            if len(weights) != n or len(tree) != n + 1 or offset + size != len(data):
+                raise ValueError('truncated pool')
+            descriptions = json.loads(data[offset:].decode('utf8'))
+            if len(descriptions) != n:
+                raise ValueError('truncated pool')
+        except (struct.error, ValueError):
+            # torn or foreign file: built again by the caller
+            self.__remove(path)
+            return None
+        quests = tuple(QuestInfo(1.0, description) for description in descriptions)
+        slots = {}
+        for i, description in enumerate(descriptions):
+            slots.setdefault(description, i)
+        return quests, weights.tolist(), tree.tolist(), slots
+
+
+if __name__ == '__main__':
+    import shutil
+    import tempfile
+    import time
+    from .game import Game
+    from .parser import get_arcaea_info
+    from .utils import Logger
+
+    regular_quests = ['8', 1.0, '9', 2.0, '9+', 2.0, '10', 1.0, 'ban', 'ifi']
+    catalog = get_arcaea_info()
+
+    def play(cache):
+        # quests drawn and redrawn around a live change of the configuration
+        game = Game('arcaea', logger=Logger.headless(), seed=7, catalog=catalog, pool_cache=cache)
+        game.enable_all()
+        start = time.perf_counter()
+        game.add_quest(regular_quests)
+        elapsed = time.perf_counter() - start
+        game.enroll('p1')
+        game.enroll('p2')
+        game.start()
+        game.draw_event()
+        drawn = []
+        for i in range(100):
+            game.draw_quest()
+            drawn.append(str(game.current_quest))
+            if i == 50:
+                game.set_quest_weight('9', 0.0)
+                game.ban_quest('grievouslady')
+        return drawn, game.snapshot(), elapsed
+
+    directory = tempfile.mkdtemp()
+    try:
+        built = play(None)
+        catalog.views.clear()
+        first = play(QuestPoolCache(directory))
+        catalog.views.clear()
+        cache = QuestPoolCache(directory)
+        from_file = play(cache)
+        from_memory = play(cache)
+        if not built[:2] == first[:2] == from_file[:2] == from_memory[:2]:
+            raise AssertionError('cached pools draw other quests')
+        print(f'add_quest: built {first[2]*1000:.2f}ms, from file {from_file[2]*1000:.2f}ms, '
+            f'from memory {from_memory[2]*1000:.3f}ms, {cache.hits} hits, {cache.misses} misses')
+    finally:
+        shutil.rmtree(directory)
@@ -1,5 +1,15 @@
 from .utils import GameplayError
-import numpy as _np
+
+# numpy is only needed to draw quests, it is imported on the first draw (or the
+# first use of a QuestPool rng) so that importing the package stays cheap
+_np = None
+
+def _numpy():
+    global _np
+    if _np is None:
+        import numpy
+        _np = numpy
+    return _np
 
 class QuestInfo:
     def __init__(
@@ -27,7 +37,7 @@ class ArcaeaQuestInfo(QuestInfo):
         level_name = str(int(level))
         if level - int(level) > 0:
             level_name += '+'
-        difficulty_full = {'pst':'Past', 'pre':'Present', 'ftr':'Future', 'byd':'Beyond'}
+        difficulty_full = {'pst':'Past', 'prs':'Present', 'ftr':'Future', 'byd':'Beyond'}
         difficulty_name = difficulty_full[song['difficulty']]
 
         song_name = song['name']
@@ -53,36 +63,185 @@ class PhigrosQuestInfo(QuestInfo):
 
 
 class QuestPool:
-    def __init__(self, quest_list=None):
-        if (quest_list):
-            self.__quest_list = quest_list
-        else:
-            self.__quest_list = []
-        self.__p_cache = None
-
-    def set_quest_list(self, quest_list):
-        self.__quest_list = quest_list
+    # Weighted draws from a Fenwick tree (binary indexed tree) over the quest
+    # weights, so drawing, removing and re-weighting a quest cost O(log n).
+    # Every quest keeps its slot: removed quests and quests of weight 0 only
+    # weigh nothing, the layout only depends on the quest list. A draw uses one
+    # rng.random() and picks the first slot whose prefix sum exceeds it times the
+    # total weight, like Generator.choice with p.
+    def __init__(self, quest_list=None, seed=None):
+        self.__seed = seed
+        self.__rng = None
+        self.set_quest_list(quest_list if quest_list else [])
+
+    def seed(self, seed):
+        self.__seed = seed
+        self.__rng = None
+
+    @property
+    def rng(self):
+        if self.__rng is None:
+            self.__rng = _numpy().random.default_rng(self.__seed)
+        return self.__rng
+
+    def get_rng_state(self):
+        return self.rng.bit_generator.state
+
+    def set_rng_state(self, state):
+        self.rng.bit_generator.state = state
+
+    @property
+    def removed_quests(self):
+        # descriptions of quests removed (redrawn) since the last set_quest_list
+        return [q.description for q in self.__removed]
+
+    def set_quest_list(self, quest_list, weights=None):
+        # weights: weight of every slot, the weights of the quests by default;
+        # with weights the quests are not changed by the pool and may be shared
+        self.__quests = list(quest_list)
+        self.__weights = [q.weight for q in self.__quests] if weights is None else list(weights)
+        self.__slots = {}
+        for i, quest in enumerate(self.__quests):
+            self.__slots.setdefault(quest.description, i)
+        self.__in_pool = [True] * len(self.__quests)
+        self.__removed = []
+        self.__build()
+
+    def get_table(self):
+        # quests, slot weights, Fenwick tree and slots of the description of the
+        # pool, taken right after set_quest_list to be cached (see pool_cache.py)
+        return tuple(self.__quests), list(self.__weights), list(self.__tree), dict(self.__slots)
+
+    def set_table(self, quests, weights, tree, slots=None):
+        # a pool of get_table, without building the tree again
+        self.__quests = list(quests)
+        self.__weights = list(weights)
+        if slots is None:
+            slots = {}
+            for i, quest in enumerate(self.__quests):
+                slots.setdefault(quest.description, i)
+        self.__slots = dict(slots)
+        self.__in_pool = [True] * len(self.__quests)
+        self.__removed = []
+        self.__tree = list(tree)
+        self.__updates = 0
+
+    def __weight(self, i):
+        return max(self.__weights[i], 0.0) if self.__in_pool[i] else 0.0
+
+    def __build(self):
+        n = len(self.__quests)
+        tree = [0.0] * (n + 1)
+        for i in range(1, n + 1):
+            tree[i] += self.__weight(i - 1)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.__tree = tree
+        self.__updates = 0
+
+    def __update(self, i, delta):
+        if delta == 0:
+            return
+        tree = self.__tree
+        n = len(tree) - 1
+        i += 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+        # rounding errors of many updates are dropped by a rebuild now and then
+        self.__updates += 1
+        if self.__updates > n:
+            self.__build()
+
+    def __total(self):
+        tree = self.__tree
+        total = 0.0
+        i = len(tree) - 1
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def __search(self, target):
+        # first slot whose prefix sum of weights exceeds target
+        tree = self.__tree
+        n = len(tree) - 1
+        pos = 0
+        step = 1 << n.bit_length()
+        while step:
+            if pos + step <= n and tree[pos + step] <= target:
+                pos += step
+                target -= tree[pos]
+            step >>= 1
+        return pos
+
+    def __slot(self, quest):
+        description = quest if isinstance(quest, str) else quest.description
+        if not description in self.__slots:
+            raise GameplayError(f'Quest not in the quest pool: {description}')
+        return self.__slots[description]
+
+    def set_weight(self, index:int, weight:float):
+        # index: position of the quest in the list given to set_quest_list
+        before = self.__weight(index)
+        self.__weights[index] = weight
+        self.__update(index, self.__weight(index) - before)
+
+    def set_removed_quests(self, descriptions:list):
+        # the pool of the last set_quest_list minus the given quests,
+        # in the same order as if they had been removed one by one
+        for quest in self.__removed:
+            i = self.__slots[quest.description]
+            self.__in_pool[i] = True
+            self.__update(i, self.__weight(i))
+        self.__removed = []
+        for description in descriptions:
+            self.remove_quest(self.__quests[self.__slot(description)])
 
     def add_quest(self, quest:QuestInfo):
-        self.__quest_list.append(quest)
-        self.__p_cache = None
+        # a quest that has a slot is put back with the weight of its slot
+        if quest.description in self.__slots:
+            i = self.__slots[quest.description]
+            if not self.__in_pool[i]:
+                self.__removed = [q for q in self.__removed if q.description != quest.description]
+            before = self.__weight(i)
+            self.__in_pool[i] = True
+            self.__update(i, self.__weight(i) - before)
+        else:
+            self.__slots[quest.description] = len(self.__quests)
+            self.__quests.append(quest)
+            self.__weights.append(quest.weight)
+            self.__in_pool.append(True)
+            self.__build()
 
     def remove_quest(self, quest:QuestInfo):
-        self.__quest_list.remove(quest)
-        self.__p_cache = None
+        i = self.__slot(quest)
+        if not self.__in_pool[i]:
+            raise GameplayError(f'Quest not in the quest pool: {quest}')
+        before = self.__weight(i)
+        self.__in_pool[i] = False
+        self.__removed.append(self.__quests[i])
+        self.__update(i, -before)
+
+    def find_quest(self, description:str, weighted=True):
+        # weighted: only quests that can be drawn (weight > 0)
+        i = self.__slot(description)
+        if not self.__in_pool[i] or (weighted and not self.__weight(i) > 0):
+            raise GameplayError(f'Quest not in the quest pool: {description}')
+        return self.__quests[i]
 
     def draw_quest(self):
-        if not self.__p_cache is None:
-            p = self.__p_cache
-        else:
-            weights = _np.array([q.weight for q in self.__quest_list])
-            total_pool_size = len(self.__quest_list)
-            if (total_pool_size == 0):
-                raise GameplayError("No Quest In The Quest Pool!")
-            total_weights = weights.sum()
-            p = weights / total_weights
-            self.__p_cache = p
-        indexes = _np.arange(0, len(p), dtype=_np.int_)
-        rolled = _np.random.choice(indexes, 1, replace=False, p=p).item()
-        current_quest = self.__quest_list[rolled]
-        return current_quest
+        total = self.__total()
+        if not total > 0:
+            raise GameplayError("No Quest In The Quest Pool!")
+        u = self.rng.random()
+        i = self.__search(u * total)
+        if i >= len(self.__quests) or not self.__weight(i) > 0:
+            # rounding errors of the sums: search again on fresh sums, at worst
+            # take the last quest that can be drawn
+            self.__build()
+            i = self.__search(u * self.__total())
+            if i >= len(self.__quests) or not self.__weight(i) > 0:
+                i = max(j for j in range(len(self.__quests)) if self.__weight(j) > 0)
+        return self.__quests[i]
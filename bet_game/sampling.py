@@ -0,0 +1,316 @@
+import math
+import time
+from collections import Counter
+import numpy as _np
+from .event import RandomEvent
+from .game import Game
+from .parser import get_arcaea_info, get_phigros_info
+from .player import PlayerManager
+from .pool_cache import QuestPoolCache
+from .utils import Logger
+from .vectorized import GameBatch
+
+# Statistical verification of the quest and event samplers, to run whenever the
+# sampling code changes (samplers, caches of weights or pools, batched draws).
+# Every check draws many samples through the real code path and compares the
+# counts per category with probabilities computed from scratch (the catalog and
+# the whole quest configuration, not the pool or its deltas):
+#   chi-square   Pearson's test over the categories, small expected counts merged
+#   ks           Kolmogorov-Smirnov of the randomized probability integral
+#                transform of the draws, uniform exactly when the draws follow the
+#                expected distribution; sensitive to mass moved to neighbour slots
+# A check fails when a p-value is below alpha. The seeds are fixed, so a run
+# either always passes or always fails, and it doubles as a throughput benchmark
+# (samples per second of the draws alone).
+
+arcaea_quests = [
+    '7', 1.0, '8', 2.0, '9', 3.0, '9+', 3.0, '10', 2.0, '10+', 1.0, '11', 0.0, '12', 0.0,
+    'ban', 'dropdead', 'ban', 'fallensquare', 'ban', 'altale', 'ban', 'ifi',
+]
+phigros_quests = [
+    '7', 0.0, '14', 1.5, '15', 1.5, '16', 1.0,
+    'ban', 'Break Over', 'ban', 'Introduction',
+]
+# live changes applied to a configured game in the quest.updated check
+arcaea_updates = [
+    ('set_quest_weight', '9', 0.5), ('set_quest_weight', '11', 4.0), ('ban_quest', 'grievouslady'),
+    ('unban_quest', 'ifi'), ('set_quest_weight', '8', 0.0), ('ban_quest', 'tempestissimo'),
+]
+
+def chi2_sf(x:float, dof:int):
+    # P(X >= x) for X chi-square distributed, the regularized upper gamma Q(dof/2, x/2)
+    a, x = dof / 2, x / 2
+    if x <= 0:
+        return 1.0
+    scale = math.exp(-x + a * math.log(x) - math.lgamma(a))
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * scale)
+    # continued fraction (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 100000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        h *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return min(1.0, scale * h)
+
+def ks_sf(d:float, n:int):
+    # P(D >= d) of the Kolmogorov-Smirnov statistic of n samples (asymptotic form)
+    sqrt_n = math.sqrt(n)
+    lam = (sqrt_n + 0.12 + 0.11 / sqrt_n) * d
+    if lam < 0.2:
+        return 1.0
+    total = sum((-1) ** (k - 1) * math.exp(-2 * k * k * lam * lam) for k in range(1, 101))
+    return min(1.0, max(0.0, 2 * total))
+
+def chi_square(counts, probabilities, min_expected=5.0):
+    # (statistic, degrees of freedom, p-value); draws of a category of probability
+    # 0 fail the test outright
+    counts = _np.asarray(counts, dtype=_np.float64)
+    probabilities = _np.asarray(probabilities, dtype=_np.float64)
+    n = counts.sum()
+    if (counts[probabilities <= 0] > 0).any():
+        return math.inf, 0, 0.0
+    counts, expected = counts[probabilities > 0], probabilities[probabilities > 0] * n
+    # merge the categories of small expected counts, smallest first
+    order = _np.argsort(expected, kind='stable')
+    merged_counts, merged_expected = [], []
+    count = want = 0.0
+    for i in order.tolist():
+        count += counts[i]
+        want += expected[i]
+        if want >= min_expected:
+            merged_counts.append(count)
+            merged_expected.append(want)
+            count = want = 0.0
+    if want > 0:
+        if merged_expected:
+            merged_counts[-1] += count
+            merged_expected[-1] += want
+        else:
+            merged_counts.append(count)
+            merged_expected.append(want)
+    if len(merged_expected) < 2:
+        return 0.0, 0, 1.0
+    merged_counts, merged_expected = _np.array(merged_counts), _np.array(merged_expected)
+    statistic = float((((merged_counts - merged_expected) ** 2) / merged_expected).sum())
+    dof = len(merged_expected) - 1
+    return statistic, dof, chi2_sf(statistic, dof)
+
+def ks_discrete(counts, probabilities, rng:_np.random.Generator):
+    # (statistic, p-value) on the randomized PIT: a draw of category i becomes
+    # F(i - 1) + V p(i), V uniform, which is uniform on [0, 1) under the null
+    counts = _np.asarray(counts, dtype=_np.int64)
+    probabilities = _np.asarray(probabilities, dtype=_np.float64)
+    probabilities = probabilities / probabilities.sum()
+    n = int(counts.sum())
+    if n == 0:
+        return 0.0, 1.0
+    lower = _np.concatenate(([0.0], _np.cumsum(probabilities)[:-1]))
+    u = _np.repeat(lower, counts) + rng.random(n) * _np.repeat(probabilities, counts)
+    u.sort()
+    i = _np.arange(1, n + 1)
+    statistic = float(max((i / n - u).max(), (u - (i - 1) / n).max()))
+    return statistic, ks_sf(statistic, n)
+
+
+class Result:
+    def __init__(self, name, counts, probabilities, seconds, rng):
+        self.name = name
+        self.samples = int(_np.sum(counts))
+        self.categories = int(_np.count_nonzero(probabilities))
+        self.seconds = seconds
+        self.chi2, self.dof, self.chi2_p = chi_square(counts, probabilities)
+        self.ks, self.ks_p = ks_discrete(counts, probabilities, rng)
+
+    @property
+    def rate(self):
+        return self.samples / self.seconds if self.seconds > 0 else math.inf
+
+    def passed(self, alpha):
+        return self.chi2_p >= alpha and self.ks_p >= alpha
+
+    def __str__(self):
+        return (f'{self.name:<22} {self.samples:>9} samples {self.categories:>5} categories  '
+            f'chi2 {self.chi2:>10.1f} dof {self.dof:>4} p={self.chi2_p:.4f}  ks p={self.ks_p:.4f}  '
+            f'{self.rate:>9.0f} samples/s')
+
+
+# checks: (samples, seed, rng of the tests) -> [Result]
+
+_catalogs = {}
+
+def _catalog(game_type):
+    if not game_type in _catalogs:
+        _catalogs[game_type] = get_arcaea_info() if game_type == 'arcaea' else get_phigros_info()
+    return _catalogs[game_type]
+
+def _quest_game(game_type, quests, seed, pool_cache=None):
+    game = Game(game_type, logger=Logger.headless(), seed=seed, catalog=_catalog(game_type), pool_cache=pool_cache)
+    game.enable_all()
+    game.add_quest(quests)
+    return game
+
+def _expected_quests(game:Game, args:list):
+    # description -> probability of the configuration args, from the songs
+    manager = game.song_manager
+    songs = manager.catalog[0]
+    levels = {manager.level_key(song['level']): 1.0 for song in songs}
+    weights, banned = manager.quest_config(levels, args)
+    expected = {}
+    for song in songs:
+        if not (song['package'] in manager.available_packages and song['difficulty'] in manager.available_difficulties):
+            continue
+        weight = 0.0 if manager.song_key(song) in banned else max(weights.get(manager.level_key(song['level']), 0.0), 0.0)
+        description = manager.quest_info(weight=1.0, song=song).description
+        expected[description] = expected.get(description, 0.0) + weight
+    return expected
+
+def _draw_quests(name, game:Game, expected:dict, samples, rng, removed=()):
+    for description in removed:
+        expected[description] = 0.0
+    index = {description: i for i, description in enumerate(expected)}
+    draw = game.quest_pool.draw_quest
+    counts = _np.zeros(len(index), dtype=_np.int64)
+    drawn = [None] * samples
+    start = time.perf_counter()
+    for i in range(samples):
+        drawn[i] = draw()
+    seconds = time.perf_counter() - start
+    for description, n in Counter(quest.description for quest in drawn).items():
+        counts[index[description]] += n
+    probabilities = _np.array(list(expected.values()))
+    return Result(name, counts, probabilities / probabilities.sum(), seconds, rng)
+
+def check_quests(samples, seed, rng):
+    results = []
+    for game_type, quests in (('arcaea', arcaea_quests), ('phigros', phigros_quests)):
+        game = _quest_game(game_type, quests, seed)
+        results.append(_draw_quests(f'quest.{game_type}', game, _expected_quests(game, quests), samples, rng))
+    return results
+
+def check_quest_updates(samples, seed, rng):
+    # weights and bans changed slot by slot, quests removed (redrawn) and put back
+    game = _quest_game('arcaea', arcaea_quests, seed)
+    args = list(arcaea_quests)
+    for method, *update in arcaea_updates:
+        getattr(game, method)(*update)
+        args += [update[0], update[1]] if method == 'set_quest_weight' else [method.split('_')[0], update[0]]
+    pool = game.quest_pool
+    removed = list({quest.description: quest for quest in (pool.draw_quest() for _ in range(20))}.values())
+    for quest in removed:
+        pool.remove_quest(quest)
+    for quest in removed[::2]:
+        pool.add_quest(quest)
+    expected = _expected_quests(game, args)
+    return [_draw_quests('quest.updated', game, expected, samples, rng, pool.removed_quests)]
+
+def check_cached_quests(samples, seed, rng):
+    # a pool taken from the pool cache, then changed
+    cache = QuestPoolCache()
+    _quest_game('arcaea', arcaea_quests, seed, cache)
+    game = _quest_game('arcaea', arcaea_quests, seed, cache)
+    game.set_quest_weight('10', 5.0)
+    game.ban_quest('grievouslady')
+    expected = _expected_quests(game, arcaea_quests + ['10', 5.0, 'ban', 'grievouslady'])
+    return [_draw_quests('quest.cached', game, expected, samples, rng)]
+
+def _event_results(name, n, singles, pairs, seconds, rng):
+    # singles: event indexes of single draws, pairs: (first, second) of double draws
+    total = len(singles) + len(pairs)
+    single_counts = _np.bincount(_np.asarray(singles, dtype=_np.int64), minlength=n)
+    results = [Result(f'{name}.single', single_counts, _np.full(n, 1 / n), seconds * len(singles) / total, rng)]
+    if len(pairs):
+        pairs = _np.asarray(pairs, dtype=_np.int64).reshape(-1, 2)
+        pair_counts = _np.bincount(pairs[:, 0] * n + pairs[:, 1], minlength=n * n)
+        # ordered pairs of two distinct events
+        probabilities = _np.full(n * n, 1 / (n * (n - 1)))
+        probabilities[_np.arange(n) * (n + 1)] = 0.0
+        results.append(Result(f'{name}.double', pair_counts, probabilities, seconds * len(pairs) / total, rng))
+    return results
+
+def check_events(samples, seed, rng):
+    # RandomEvent as Game drives it: the effects apply to a lobby and end with the turn
+    results = []
+    for game_type in ('arcaea', 'phigros'):
+        pm = PlayerManager()
+        for i in range(6):
+            pm.add_player(f'p{i}')
+        event = RandomEvent(pm, Logger.headless(), game_type, seed=seed)
+        index = {e.__name__: i for i, e in enumerate(event.event)}
+        draws = [None] * samples
+        start = time.perf_counter()
+        for i in range(samples):
+            draws[i] = event.draw_event()
+            pm.reset_turn_effects()
+        seconds = time.perf_counter() - start
+        singles = [index[names[0]] for names in draws if len(names) == 1]
+        pairs = [(index[names[0]], index[names[1]]) for names in draws if len(names) == 2]
+        results += _event_results(f'event.{game_type}', len(index), singles, pairs, seconds, rng)
+    return results
+
+def check_batch_events(samples, seed, rng):
+    # GameBatch.draw_events, half of the games drawing two events
+    games = 10000
+    batch = GameBatch(games, 2, seeds=range(seed, seed + games))
+    batch.double_event[::2] = True
+    chunks = []
+    start = time.perf_counter()
+    for _ in range(max(1, samples // games)):
+        chunks.append(batch.draw_events())
+    seconds = time.perf_counter() - start
+    events = _np.concatenate(chunks)
+    double = events[:, 1] >= 0
+    return _event_results('event.vectorized', len(batch.event_names), events[~double, 0], events[double], seconds, rng)
+
+CHECKS = {
+    'quest': check_quests,
+    'quest_updates': check_quest_updates,
+    'quest_cache': check_cached_quests,
+    'event': check_events,
+    'event_batch': check_batch_events,
+}
+
+def verify(samples=1000000, checks=tuple(CHECKS), seed=0):
+    # results of the checks, see Result.passed
+    rng = _np.random.default_rng(seed)
+    results = []
+    for name in checks:
+        results += CHECKS[name](samples, seed, rng)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Chi-square and KS tests of the quest and event samplers, with throughput')
+    parser.add_argument('--samples', type=int, default=1000000, help='draws per check')
+    parser.add_argument('--checks', nargs='+', default=list(CHECKS), choices=list(CHECKS))
+    parser.add_argument('--alpha', type=float, default=1e-4, help='significance level of a failure')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    failures = 0
+    for result in verify(args.samples, args.checks, args.seed):
+        ok = result.passed(args.alpha)
+        failures += not ok
+        print(f'{result}  {"ok" if ok else "FAIL"}')
+    if failures:
+        print(f'{failures} check(s) failed at alpha {args.alpha}')
+        sys.exit(1)
@@ -0,0 +1,393 @@
+import asyncio
+import itertools
+import json
+from .deadline import TimerWheel
+from .game import Game
+from .parser import get_arcaea_info, get_phigros_info
+from .utils import GameplayError, Logger
+
+# Game methods a client may call on a lobby; expire only comes from the deadlines
+# of the lobby and rollback takes back the bets and scores of other players
+_LOBBY_COMMANDS = {
+    'enable', 'disable', 'enable_all', 'disable_all', 'add_quest', 'set_quest_weight', 'ban_quest', 'unban_quest', 'reset_round',
+    'enroll', 'remove', 'start', 'draw_event', 'draw_quest', 'verify', 'bet', 'play',
+    'evaluate_preprocess', 'evaluate_score', 'evaluate_bet', 'end_turn', 'undo', 'redo',
+}
+
+class Lobby:
+    # One game driven by its own command queue (actor style): commands of a lobby
+    # run one after another, different lobbies never wait for each other.
+    # With deadlines (status -> seconds, e.g. {103: 60, 104: 300, 105: 30}) every
+    # phase of the game that has one is armed on the timer wheel when the game
+    # reaches it; the expiry is queued like a command and calls Game.expire,
+    # unless the game left the phase in the meantime. The wheel is shared by the
+    # lobbies of a server (LobbyServer.wheel) and required with deadlines.
+    def __init__(self, lobby_id:str, game:Game, deadlines:dict=None, wheel:TimerWheel=None, default_score=0):
+        self.id = lobby_id
+        self.game = game
+        self.deadlines = deadlines if deadlines else {}
+        self.default_score = default_score
+        if self.deadlines and wheel is None:
+            raise GameplayError('Lobby deadlines need a timer wheel')
+        self.__wheel = wheel
+        self.__timer = None
+        self.__phase = None         # (turn, status) the timer is armed for
+        self.__closing = False
+        self.__queue = asyncio.Queue()
+        self.__task = asyncio.get_running_loop().create_task(self.__run())
+
+    @property
+    def deadline(self):
+        # seconds left in the current phase, None without a deadline
+        if self.__timer is None or not self.__timer.pending:
+            return None
+        return max(0.0, self.__timer.when - asyncio.get_running_loop().time())
+
+    @property
+    def closed(self):
+        return self.__task.done()
+
+    async def submit(self, cmd:str, *args):
+        if self.closed or self.__closing:
+            raise GameplayError(f'Lobby {self.id} is closed')
+        future = asyncio.get_running_loop().create_future()
+        self.__queue.put_nowait((cmd, args, future))
+        return await future
+
+    async def close(self):
+        if not self.closed:
+            self.__closing = True
+            future = asyncio.get_running_loop().create_future()
+            self.__queue.put_nowait((None, (), future))
+            await future
+
+    async def __run(self):
+        while True:
+            cmd, args, future = await self.__queue.get()
+            if future is None:
+                # a deadline passed
+                if cmd == self.__phase:
+                    try:
+                        self.game.expire(self.default_score)
+                    except Exception as e:
+                        self.game.log(f'Lobby {self.id}: expiry failed: {type(e).__name__}: {e}')
+                    self.__arm()
+                continue
+            if cmd is None:
+                if self.__timer:
+                    self.__timer.cancel()
+                # ends the watches of the lobby as well
+                self.game.close()
+                future.set_result(None)
+                self.__drain()
+                return
+            try:
+                result = self.execute(cmd, args)
+            except Exception as e:
+                # the actor must outlive any failing command
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            self.__arm()
+
+    def __drain(self):
+        # commands queued behind the close would wait forever
+        while not self.__queue.empty():
+            cmd, args, future = self.__queue.get_nowait()
+            if future is None or future.done():
+                continue
+            if cmd is None:
+                future.set_result(None)
+            else:
+                future.set_exception(GameplayError(f'Lobby {self.id} is closed'))
+
+    def __arm(self):
+        if not self.deadlines:
+            return
+        phase = (self.game.turn, self.game.status)
+        if phase == self.__phase:
+            return
+        if self.__timer:
+            self.__timer.cancel()
+            self.__timer = None
+        self.__phase = phase
+        if phase[1] in self.deadlines:
+            self.__timer = self.__wheel.schedule(self.deadlines[phase[1]], self.__queue.put_nowait, (phase, (), None))
+
+    def execute(self, cmd:str, args):
+        if cmd == 'result':
+            self.game.evaluate_preprocess()
+            self.game.evaluate_score()
+            self.game.evaluate_bet()
+            self.game.end_turn()
+            return self.game.winner
+        elif cmd == 'state':
+            return self.game.snapshot()
+        elif cmd == 'standings':
+            return str(self.game)
+        elif cmd == 'deadline':
+            return self.deadline
+        elif cmd == 'memory':
+            profiler = self.game.profiler
+            if profiler is None:
+                # imported on demand, like by Game.enable_profiling
+                from .memory import MemoryProfiler
+                profiler = MemoryProfiler()
+            return profiler.measure(self.game)
+        elif cmd in _LOBBY_COMMANDS:
+            return getattr(self.game, cmd)(*args)
+        else:
+            raise GameplayError(f'Invalid command: {cmd}')
+
+
+class LobbyServer:
+    def __init__(self, logger_factory=Logger.headless, history=None, catalogs:dict=None, pool_cache=None,
+            deadlines:dict=None, default_score=0, tick=0.25, profiler=None):
+        # history: HistoryStore shared by the games of all lobbies
+        # catalogs: game type -> catalog, e.g. attached shared catalogs of a worker
+        # process (see shared_catalog.py); loaded on first use otherwise
+        # pool_cache: QuestPoolCache of the quest pools of all lobbies (see pool_cache.py)
+        # deadlines: status -> seconds of the phase in every lobby, see Lobby; the
+        # lobbies share one timer wheel of tick seconds
+        # profiler: MemoryProfiler tracking the games of all lobbies (see memory.py)
+        self.__lobbies = {}
+        self.__catalogs = dict(catalogs) if catalogs else {}    # song catalog shared by all lobbies of a game type
+        self.__lobby_ids = itertools.count(1)
+        self.__logger_factory = logger_factory
+        self.history = history
+        self.pool_cache = pool_cache
+        self.deadlines = deadlines
+        self.default_score = default_score
+        self.wheel = TimerWheel(tick)
+        self.profiler = profiler
+
+    @property
+    def lobbies(self):
+        return self.__lobbies
+
+    def catalog(self, game_type:str):
+        if not game_type in self.__catalogs:
+            if game_type == 'arcaea':
+                self.__catalogs[game_type] = get_arcaea_info()
+            elif game_type == 'phigros':
+                self.__catalogs[game_type] = get_phigros_info()
+            else:
+                raise GameplayError("Currently Only Support arcaea and phigros")
+        return self.__catalogs[game_type]
+
+    def lobby(self, lobby_id:str):
+        if not lobby_id in self.__lobbies:
+            raise GameplayError(f'Invalid lobby id: {lobby_id}')
+        return self.__lobbies[lobby_id]
+
+    def create_lobby(self, lobby_id:str=None, game_type='arcaea', turns=5, seed=None):
+        if lobby_id is None:
+            lobby_id = f'lobby{next(self.__lobby_ids)}'
+            while lobby_id in self.__lobbies:
+                lobby_id = f'lobby{next(self.__lobby_ids)}'
+        elif lobby_id in self.__lobbies:
+            raise GameplayError(f'Duplicate lobby id: {lobby_id}')
+        game = Game(game_type, turns=turns, logger=self.__logger_factory(), seed=seed,
+            catalog=self.catalog(game_type), history=self.history, pool_cache=self.pool_cache)
+        if self.profiler:
+            game.enable_profiling(self.profiler)
+        lobby = Lobby(lobby_id, game, self.deadlines, self.wheel, self.default_score)
+        self.__lobbies[lobby_id] = lobby
+        return lobby
+
+    async def close_lobby(self, lobby_id:str):
+        lobby = self.lobby(lobby_id)
+        del self.__lobbies[lobby_id]
+        await lobby.close()
+
+    async def close(self):
+        for lobby_id in list(self.__lobbies):
+            await self.close_lobby(lobby_id)
+
+    async def handle(self, request:dict):
+        # request: {"id": any, "cmd": str, "lobby": str, "args": list}
+        # response: {"id": same id, "ok": true, "result": ...} or {"id", "ok": false, "error": str}
+        response = {'id': request.get('id')}
+        try:
+            cmd = request.get('cmd')
+            args = request.get('args', [])
+            if cmd == 'create':
+                result = self.create_lobby(request.get('lobby'), *args).id
+            elif cmd == 'close':
+                result = await self.close_lobby(request.get('lobby'))
+            elif cmd == 'list':
+                result = list(self.__lobbies)
+            else:
+                result = await self.lobby(request.get('lobby')).submit(cmd, *args)
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = f'{type(e).__name__}: {e}'
+        else:
+            response['ok'] = True
+            response['result'] = result
+        return response
+
+    async def __respond(self, request, writer:asyncio.StreamWriter):
+        response = await self.handle(request)
+        if not writer.is_closing():
+            writer.write(json.dumps(response, ensure_ascii=False, separators=(',', ':')).encode('utf8') + b'\n')
+
+    async def __watch(self, request, writer:asyncio.StreamWriter):
+        # {"cmd": "watch", "lobby": ...}: after the response, one line per message of
+        # the spectator feed of the game, {"watch": id, "feed": {...}}, and a last
+        # {"watch": id, "feed": null} when the lobby closes. The messages are the
+        # encoded ones of the feed, shared by every watcher; a watcher that can not
+        # keep up gets a snapshot instead of the diffs it missed.
+        try:
+            subscription = self.lobby(request.get('lobby')).game.subscribe()
+        except GameplayError as e:
+            writer.write(json.dumps({'id': request.get('id'), 'ok': False, 'error': f'{type(e).__name__}: {e}'},
+                ensure_ascii=False, separators=(',', ':')).encode('utf8') + b'\n')
+            return
+        prefix = b'{"watch":' + json.dumps(request.get('id'), ensure_ascii=False, separators=(',', ':')).encode('utf8') + b',"feed":'
+        writer.write(json.dumps({'id': request.get('id'), 'ok': True, 'result': None}).encode('utf8') + b'\n')
+        try:
+            while not writer.is_closing():
+                messages = subscription.poll()
+                writer.write(b''.join(prefix + message + b'}\n' for message in messages))
+                await writer.drain()
+                if subscription.closed:
+                    if subscription.cursor == subscription.feed.seq:
+                        writer.write(prefix + b'null}\n')
+                        break
+                    continue
+                await subscription.wait()
+        finally:
+            subscription.close()
+
+    async def __client(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        # one JSON request per line; requests are answered out of order (matched by id)
+        # so that a busy lobby does not hold back the others on the same connection
+        tasks = set()
+        watches = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request should be an object')
+                except ValueError as e:
+                    writer.write(json.dumps({'id': None, 'ok': False, 'error': f'ParseError: {e}'}).encode('utf8') + b'\n')
+                    continue
+                if request.get('cmd') == 'watch':
+                    task = asyncio.create_task(self.__watch(request, writer))
+                    watches.add(task)
+                    task.add_done_callback(watches.discard)
+                else:
+                    task = asyncio.create_task(self.__respond(request, writer))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in watches:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=0):
+        return await asyncio.start_server(self.__client, host, port)
+
+    async def serve_unix(self, path:str):
+        return await asyncio.start_unix_server(self.__client, path)
+
+
+class LobbyClient:
+    # Client of the LobbyServer protocol, requests on one connection can be pipelined
+    def __init__(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        self.__reader = reader
+        self.__writer = writer
+        self.__pending = {}
+        self.__watches = {}     # request id -> queue of the feed messages
+        self.__request_ids = itertools.count()
+        self.__task = asyncio.get_running_loop().create_task(self.__receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=0):
+        return cls(*await asyncio.open_connection(host, port))
+
+    @classmethod
+    async def connect_unix(cls, path:str):
+        return cls(*await asyncio.open_unix_connection(path))
+
+    async def request(self, cmd:str, lobby:str=None, *args):
+        request_id = next(self.__request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request_id] = future
+        request = {'id': request_id, 'cmd': cmd, 'lobby': lobby, 'args': args}
+        self.__writer.write(json.dumps(request, ensure_ascii=False, separators=(',', ':')).encode('utf8') + b'\n')
+        response = await future
+        if not response['ok']:
+            raise GameplayError(response['error'])
+        return response['result']
+
+    async def watch(self, lobby:str):
+        # messages of the spectator feed of a lobby (snapshot first, then diffs,
+        # see spectate.apply_diff) until the lobby closes
+        request_id = next(self.__request_ids)
+        queue = asyncio.Queue()
+        self.__watches[request_id] = queue
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request_id] = future
+        request = {'id': request_id, 'cmd': 'watch', 'lobby': lobby}
+        self.__writer.write(json.dumps(request, ensure_ascii=False, separators=(',', ':')).encode('utf8') + b'\n')
+        try:
+            response = await future
+            if not response['ok']:
+                raise GameplayError(response['error'])
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.__watches.pop(request_id, None)
+
+    async def __receive(self):
+        try:
+            while True:
+                line = await self.__reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                if 'watch' in response:
+                    queue = self.__watches.get(response['watch'])
+                    if queue:
+                        queue.put_nowait(response['feed'])
+                    continue
+                future = self.__pending.pop(response['id'], None)
+                if future and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.__pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Connection closed'))
+            for queue in self.__watches.values():
+                queue.put_nowait(None)
+
+    async def close(self):
+        self.__writer.close()
+        await self.__task
+
+
+async def serve_forever(host='127.0.0.1', port=8765):
+    server = await LobbyServer().serve(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(serve_forever())
@@ -0,0 +1,296 @@
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+from multiprocessing import resource_tracker, shared_memory
+from .parser import SongCatalog
+from .utils import GameplayError
+
+# A SongCatalog in a shared memory segment, for worker processes that would
+# otherwise each hold the catalog as Python dicts (and touch every one of them
+# through refcounts, so copy-on-write after fork does not help either).
+# The owner exports the catalog once, workers attach to the segment by name and
+# read songs, levels and the (package, difficulty) index in place.
+#
+# Layout: header, then 8-byte aligned sections of fixed-width arrays:
+#   strings      uint32 offsets[strings + 1] into a utf8 blob, every distinct string once
+#   songs        string indexes of id, name, artist, package, difficulty; float64 level;
+#                weight level (int64 or float64, the level_key of the catalog)
+#   levels       weight level keys, uint32 bounds[levels + 1] into the song indexes by level
+#   groups       package and difficulty string indexes, uint32 bounds[groups + 1] into
+#                the song indexes by group
+#   sets         string indexes of the packages and of the difficulties
+#   version      ascii version (hash) of the catalog
+
+_MAGIC = b'BETCAT02'
+_STRING_KEYS = ('id', 'name', 'artist', 'package', 'difficulty')
+_SECTIONS = (
+    ('offsets', 'I'), ('blob', 'B'),
+    ('id', 'I'), ('name', 'I'), ('artist', 'I'), ('package', 'I'), ('difficulty', 'I'),
+    ('level', 'd'), ('song_levels', None),
+    ('level_keys', None), ('level_bounds', 'I'), ('level_songs', 'I'),
+    ('group_packages', 'I'), ('group_difficulties', 'I'), ('group_bounds', 'I'), ('group_songs', 'I'),
+    ('packages', 'I'), ('difficulties', 'I'), ('version', 'B'),
+)
+# magic, integer levels, then offset and length of every section
+_HEADER = struct.Struct('<8sQ' + 'QQ' * len(_SECTIONS))
+
+def _level_format(integer_levels):
+    return 'q' if integer_levels else 'd'
+
+
+class _Segment:
+    # the mapped segment and every view taken on it; the views are released
+    # before the segment is closed, the songs and the catalog point here (and
+    # not at each other) so that no reference cycle delays closing
+    def __init__(self, shm:shared_memory.SharedMemory):
+        buf = shm.buf
+        header = _HEADER.unpack_from(buf, 0)
+        if header[0] != _MAGIC:
+            raise GameplayError(f'Not a song catalog segment: {shm.name}')
+        self.integer_levels = bool(header[1])
+        self.__views = []
+        self.sections = {}
+        for i, (name, fmt) in enumerate(_SECTIONS):
+            offset, length = header[2 + 2*i], header[3 + 2*i]
+            fmt = fmt if fmt else _level_format(self.integer_levels)
+            self.sections[name] = self.view(buf[offset:offset + length * struct.calcsize(fmt)].cast(fmt))
+        self.shm = shm
+
+    def view(self, view:memoryview):
+        self.__views.append(view)
+        return view
+
+    def string(self, k:int):
+        offsets = self.sections['offsets']
+        return str(self.sections['blob'][offsets[k]:offsets[k+1]], 'utf8')
+
+    def song_field(self, i:int, key:str):
+        if key == 'level':
+            return self.sections['level'][i]
+        elif key in _STRING_KEYS:
+            return self.string(self.sections[key][i])
+        raise KeyError(key)
+
+    def close(self):
+        for view in reversed(self.__views):
+            view.release()
+        self.shm.close()
+
+    def __del__(self):
+        if hasattr(self, 'shm'):
+            self.close()
+
+
+class SharedSong(Mapping):
+    # read only song dict of a shared catalog
+    __slots__ = ('_segment', '_index')
+
+    def __init__(self, segment:_Segment, index:int):
+        self._segment = segment
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._segment.song_field(self._index, key)
+
+    def __iter__(self):
+        return iter(_STRING_KEYS + ('level',))
+
+    def __len__(self):
+        return len(_STRING_KEYS) + 1
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class SharedSongs(Sequence):
+    __slots__ = ('_segment', '_count')
+
+    def __init__(self, segment:_Segment):
+        self._segment = segment
+        self._count = len(segment.sections['level'])
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [SharedSong(self._segment, j) for j in range(*i.indices(self._count))]
+        if i < 0:
+            i += self._count
+        if i < 0 or i >= self._count:
+            raise IndexError('song index out of range')
+        return SharedSong(self._segment, i)
+
+
+class SharedCatalog(SongCatalog):
+    # attach with attach_catalog(name), create with export_catalog(catalog)
+    def __new__(cls, shm:shared_memory.SharedMemory, owner=False):
+        segment = _Segment(shm)
+        sections = segment.sections
+        string = segment.string
+        packages = {string(k) for k in sections['packages']}
+        difficulties = {string(k) for k in sections['difficulties']}
+        catalog = tuple.__new__(cls, (SharedSongs(segment), packages, difficulties))
+        catalog.segment = segment
+        catalog.owner = owner
+        catalog.level_key = int if segment.integer_levels else float
+        catalog.version = str(sections['version'], 'ascii')
+        catalog.song_levels = sections['song_levels']
+        # the index dicts have one entry per level / group, the song indexes stay in the segment
+        bounds = sections['level_bounds']
+        catalog.levels = {level: segment.view(sections['level_songs'][bounds[i]:bounds[i+1]])
+            for i, level in enumerate(sections['level_keys'])}
+        bounds = sections['group_bounds']
+        catalog.groups = {(string(package), string(difficulty)): segment.view(sections['group_songs'][bounds[i]:bounds[i+1]])
+            for i, (package, difficulty) in enumerate(zip(sections['group_packages'], sections['group_difficulties']))}
+        catalog.views = {}
+        return catalog
+
+    @property
+    def shm(self):
+        return self.segment.shm
+
+    @property
+    def name(self):
+        return self.segment.shm.name
+
+    def __reduce__(self):
+        # other processes attach to the segment instead of copying the catalog
+        return (attach_catalog, (self.name,))
+
+    def close(self):
+        # the songs and indexes of this catalog can not be used afterwards
+        self.views.clear()
+        self.segment.close()
+
+    def unlink(self):
+        # owner only: free the segment once every process has closed it. Workers
+        # sharing the resource tracker of the owner dropped the registration
+        # when they attached (see attach_catalog), so it is made again first.
+        resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+
+
+def export_catalog(catalog:SongCatalog, name:str=None):
+    # copy a catalog (result of get_arcaea_info / get_phigros_info) into a new segment
+    songs, packages, difficulties = catalog[0], catalog[1], catalog[2]
+    if not isinstance(catalog, SongCatalog):
+        raise GameplayError('Only a SongCatalog can be exported')
+    integer_levels = catalog.level_key is int
+    level_format = _level_format(integer_levels)
+    strings = {}
+    def intern(s):
+        return strings.setdefault(s, len(strings))
+
+    data = {key: array('I', (intern(song[key]) for song in songs)) for key in _STRING_KEYS}
+    data['level'] = array('d', (song['level'] for song in songs))
+    data['song_levels'] = array(level_format, catalog.song_levels)
+    for prefix, index in (('level', catalog.levels), ('group', catalog.groups)):
+        bounds = array('I', [0])
+        members = array('I')
+        for indexes in index.values():
+            members.extend(indexes)
+            bounds.append(len(members))
+        data[f'{prefix}_bounds'] = bounds
+        data[f'{prefix}_songs'] = members
+    data['level_keys'] = array(level_format, catalog.levels)
+    data['group_packages'] = array('I', (intern(package) for package, _ in catalog.groups))
+    data['group_difficulties'] = array('I', (intern(difficulty) for _, difficulty in catalog.groups))
+    data['packages'] = array('I', (intern(package) for package in sorted(packages)))
+    data['difficulties'] = array('I', (intern(difficulty) for difficulty in sorted(difficulties)))
+    encoded = [s.encode('utf8') for s in strings]
+    offsets = array('I', [0])
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    data['offsets'] = offsets
+    data['blob'] = array('B', b''.join(encoded))
+    data['version'] = array('B', catalog.version.encode('ascii'))
+
+    layout = []
+    size = _HEADER.size
+    for key, _ in _SECTIONS:
+        size = (size + 7) & ~7
+        layout += [size, len(data[key])]
+        size += len(data[key]) * data[key].itemsize
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    try:
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, int(integer_levels), *layout)
+        for i, (key, _) in enumerate(_SECTIONS):
+            raw = memoryview(data[key]).cast('B')
+            shm.buf[layout[2*i]:layout[2*i] + len(raw)] = raw
+        return SharedCatalog(shm, owner=True)
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+
+def attach_catalog(name:str):
+    # attach to an exported catalog; the segment stays owned by the exporting
+    # process, so it is not registered for cleanup at the exit of this one
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return SharedCatalog(shm)
+
+
+def _worker_memory(name, game_type, games):
+    # resident memory growth (KiB) of a worker that loads the catalog (name
+    # None) or attaches to it, then sets up games on it
+    import os
+    from .game import Game
+    from .parser import get_arcaea_info, get_phigros_info
+    from .utils import Logger
+    def rss():
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    before = rss()
+    if name is None:
+        catalog = get_arcaea_info() if game_type == 'arcaea' else get_phigros_info()
+    else:
+        catalog = attach_catalog(name)
+    kept = []
+    for _ in range(games):
+        game = Game(game_type, logger=Logger.headless(), catalog=catalog)
+        game.enable_all()
+        game.add_quest([])
+        kept.append(game)
+    quests = kept[-1].song_manager.quest_view().quests if kept else ()
+    return rss() - before, str(quests[0]) if quests else None
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import time
+    from .parser import get_arcaea_info, get_phigros_info
+
+    for game_type, load in (('arcaea', get_arcaea_info), ('phigros', get_phigros_info)):
+        catalog = load()
+        start = time.perf_counter()
+        shared = export_catalog(catalog)
+        exported = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            attached = attach_catalog(shared.name)
+            attach = time.perf_counter() - start
+            for i in range(len(catalog[0])):
+                if dict(attached[0][i]) != catalog[0][i] or attached.song_levels[i] != catalog.song_levels[i]:
+                    raise AssertionError(f'song {i}: {dict(attached[0][i])} != {catalog[0][i]}')
+            if attached[1] != catalog[1] or attached[2] != catalog[2]:
+                raise AssertionError('packages or difficulties differ')
+            if {k: list(v) for k, v in attached.levels.items()} != {k: list(v) for k, v in catalog.levels.items()} or \
+                    {k: list(v) for k, v in attached.groups.items()} != {k: list(v) for k, v in catalog.groups.items()}:
+                raise AssertionError('indexes differ')
+            attached.close()
+            print(f'{game_type}: {len(catalog[0])} songs, {shared.shm.size} bytes, '
+                f'export {exported*1000:.2f}ms, attach {attach*1000:.2f}ms')
+
+            # fresh worker processes: the catalog loaded as dicts vs attached by name
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(1) as pool:
+                dicts = pool.apply(_worker_memory, (None, game_type, 4))
+            with context.Pool(1) as pool:
+                attached = pool.apply(_worker_memory, (shared.name, game_type, 4))
+            print(f'  worker memory growth, 4 games: catalog copy {dicts[0]} KiB, shared {attached[0]} KiB')
+        finally:
+            shared.close()
+            shared.unlink()
@@ -0,0 +1,271 @@
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as _np
+from .advisor import BetAdvisor
+from .game import Game
+from .utils import GameplayError, Logger
+
+MAX_SCORE = 10000000
+
+# strategies: how a simulated player bets and which score it gets
+class Strategy:
+    # never bets, scores are drawn from a normal distribution around skill
+    def __init__(self, skill=9800000, spread=100000):
+        self.skill = skill
+        self.spread = spread
+
+    def bet(self, game:Game, player_id:str, rng:random.Random):
+        return None, 1
+
+    def score(self, game:Game, player_id:str, rng:random.Random):
+        return max(0, min(MAX_SCORE, int(rng.gauss(self.skill, self.spread))))
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.skill}, {self.spread})'
+
+
+class RandomBetStrategy(Strategy):
+    # bets with probability p_bet on a random other player
+    def __init__(self, skill=9800000, spread=100000, p_bet=0.5, max_stake=3):
+        super().__init__(skill, spread)
+        self.p_bet = p_bet
+        self.max_stake = max_stake
+
+    def bet(self, game:Game, player_id:str, rng:random.Random):
+        if rng.random() >= self.p_bet:
+            return None, 1
+        others = [player.id for player in game.players if player.id != player_id]
+        return rng.choice(others), rng.randint(1, self.max_stake)
+
+
+class LeaderBetStrategy(Strategy):
+    # always bets stake points on the other player with the highest score
+    def __init__(self, skill=9800000, spread=100000, stake=2):
+        super().__init__(skill, spread)
+        self.stake = stake
+
+    def bet(self, game:Game, player_id:str, rng:random.Random):
+        leader = max((player for player in game.players if player.id != player_id),
+            key=lambda player: player.score)
+        return leader.id, self.stake
+
+
+class ExpectedValueBetStrategy(Strategy):
+    # bets max_stake on the other player with the highest expected reward under the
+    # current standings, the bets already placed and the events of the turn (see
+    # BetAdvisor); does not bet when no bet has a positive expectation
+    def __init__(self, skill=9800000, spread=100000, max_stake=3, samples=2000, weights:dict=None):
+        super().__init__(skill, spread)
+        self.max_stake = max_stake
+        self.advisor = BetAdvisor(weights, samples)
+
+    def bet(self, game:Game, player_id:str, rng:random.Random):
+        target, stake, _ = self.advisor.best(game, player_id, self.max_stake)
+        return target, stake
+
+
+class SimulationResult:
+    def __init__(self, player_ids:list):
+        self.player_ids = player_ids
+        self.games = 0
+        self.turns = 0
+        self.elapsed = 0.0
+        self.wins = {id: 0.0 for id in player_ids}      # ties split the win
+        self.score_sum = {id: 0 for id in player_ids}
+        self.score_sq_sum = {id: 0 for id in player_ids}
+        # event name -> [turns, sum of |score change| per player, sum of change of score std]
+        self.events = {}
+
+    def merge(self, other):
+        self.games += other.games
+        self.turns += other.turns
+        for id in self.player_ids:
+            self.wins[id] += other.wins[id]
+            self.score_sum[id] += other.score_sum[id]
+            self.score_sq_sum[id] += other.score_sq_sum[id]
+        for name, stats in other.events.items():
+            mine = self.events.setdefault(name, [0, 0.0, 0.0])
+            for i in range(3):
+                mine[i] += stats[i]
+
+    @property
+    def throughput(self):
+        return self.games / self.elapsed if self.elapsed > 0 else 0.0
+
+    def win_rate(self, id:str):
+        return self.wins[id] / self.games
+
+    def mean_score(self, id:str):
+        return self.score_sum[id] / self.games
+
+    def score_variance(self, id:str):
+        mean = self.mean_score(id)
+        return self.score_sq_sum[id] / self.games - mean * mean
+
+    def event_impact(self, name:str):
+        # (share of turns, mean |score change| per player, mean change of the score std)
+        turns, delta, spread = self.events[name]
+        return turns / self.turns, delta / turns, spread / turns
+
+    def report(self):
+        lines = [f'{self.games} games in {self.elapsed:.2f}s ({self.throughput:.0f} games/s)']
+        lines.append(f'{"player":<15} {"win rate":>8} {"mean":>8} {"variance":>9}')
+        for id in self.player_ids:
+            lines.append(f'{id:<15} {self.win_rate(id):>8.3f} {self.mean_score(id):>8.2f} {self.score_variance(id):>9.2f}')
+        lines.append(f'{"event":<28} {"turns":>6} {"|delta|":>8} {"spread":>7}')
+        for name in sorted(self.events):
+            share, delta, spread = self.event_impact(name)
+            lines.append(f'{name:<28} {share:>6.3f} {delta:>8.3f} {spread:>+7.3f}')
+        return '\n'.join(lines)
+
+
+def _std(values):
+    mean = sum(values) / len(values)
+    return math.sqrt(sum((v - mean) ** 2 for v in values) / len(values))
+
+# one worker process builds the game (catalog, quest pool) once and reuses it
+_worker_game = None
+
+def _init_worker(simulation):
+    global _worker_game
+    _worker_game = simulation.new_game()
+
+def _run_chunk(simulation, seeds):
+    return simulation.run_games(_worker_game, seeds)
+
+
+class Simulation:
+    def __init__(
+        self,
+        strategies:dict,
+        game_type='arcaea',
+        turns=5,
+        quests:list=None,
+        enable:list=None,
+        catalog=None
+    ):
+        # strategies: player id -> Strategy
+        # enable: packages / difficulties to enable, None for all of them
+        # catalog: song catalog of the games, a SharedCatalog is attached to by the workers
+        if len(strategies) < 2:
+            raise GameplayError("At least two players are needed!")
+        self.strategies = dict(strategies)
+        self.game_type = game_type
+        self.turns = turns
+        self.quests = quests if quests else []
+        self.enable = enable
+        self.catalog = catalog
+
+    def new_game(self):
+        game = Game(self.game_type, turns=self.turns, logger=Logger.headless(), catalog=self.catalog)
+        if self.enable is None:
+            game.enable_all()
+        else:
+            for pac in self.enable:
+                game.enable(pac)
+        game.add_quest(self.quests)
+        for id in self.strategies:
+            game.enroll(id)
+        return game
+
+    def run_games(self, game:Game, seeds):
+        # seeds: pairs of integers, one pair (game rng, strategy rng) per game
+        result = SimulationResult(list(self.strategies))
+        start = time.perf_counter()
+        for game_seed, strategy_seed in seeds:
+            game.seed(int(game_seed))
+            rng = random.Random(int(strategy_seed))
+            self.play_game(game, rng, result)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def play_game(self, game:Game, rng:random.Random, result:SimulationResult):
+        # the evaluation sorts the player list, the players are enrolled again so
+        # that every game starts from the same order, whatever ran before it
+        for id in self.strategies:
+            game.remove(id)
+            game.enroll(id)
+        game.reset_round(self.turns)
+        game.start()
+        while not game.finished:
+            before = {player.id: player.score for player in game.players}
+            events = game.draw_event()
+            game.draw_quest()
+            game.verify()
+            for id, strategy in self.strategies.items():
+                game.bet(id, *strategy.bet(game, id, rng))
+            for id, strategy in self.strategies.items():
+                game.play(id, strategy.score(game, id, rng))
+            game.evaluate_preprocess()
+            game.evaluate_score()
+            game.evaluate_bet()
+            game.end_turn()
+
+            after = {player.id: player.score for player in game.players}
+            delta = sum(abs(after[id] - before[id]) for id in after) / len(after)
+            spread = _std(list(after.values())) - _std(list(before.values()))
+            result.turns += 1
+            for name in events:
+                stats = result.events.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += delta
+                stats[2] += spread
+
+        winners = game.winner.split(', ')
+        for player in game.players:
+            result.score_sum[player.id] += player.score
+            result.score_sq_sum[player.id] += player.score * player.score
+            if player.id in winners:
+                result.wins[player.id] += 1 / len(winners)
+        result.games += 1
+
+    def run(self, games:int, seed=0, workers:int=None, chunk_size=200):
+        # every chunk of games gets an independent seed stream spawned from seed,
+        # so results only depend on seed and chunk_size, not on the number of workers
+        chunks = []
+        for i, child in enumerate(_np.random.SeedSequence(seed).spawn(math.ceil(games / chunk_size))):
+            n = min(chunk_size, games - i * chunk_size)
+            chunks.append(child.generate_state(2 * n, dtype=_np.uint64).reshape(n, 2).tolist())
+
+        result = SimulationResult(list(self.strategies))
+        start = time.perf_counter()
+        if workers == 1:
+            game = self.new_game()
+            for seeds in chunks:
+                result.merge(self.run_games(game, seeds))
+        else:
+            workers = workers if workers else os.cpu_count()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                    initargs=(self,)) as executor:
+                for chunk_result in executor.map(_run_chunk, [self] * len(chunks), chunks):
+                    result.merge(chunk_result)
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Check that simulation results do not depend on the number of workers')
+    parser.add_argument('--games', type=int, default=1200)
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=3)
+    args = parser.parse_args()
+
+    simulation = Simulation({
+        'cautious': Strategy(skill=9850000, spread=80000),
+        'gambler': RandomBetStrategy(skill=9800000, spread=120000, p_bet=0.9, max_stake=6),
+        'follower': LeaderBetStrategy(skill=9800000, spread=100000, stake=2),
+        'newbie': RandomBetStrategy(skill=9300000, spread=300000, p_bet=0.3, max_stake=3),
+    }, turns=5)
+    def outcome(result):
+        return result.games, result.turns, result.wins, result.score_sum, result.score_sq_sum, result.events
+    # workers run different chunks one after another on the same game
+    results = [simulation.run(args.games, seed=args.seed, workers=workers, chunk_size=100)
+        for workers in (1, args.workers, args.workers)]
+    if not outcome(results[0]) == outcome(results[1]) == outcome(results[2]):
+        raise AssertionError(f'results differ between 1 and {args.workers} workers')
+    print(f'{args.games} games, same results with 1 and {args.workers} workers')
+    print(results[0].report())
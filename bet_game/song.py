@@ -1,20 +1,107 @@
-from .parser import get_arcaea_info, set_arcaea_quest
-from .parser import get_phigros_info, set_phigros_quest
+from .parser import SongCatalog
+from .parser import get_arcaea_info, arcaea_quest_config, arcaea_song_key
+from .parser import get_phigros_info, phigros_quest_config, phigros_song_key
+from .quest import ArcaeaQuestInfo, PhigrosQuestInfo
 from .utils import GameplayError
+from types import MappingProxyType
 import copy
 
+class QuestView:
+    # The songs of the enabled packages and difficulties, cached on the catalog
+    # per selection and never modified: slot i is songs[i], with indexes of the
+    # slots by weight level and by song key (what 'ban' names) so that quest
+    # configuration changes only touch the affected slots.
+    def __init__(self, catalog, indexes, quest_info, song_key):
+        # indexes: catalog song indexes of the view, in catalog order
+        songs = catalog[0]
+        self.songs = tuple(songs[i] for i in indexes)
+        self.song_levels = tuple(catalog.song_levels[i] for i in indexes)
+        self.quest_info = quest_info
+        self.song_key = song_key
+        by_level = {}
+        by_song = {}
+        for slot, song in enumerate(self.songs):
+            by_level.setdefault(self.song_levels[slot], []).append(slot)
+            by_song.setdefault(song_key(song), []).append(slot)
+        self.by_level = MappingProxyType({level: tuple(slots) for level, slots in by_level.items()})
+        self.by_song = MappingProxyType({key: tuple(slots) for key, slots in by_song.items()})
+        # every level of the view starts with weight 1.0
+        self.levels = MappingProxyType({level: 1.0 for level in by_level})
+        self.__quests = None
+
+    def __len__(self):
+        return len(self.songs)
+
+    @property
+    def quests(self):
+        # one quest per slot, shared by every pool built from the view: the
+        # pools keep their own weights, these stay at 1.0 and must not be changed
+        if self.__quests is None:
+            self.__quests = tuple(self.quest_info(weight=1.0, song=song) for song in self.songs)
+        return self.__quests
+
+    def weights(self, level_weights:dict, banned=()):
+        # slot weights of a configuration, only the levels that differ from the
+        # default weight and the banned songs are written
+        weights = [1.0] * len(self.songs)
+        for level, slots in self.by_level.items():
+            weight = level_weights.get(level, 0.0)
+            if weight != 1.0:
+                for slot in slots:
+                    weights[slot] = weight
+        for key in banned:
+            for slot in self.by_song.get(key, ()):
+                weights[slot] = 0.0
+        return weights
+
+    def quest(self, slot:int, weight:float):
+        return self.quest_info(weight=weight, song=self.songs[slot])
+
+    def level(self, slot:int):
+        return self.song_levels[slot]
+
+    def key(self, slot:int):
+        return self.song_key(self.songs[slot])
+
+
 class SongPackageManager:
-    def __init__(self):
-        self._songs = None
-        self._packages = None
-        self._difficulties = None
+    def __init__(self, catalog=None):
+        # catalog: (songs, packages, difficulties), read only, can be shared between
+        # managers; when not given it is loaded on first access
+        self.__catalog = catalog if catalog else None
 
         self._packages_enabled = set()
         self._difficulties_enabled = set()
 
-        self._songs_cache = None
-        self._levels_cache = None
-        self.set_quest_list = None
+        self._view = None
+        self.quest_config = None
+        self.quest_info = None
+        self.level_key = None
+        self.song_key = None
+
+    def load_catalog(self):
+        raise NotImplementedError
+
+    @property
+    def catalog(self):
+        if self.__catalog is None:
+            self.__catalog = self.load_catalog()
+        if not isinstance(self.__catalog, SongCatalog):
+            # plain (songs, packages, difficulties) tuples get the indexes of SongCatalog
+            self.__catalog = SongCatalog(*self.__catalog, self.level_key)
+        return self.__catalog
+
+    @property
+    def _songs(self):
+        return self.catalog[0]
+
+    @property
+    def _packages(self):
+        return self.catalog[1]
+
+    @property
+    def _difficulties(self):
+        return self.catalog[2]
 
     @property
     def available_packages(self):
@@ -26,23 +113,19 @@ class SongPackageManager:
 
     def enable_all_packages(self):
         self._packages_enabled = copy.deepcopy(self._packages)
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
 
     def disable_all_packages(self):
         self._packages_enabled = set()
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
 
     def enable_all_difficulties(self):
         self._difficulties_enabled = copy.deepcopy(self._difficulties)
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
 
     def disable_all_difficulties(self):
         self._difficulties_enabled = set()
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
 
     def enable(self, s:str):
         if s.lower() in self._packages:
@@ -51,65 +134,69 @@ class SongPackageManager:
             self._difficulties_enabled.add(s.lower())
         else:
             raise GameplayError(f'Invalid package or difficulty name {s} to enable')
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
 
     def disable(self, s:str):
         if s.lower() in self._packages:
-            self._packages_enabled.remove(s.lower())
-        if s.lower() in self._difficulties:
-            self._difficulties_enabled.remove(s.lower())
+            self._packages_enabled.discard(s.lower())
+        elif s.lower() in self._difficulties:
+            self._difficulties_enabled.discard(s.lower())
         else:
             raise GameplayError(f'Invalid package or difficulty name {s} to disable')
-        self._levels_cache = None
-        self._songs_cache = None
+        self._view = None
+
+    def quest_view(self, packages=None, difficulties=None):
+        # view of the enabled packages and difficulties, or of the given ones
+        if packages is not None or difficulties is not None:
+            return self.__quest_view(
+                frozenset(self._packages_enabled if packages is None else packages),
+                frozenset(self._difficulties_enabled if difficulties is None else difficulties))
+        if self._view is None:
+            self._view = self.__quest_view(frozenset(self._packages_enabled), frozenset(self._difficulties_enabled))
+        return self._view
+
+    def __quest_view(self, packages:frozenset, difficulties:frozenset):
+        catalog = self.catalog
+        selection = (packages, difficulties)
+        view = catalog.views.get(selection)
+        if view is None:
+            indexes = sorted(i for package in packages for difficulty in difficulties
+                for i in catalog.groups.get((package, difficulty), ()))
+            view = QuestView(catalog, indexes, self.quest_info, self.song_key)
+            if len(catalog.views) >= 64:
+                catalog.views.clear()
+            catalog.views[selection] = view
+        return view
 
     def add_quest_list(self, args:list):
-        if not self._levels_cache is None:
-            # song cache and level cache are synchronous
-            songs = self._songs_cache
-            levels = self._levels_cache
-        else:
-            songs = []
-            levels = {}
-            for song in self._songs:
-                if song['package'] in self._packages_enabled and song['difficulty'] in self._difficulties_enabled:
-                    songs.append(song)
-                    if song['level'] not in levels.keys():
-                        levels[song['level']] = 1.0
-            self._levels_cache = levels
-            self._songs_cache = songs
-        return self.set_quest_list(levels, songs, args)
+        view = self.quest_view()
+        weights = view.weights(*self.quest_config(view.levels, args))
+        return [view.quest(slot, weight) for slot, weight in enumerate(weights) if weight > 0]
 
 
 class ArcaeaSongPackageManager(SongPackageManager):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, catalog=None):
         # package names and difficulty names should be lower
-        self._songs, self._packages, self._difficulties = get_arcaea_info()
-        self.set_quest_list = set_arcaea_quest
+        # catalog: result of get_arcaea_info()
+        super().__init__(catalog)
+        self.quest_config = arcaea_quest_config
+        self.quest_info = ArcaeaQuestInfo
+        self.level_key = float
+        self.song_key = arcaea_song_key
+
+    def load_catalog(self):
+        return get_arcaea_info()
 
 
 class PhigrosSongPackageManager(SongPackageManager):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, catalog=None):
         # package names and difficulty names should be lower
-        self._songs, self._packages, self._difficulties = get_phigros_info()
-        self.set_quest_list = set_phigros_quest
-
-    def add_quest_list(self, args:list):
-        if not self._levels_cache is None:
-            # song cache and level cache are synchronous
-            songs = self._songs_cache
-            levels = self._levels_cache
-        else:
-            songs = []
-            levels = {}
-            for song in self._songs:
-                if song['package'] in self._packages_enabled and song['difficulty'] in self._difficulties_enabled:
-                    songs.append(song)
-                    if int(song['level']) not in levels.keys():
-                        levels[int(song['level'])] = 1.0
-            self._levels_cache = levels
-            self._songs_cache = songs
-        return self.set_quest_list(levels, songs, args)
\ No newline at end of file
+        # catalog: result of get_phigros_info()
+        super().__init__(catalog)
+        self.quest_config = phigros_quest_config
+        self.quest_info = PhigrosQuestInfo
+        self.level_key = int
+        self.song_key = phigros_song_key
+
+    def load_catalog(self):
+        return get_phigros_info()
@@ -0,0 +1,301 @@
+import json
+from .utils import WARNING
+
+# Spectators of a game. Game.subscribe starts a SpectatorFeed on the game: after
+# every state transition the feed computes one diff of the public state against
+# the previous one, encodes it once and appends it to a buffer shared by all
+# subscribers, which only keep a cursor into it. A subscriber starts with a
+# snapshot of the public state; one that falls behind the buffer gets a new
+# snapshot instead of the diffs it missed.
+#
+# Public state, players keep the order of the player list:
+#   {"status": 103, "turn": 2, "turns": 5, "quest": "...", "events": [...], "winner": null,
+#    "order": ["p1", ...], "players": {"p1": {"score": 3, "bet": true, ...}, ...}}
+# Bets are secret until the bets are evaluated (status 107) and playing scores
+# until everybody played (status 105), before that only whether a player did.
+# Messages (JSON objects, encoded once):
+#   snapshot     {"seq": n, "state": {...}}
+#   diff         {"seq": n, "op": "bet", <changed top level keys>,
+#                 "players": {"p1": {<changed fields>}, "p9": {<whole entry, new player>}},
+#                 "removed": ["p2"]}
+
+_REVEAL_PLAYING_SCORES = 105
+_REVEAL_BETS = 107
+_STATE_KEYS = ('status', 'turn', 'turns', 'quest', 'events', 'winner', 'order')
+
+def player_state(player, status):
+    revealed_scores = status >= _REVEAL_PLAYING_SCORES
+    revealed_bets = status >= _REVEAL_BETS
+    return {
+        'score': player.score,
+        'bet': player.took_bet,
+        'bet_id': player.bet_id if revealed_bets else None,
+        'stake': player.stake if revealed_bets and player.bet_id else None,
+        'played': player.played,
+        'playing_score': player.playing_score if revealed_scores else None,
+        'betted': player.betted,
+        'rank': player.rank,
+        'cur_pt': player.cur_pt,
+        'bet_reward': player.bet_reward,
+    }
+
+def spectator_state(game):
+    status = game.status
+    players = game.players
+    quest = game.current_quest
+    return {
+        'status': status,
+        'turn': game.turn,
+        'turns': game.turns,
+        'quest': None if quest is None else quest.description,
+        'events': list(game.events),
+        'winner': game.winner if game.finished else None,
+        'order': [player.id for player in players],
+        'players': {player.id: player_state(player, status) for player in players},
+    }
+
+def apply_diff(state:dict, message:dict):
+    # the state after a message of the feed (a snapshot replaces the state)
+    if 'state' in message:
+        return message['state']
+    for key in _STATE_KEYS:
+        if key in message:
+            state[key] = message[key]
+    players = state['players']
+    for id in message.get('removed', ()):
+        players.pop(id, None)
+    for id, fields in message.get('players', {}).items():
+        if id in players:
+            players[id].update(fields)
+        else:
+            players[id] = fields
+    return state
+
+def _encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+
+class SpectatorFeed:
+    def __init__(self, game, capacity=1024):
+        # capacity: diffs kept for subscribers that are behind
+        self.game = game
+        self.capacity = capacity
+        self.seq = 0
+        self.closed = False
+        self.__state = spectator_state(game)
+        self.__snapshot = None          # encoded snapshot of seq, built on demand
+        self.__messages = []            # encoded diffs, seq of messages[i] is first + i
+        self.__first = 1
+        self.__subscribers = []
+        self.__changed = None           # future awaited by the subscribers of an event loop
+
+    @property
+    def subscribers(self):
+        return len(self.__subscribers)
+
+    @property
+    def state(self):
+        return self.__state
+
+    def snapshot(self):
+        if self.__snapshot is None:
+            self.__snapshot = _encode({'seq': self.seq, 'state': self.__state})
+        return self.__snapshot
+
+    def subscribe(self, callback=None):
+        subscription = Subscription(self, callback)
+        self.__subscribers.append(subscription)
+        if callback:
+            callback(self.snapshot())
+            subscription.cursor = self.seq
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.__subscribers:
+            self.__subscribers.remove(subscription)
+
+    def publish(self, op:str, players=None):
+        # players: the players the operation touched, every player when None
+        if self.closed:
+            return
+        game = self.game
+        old = self.__state
+        new = dict(old)
+        status = game.status
+        quest = game.current_quest
+        new['status'] = status
+        new['turn'] = game.turn
+        new['turns'] = game.turns
+        new['quest'] = None if quest is None else quest.description
+        if old['events'] != game.events:
+            new['events'] = list(game.events)
+        new['winner'] = game.winner if game.finished else None
+
+        diff = {}
+        for key in _STATE_KEYS[:-1]:
+            if new[key] != old[key]:
+                diff[key] = new[key]
+        changed = {}
+        old_players = old['players']
+        if players is None or status != old['status']:
+            # the status decides what is revealed, every player is compared
+            players = game.players
+            order = [player.id for player in players]
+            if order != old['order']:
+                new['order'] = diff['order'] = order
+                removed = old_players.keys() - set(order)
+                if removed:
+                    diff['removed'] = sorted(removed)
+            new_players = {}
+        else:
+            new_players = dict(old_players)
+        for player in players:
+            entry = player_state(player, status)
+            before = old_players.get(player.id)
+            if before is None:
+                changed[player.id] = entry
+            elif entry != before:
+                changed[player.id] = {field: value for field, value in entry.items() if before[field] != value}
+            new_players[player.id] = entry
+        new['players'] = new_players
+        if changed:
+            diff['players'] = changed
+        self.__state = new
+        if not diff:
+            return
+
+        self.seq += 1
+        self.__snapshot = None
+        message = _encode({'seq': self.seq, 'op': op, **diff})
+        self.__messages.append(message)
+        if len(self.__messages) > 2 * self.capacity:
+            del self.__messages[:self.capacity]
+            self.__first += self.capacity
+        failed = []
+        for subscription in self.__subscribers:
+            if subscription.callback:
+                try:
+                    subscription.callback(message)
+                except Exception as e:
+                    # the operation has already been applied to the game, a failing
+                    # spectator must not fail it (nor keep the diff from the others)
+                    failed.append(subscription)
+                    self.game.log(f'Spectator dropped: {type(e).__name__}: {e}', False, WARNING)
+                else:
+                    subscription.cursor = self.seq
+        for subscription in failed:
+            self.unsubscribe(subscription)
+        self.__wake()
+
+    def read(self, cursor):
+        # messages after cursor (None: not subscribed yet) and the new cursor
+        if cursor is None or cursor + 1 < self.__first + max(0, len(self.__messages) - self.capacity):
+            return [self.snapshot()], self.seq
+        return self.__messages[cursor + 1 - self.__first:], self.seq
+
+    async def changed(self):
+        # returns after the next diff (or when the feed closes)
+        if self.closed:
+            return
+        # asyncio is only imported by the feeds that are awaited, see Game.subscribe
+        import asyncio
+        if self.__changed is None:
+            self.__changed = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self.__changed)
+
+    def __wake(self):
+        if self.__changed is not None:
+            if not self.__changed.done():
+                self.__changed.set_result(None)
+            self.__changed = None
+
+    def close(self):
+        self.closed = True
+        self.__subscribers.clear()
+        self.__wake()
+
+
+class Subscription:
+    # pull (poll / wait) or push (callback) reader of a SpectatorFeed
+    def __init__(self, feed:SpectatorFeed, callback=None):
+        self.feed = feed
+        self.callback = callback
+        self.cursor = None
+
+    @property
+    def closed(self):
+        return self.feed.closed
+
+    def poll(self):
+        # encoded messages since the last poll: a snapshot first, then diffs
+        messages, self.cursor = self.feed.read(self.cursor)
+        return messages
+
+    async def wait(self):
+        if self.cursor is None or self.cursor == self.feed.seq:
+            await self.feed.changed()
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import time
+    from .game import Game
+    from .parser import get_arcaea_info
+    from .utils import Logger
+
+    parser = argparse.ArgumentParser(description='Check and time the spectator feed of a game')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    game = Game('arcaea', turns=3, logger=Logger.headless(), seed=args.seed, catalog=get_arcaea_info())
+    game.enable_all()
+    game.add_quest([])
+    for i in range(args.players):
+        game.enroll(f'p{i}')
+    subscriptions = [game.subscribe() for _ in range(args.subscribers)]
+    states = [None, None]
+    def check(subscription, i):
+        # the state rebuilt from the messages is the public state of the game
+        for message in subscription.poll():
+            states[i] = apply_diff(states[i], json.loads(message))
+        if states[i] != json.loads(json.dumps(spectator_state(game))):
+            raise AssertionError(f'diffs disagree with the game at seq {game.feed.seq}')
+
+    published = 0.0
+    game.start()
+    late = None
+    while not game.finished:
+        ids = [player.id for player in game.players]
+        start = time.perf_counter()
+        game.draw_event()
+        game.draw_quest()
+        game.verify()
+        for id in ids:
+            game.bet(id, rng.choice([None] + ids[:2]) if id not in ids[:2] else None, rng.randint(1, 3))
+        game.undo()
+        game.redo()
+        for id in ids:
+            game.play(id, rng.randint(9000000, 10000000))
+        game.evaluate_preprocess()
+        game.evaluate_score()
+        game.evaluate_bet()
+        game.end_turn()
+        published += time.perf_counter() - start
+        check(subscriptions[0], 0)
+        if late is None:
+            late = game.subscribe()
+        else:
+            check(late, 1)
+    start = time.perf_counter()
+    for subscription in subscriptions[1:]:
+        subscription.poll()
+    polled = time.perf_counter() - start
+    print(f'{game.feed.seq} diffs of {args.players} players in {published*1000:.1f}ms, '
+        f'{args.subscribers - 1} subscribers caught up in {polled*1000:.1f}ms')
@@ -0,0 +1,401 @@
+import asyncio
+import json
+import math
+import random
+from .server import LobbyServer
+from .utils import GameplayError, ParseError
+
+# Tournaments over many games: every match is one Game (one round of turns) of
+# its players on a lobby, the final scores of the game decide the match.
+#   swiss               every round pairs players of similar standing who did not
+#                       meet yet, matches of match_size players
+#   single_elimination  head-to-head bracket with standard seeding (1 meets the
+#                       lowest seed), byes for the top seeds
+#   double_elimination  a player is out after two lost matches: winners and
+#                       losers bracket played side by side, grand final with reset
+#   round_robin         groups of group_size players (snake seeding), every
+#                       player of a group meets the others once
+# Entrants are given best seed first. Match points: one per opponent with a
+# lower final score, half per opponent with the same score; a swiss bye is
+# worth one point. In elimination matches a tied game goes to the better seed.
+
+FORMATS = ('swiss', 'single_elimination', 'double_elimination', 'round_robin')
+
+class Match:
+    # players of one game; a swiss or elimination bye has a single player
+    def __init__(self, match_id:str, round:int, players:list, bracket=None):
+        self.id = match_id
+        self.round = round
+        self.players = list(players)
+        self.bracket = bracket      # 'winners', 'losers', 'final' or the round robin group
+        self.scores = None          # player id -> final score, once played
+        self.winners = None
+
+    @property
+    def bye(self):
+        return len(self.players) == 1
+
+    @property
+    def done(self):
+        return self.winners is not None
+
+    def set_result(self, scores:dict, winners:list=None):
+        if set(scores) != set(self.players):
+            raise GameplayError(f'The result of match {self.id} should have the scores of {", ".join(self.players)}')
+        if winners is None:
+            top = max(scores.values())
+            winners = [id for id in self.players if scores[id] == top]
+        self.scores = dict(scores)
+        self.winners = list(winners)
+
+    def points(self):
+        if self.bye:
+            return {self.players[0]: 1.0}
+        return {id: sum(1.0 if self.scores[id] > self.scores[other] else 0.5 if self.scores[id] == self.scores[other] else 0.0
+            for other in self.players if other != id) for id in self.players}
+
+    def __repr__(self):
+        return f'Match({self.id}, {self.players}, winners={self.winners})'
+
+
+class Tournament:
+    def __init__(
+        self,
+        entrants:list,
+        format='swiss',
+        rounds:int=None,
+        match_size=2,
+        group_size=4,
+        game_type='arcaea',
+        turns=5,
+        quests:list=None,
+        seed=0,
+        name='cup',
+        checkpoint:str=None
+    ):
+        # rounds: swiss only, log2 of the entrants by default
+        # checkpoint: JSONL file the bracket is written to, see Tournament.load
+        if not format in FORMATS:
+            raise GameplayError(f'Invalid tournament format: {format}')
+        if len(entrants) < 2 or len(set(entrants)) != len(entrants):
+            raise GameplayError('A tournament needs at least two distinct entrants')
+        if match_size < 2 or match_size > len(entrants):
+            raise GameplayError(f'Invalid match size: {match_size}')
+        if format != 'swiss' and match_size != 2:
+            raise GameplayError(f'{format} matches are head-to-head')
+        self.entrants = list(entrants)
+        self.format = format
+        self.match_size = match_size
+        self.group_size = max(group_size, 2)
+        self.game_type = game_type
+        self.turns = turns
+        self.quests = quests if quests else []
+        self.seed = seed
+        self.name = name
+        self.groups = []            # round robin groups
+        self.__bracket = []         # first elimination round
+        if format == 'swiss':
+            self.rounds = rounds if rounds else max(math.ceil(math.log(len(entrants), match_size)), 1)
+        elif format == 'round_robin':
+            # snake seeding: 1 2 3 4 / 8 7 6 5 / 9 ...
+            count = math.ceil(len(entrants) / self.group_size)
+            self.groups = [[] for _ in range(count)]
+            for i, id in enumerate(self.entrants):
+                row, col = divmod(i, count)
+                self.groups[col if row % 2 == 0 else count - 1 - col].append(id)
+            self.rounds = max(len(group) + len(group) % 2 for group in self.groups) - 1
+        else:
+            self.rounds = None      # until one player is left
+            # standard seeding: 1 v 8, 4 v 5, 2 v 7, 3 v 6; missing seeds are byes
+            size = 1 << (len(entrants) - 1).bit_length()
+            order = [0]
+            while len(order) < size:
+                order = [s for seed in order for s in (seed, 2 * len(order) - 1 - seed)]
+            self.__bracket = [[self.entrants[seed] for seed in order[i:i+2] if seed < len(entrants)]
+                for i in range(0, size, 2)]
+        self.round = 0
+        self.matches = []
+        self.__matches = {}
+        self.__seeds = {id: i for i, id in enumerate(self.entrants)}
+        self.__points = {id: 0.0 for id in self.entrants}
+        self.__scores = {id: 0 for id in self.entrants}
+        self.__losses = {id: 0 for id in self.entrants}
+        self.__eliminated = {}      # player id -> round
+        self.__opponents = {id: set() for id in self.entrants}
+        self.__byes = set()
+        # player id -> position in the first elimination round
+        self.__positions = {id: i for i, id in enumerate(id for pair in self.__bracket for id in pair)}
+        self.__checkpoint = None
+        if checkpoint:
+            self.__checkpoint = open(checkpoint, 'w', encoding='utf8')
+            self.__write(['tournament', self.config()])
+
+    def config(self):
+        return {
+            'entrants': self.entrants, 'format': self.format, 'rounds': self.rounds,
+            'match_size': self.match_size, 'group_size': self.group_size, 'game_type': self.game_type,
+            'turns': self.turns, 'quests': self.quests, 'seed': self.seed, 'name': self.name,
+        }
+
+    # checkpoint
+    def __write(self, record):
+        if self.__checkpoint:
+            self.__checkpoint.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.__checkpoint.flush()
+
+    @classmethod
+    def load(cls, path:str):
+        # the tournament of a checkpoint, matches that were not over are played again
+        with open(path, 'rb') as f:
+            data = f.read()
+        lines = data.split(b'\n')
+        tournament = None
+        valid_size = 0          # bytes up to the end of the last complete record
+        offset = 0
+        for i, line in enumerate(lines):
+            offset += len(line) + 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if i >= len(lines) - 2:
+                    break   # truncated last line
+                raise ParseError(f'Invalid checkpoint line {i+1}')
+            # the last record may miss its newline only
+            valid_size = min(offset, len(data))
+            if tournament is None:
+                if record[0] != 'tournament':
+                    raise ParseError('The checkpoint should start with a tournament record')
+                tournament = cls(**record[1])
+            elif record[0] == 'round':
+                tournament.__add_round(record[1], [Match(*match) for match in record[2]])
+            elif record[0] == 'result':
+                tournament.__record(tournament.match(record[1]), record[2], record[3])
+            else:
+                raise ParseError(f'Invalid checkpoint record: {record[0]}')
+        if tournament is None:
+            raise ParseError('Empty checkpoint')
+        with open(path, 'rb+') as f:
+            f.truncate(valid_size)
+            f.seek(valid_size - 1)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        tournament.__checkpoint = open(path, 'a', encoding='utf8')
+        return tournament
+
+    def close(self):
+        if self.__checkpoint and not self.__checkpoint.closed:
+            self.__checkpoint.close()
+
+    # state
+    def match(self, match_id:str):
+        if not match_id in self.__matches:
+            raise GameplayError(f'Invalid match id: {match_id}')
+        return self.__matches[match_id]
+
+    @property
+    def pending(self):
+        return [match for match in self.matches if not match.done]
+
+    def alive(self):
+        # players still in the tournament, in seed order
+        return [id for id in self.entrants if not id in self.__eliminated]
+
+    @property
+    def finished(self):
+        if self.pending:
+            return False
+        if self.rounds is not None:
+            return self.round >= self.rounds
+        return len(self.alive()) <= 1
+
+    def standings(self, players:list=None):
+        # [(player id, match points, opponents' points, total score)], best first;
+        # in elimination players knocked out later rank higher.
+        # players: e.g. one of the round robin groups, all entrants by default
+        players = self.entrants if players is None else players
+        buchholz = {id: sum(self.__points[other] for other in self.__opponents[id]) for id in players}
+        def key(id):
+            return (-self.__eliminated.get(id, math.inf), -self.__points[id], -buchholz[id],
+                -self.__scores[id], self.__seeds[id])
+        return [(id, self.__points[id], buchholz[id], self.__scores[id]) for id in sorted(players, key=key)]
+
+    @property
+    def champion(self):
+        return self.standings()[0][0] if self.finished else None
+
+    def match_seed(self, match:Match):
+        # seed of the game of a match, the same after a restart
+        return random.Random(f'{self.seed}:{self.name}:{match.id}').randrange(1 << 30)
+
+    # rounds
+    def next_round(self):
+        # creates the matches of the next round, byes are decided at once
+        if self.pending:
+            raise GameplayError(f'Round {self.round} is not over')
+        if self.finished:
+            return []
+        groups = getattr(self, f'_Tournament__pair_{self.format}')()
+        matches = [Match(f'r{self.round+1}m{i+1}', self.round + 1, players, bracket)
+            for i, (bracket, players) in enumerate(groups)]
+        self.__write(['round', self.round + 1, [[m.id, m.round, m.players, m.bracket] for m in matches]])
+        self.__add_round(self.round + 1, matches)
+        for match in matches:
+            if match.bye:
+                self.record(match.id, {match.players[0]: 0})
+        return matches
+
+    def __add_round(self, round, matches):
+        self.round = round
+        self.matches.extend(matches)
+        for match in matches:
+            self.__matches[match.id] = match
+
+    def record(self, match_id:str, scores:dict, winners:list=None):
+        # result of a match played by hand: player id -> final score (the winners
+        # are the players with the top score by default)
+        match = self.match(match_id)
+        if match.done:
+            raise GameplayError(f'Match {match_id} is already over')
+        self.__record(match, scores, winners)
+        self.__write(['result', match.id, match.scores, match.winners])
+
+    def record_game(self, match_id:str, game):
+        if not game.finished:
+            raise GameplayError(f'The game of match {match_id} is not over')
+        self.record(match_id, {player.id: player.score for player in game.players}, game.winner.split(', '))
+
+    def __record(self, match:Match, scores:dict, winners:list):
+        match.set_result(scores, winners)
+        if match.bye:
+            self.__byes.add(match.players[0])
+        if not match.bye or self.format == 'swiss':
+            for id, points in match.points().items():
+                self.__points[id] += points
+        for id in match.players:
+            if not match.bye:
+                self.__scores[id] += match.scores[id]
+            self.__opponents[id].update(other for other in match.players if other != id)
+        if self.format.endswith('elimination') and not match.bye:
+            winner = min(match.winners, key=self.__seeds.get)
+            limit = 1 if self.format == 'single_elimination' else 2
+            for id in match.players:
+                if id != winner:
+                    self.__losses[id] += 1
+                    if self.__losses[id] >= limit:
+                        self.__eliminated[id] = match.round
+
+    # pairings: [(bracket, players)]
+    def __standing_order(self, players):
+        return sorted(players, key=lambda id: (-self.__points[id], -self.__scores[id], self.__seeds[id]))
+
+    def __pair_swiss(self):
+        order = self.__standing_order(self.entrants)
+        groups = []
+        if len(order) % self.match_size == 1:
+            # the lowest ranked player without a bye sits out
+            bye = next((id for id in reversed(order) if not id in self.__byes), order[-1])
+            order.remove(bye)
+            groups.append((None, [bye]))
+        matches = []
+        while order:
+            size = min(self.match_size, len(order))
+            group = [order.pop(0)]
+            # the best ranked players who did not meet anyone of the group yet
+            for id in list(order):
+                if len(group) == size:
+                    break
+                if self.__opponents[id].isdisjoint(group):
+                    group.append(id)
+                    order.remove(id)
+            while len(group) < size:
+                group.append(order.pop(0))
+            matches.append((None, group))
+        return matches + groups
+
+    def __bracket_pairs(self, players):
+        # adjacent players of the bracket meet
+        players = sorted(players, key=self.__positions.get)
+        return [players[i:i+2] for i in range(0, len(players), 2)]
+
+    def __pair_single_elimination(self):
+        if self.round == 0:
+            return [('winners', pair) for pair in self.__bracket]
+        return [('winners', pair) for pair in self.__bracket_pairs(self.alive())]
+
+    def __pair_double_elimination(self):
+        if self.round == 0:
+            return [('winners', pair) for pair in self.__bracket]
+        alive = self.alive()
+        winners = [id for id in alive if self.__losses[id] == 0]
+        losers = [id for id in alive if self.__losses[id] == 1]
+        if len(alive) == 2:
+            # grand final, played again when the winners bracket player loses
+            return [('final', winners + losers)]
+        groups = []
+        if len(winners) > 1:
+            groups += [('winners', pair) for pair in self.__bracket_pairs(winners)]
+        if len(losers) > 1:
+            # best seed against worst, the best seed sits out an odd round
+            losers.sort(key=self.__seeds.get)
+            if len(losers) % 2:
+                groups.append(('losers', [losers.pop(0)]))
+            groups += [('losers', [losers[i], losers[-1-i]]) for i in range(len(losers) // 2)]
+        return groups
+
+    def __pair_round_robin(self):
+        # circle method inside every group, a player without opponent sits out
+        matches = []
+        for g, group in enumerate(self.groups):
+            if len(group) % 2:
+                group = group + [None]
+            n = len(group)
+            if self.round >= n - 1:
+                continue    # a smaller group is done
+            shift = self.round
+            circle = [group[0]] + group[1+shift:] + group[1:1+shift]
+            matches += [(g, [circle[i], circle[n-1-i]]) for i in range(n // 2)
+                if circle[i] is not None and circle[n-1-i] is not None]
+        return matches
+
+    # playing
+    async def play_round(self, play, server:LobbyServer=None, concurrency=16):
+        # play(lobby, match): coroutine that drives the started game of a match to
+        # its end (bots, or waiting for the players of a hosted lobby). The games
+        # of the round run concurrently; every result is checkpointed as soon as
+        # it is in, a failing match is left pending and the first error is raised
+        # once the other matches are over.
+        server = server if server else LobbyServer()
+        limit = asyncio.Semaphore(concurrency)
+        async def one(match):
+            async with limit:
+                lobby = server.create_lobby(f'{self.name}-{match.id}', self.game_type, self.turns, self.match_seed(match))
+                try:
+                    await lobby.submit('enable_all')
+                    await lobby.submit('add_quest', self.quests)
+                    for id in match.players:
+                        await lobby.submit('enroll', id)
+                    await lobby.submit('start')
+                    await play(lobby, match)
+                    self.record_game(match.id, lobby.game)
+                finally:
+                    await server.close_lobby(lobby.id)
+        results = await asyncio.gather(*[one(match) for match in self.pending], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def run(self, play, server:LobbyServer=None, concurrency=16):
+        # plays the remaining rounds, also the pending matches of a loaded checkpoint
+        while True:
+            if self.pending:
+                await self.play_round(play, server, concurrency)
+            if not self.next_round():
+                return self.champion
+
+    def __str__(self):
+        lines = [f'{self.name}: {self.format}, round {self.round}' + (f'/{self.rounds}' if self.rounds else '')]
+        for i, (id, points, buchholz, score) in enumerate(self.standings()):
+            lines.append(f'{i+1:>4}. {id:<16} {points:>6g} pts {buchholz:>7g} opp {score:>6} score')
+        return '\n'.join(lines)
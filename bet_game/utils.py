@@ -1,4 +1,8 @@
 import datetime
+import os
+import queue
+import sys
+import threading
 
 class GameplayError(Exception):
     pass
@@ -67,20 +71,201 @@ class TrieNode:
             child = self.children[id[0]]
             child.insert(id[1:], player)
 
+# log levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+
+_LOG_STOP = object()
+
+class _LogFlush:
+    def __init__(self):
+        self.done = threading.Event()
+
+class _LogErrors:
+    # failures of the sinks in the writer thread, which keeps going without them
+    def __init__(self):
+        self.count = 0
+        self.last = None
+
+def _write(sink, s, errors:_LogErrors):
+    try:
+        if s is None:
+            if hasattr(sink, 'flush'):
+                sink.flush()
+        else:
+            sink.write(s)
+    except Exception as e:
+        errors.count += 1
+        errors.last = f'{type(e).__name__}: {e}'
+
+def _log_writer(q:queue.Queue, sinks:list, errors:_LogErrors):
+    # runs in the background thread; holds no reference to the Logger itself
+    # so that the Logger can still be garbage collected. A failing sink only
+    # loses its own lines: flush markers are always released and every item is
+    # marked done, so that flush() and a blocking log() can not wait forever.
+    while True:
+        batch = [q.get()]
+        try:
+            while len(batch) < Logger.BATCH_SIZE:
+                batch.append(q.get_nowait())
+        except queue.Empty:
+            pass
+
+        stop = False
+        for item in batch:
+            if item is _LOG_STOP:
+                stop = True
+            elif isinstance(item, _LogFlush):
+                for sink in [sys.stdout, *sinks]:
+                    _write(sink, None, errors)
+                item.done.set()
+            else:
+                s, echo, file = item
+                if echo:
+                    _write(sys.stdout, s + '\n', errors)
+                if file:
+                    for sink in sinks:
+                        _write(sink, s + '\n', errors)
+            q.task_done()
+        if stop:
+            return
+
 class Logger:
-    __file_name = None
-    __file = None
-    
+    POLICY_BLOCK = 'block'  # backpressure: log() waits until the queue has room
+    POLICY_DROP = 'drop'    # lines are dropped (and counted) while the queue is full
+    BATCH_SIZE = 256
+
+    def __init__(
+        self,
+        echo=True,
+        log_dir='log',
+        sinks=None,
+        threaded=False,
+        queue_size=4096,
+        policy='block',
+        echo_level=INFO,
+        file_level=INFO
+    ):
+        self.__file = None
+        self.__sinks = list(sinks) if sinks else []
+        self.__queue = None
+        self.__thread = None
+        if policy not in (self.POLICY_BLOCK, self.POLICY_DROP):
+            raise GameplayError(f'Invalid logging policy: {policy}')
+        self.echo = echo
+        self.echo_level = echo_level
+        self.file_level = file_level
+        self.policy = policy
+        self.dropped = 0
+        self.__errors = _LogErrors()
+        self.__log_dir = log_dir
+        # threaded: a writer thread per logger, until close(); for hosts whose
+        # sinks are slow, the other loggers write in the calling thread
+        if threaded:
+            self.__queue = queue.Queue(maxsize=queue_size)
+            self.__thread = threading.Thread(target=_log_writer, daemon=True,
+                args=(self.__queue, self.__sinks, self.__errors))
+            self.__thread.start()
+
+    @classmethod
+    def headless(cls):
+        # no console, no file and no writer thread: every log() returns before rendering
+        return cls(echo=False, log_dir=None, threaded=False)
+
+    @property
+    def file_name(self):
+        return None if self.__file is None else self.__file.name
+
+    def add_sink(self, sink):
+        self.flush()
+        self.__sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.flush()
+        self.__sinks.remove(sink)
+
     def reset_log(self, game_type='arcaea'):
+        if self.__log_dir is None:
+            return
+        self.flush()
         if not self.__file is None:
+            self.__sinks.remove(self.__file)
             self.__file.close()
-        self.__file_name = f'bet_on_me_{game_type}_' + datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f.txt')
-        self.__file = open('log/'+ self.__file_name, 'w')
+        os.makedirs(self.__log_dir, exist_ok=True)
+        file_name = f'bet_on_me_{game_type}_' + datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f.txt')
+        self.__file = open(os.path.join(self.__log_dir, file_name), 'w', encoding='utf8')
+        self.__sinks.append(self.__file)
+
+    def enabled(self, level=INFO, file=True):
+        return (self.echo and level >= self.echo_level) or \
+            (file and level >= self.file_level and len(self.__sinks) > 0)
+
+    def log(self, s, file=True, level=INFO):
+        # s may be a callable or any object with __str__, which is only rendered
+        # when some sink is enabled at this level
+        echo = self.echo and level >= self.echo_level
+        file = file and level >= self.file_level and len(self.__sinks) > 0
+        if not (echo or file):
+            return
+        if callable(s):
+            s = s()
+        s = str(s)
+        if self.__queue is None or not self.__thread.is_alive():
+            # also once the writer thread stopped (closed)
+            if echo:
+                sys.stdout.write(s + '\n')
+            if file:
+                for sink in self.__sinks:
+                    sink.write(s + '\n')
+        elif self.policy == self.POLICY_BLOCK:
+            self.__put((s, echo, file))
+        else:
+            try:
+                self.__queue.put_nowait((s, echo, file))
+            except queue.Full:
+                self.dropped += 1
 
-    def log(self, s, file=True):
-        print(s)
-        if file:
-            self.__file.write(str(s)+'\n')
+    @property
+    def sink_errors(self):
+        # (number, last error) of the writes and flushes that failed in the writer thread
+        return self.__errors.count, self.__errors.last
+
+    def __put(self, item):
+        # waits for room in the queue as long as the writer thread is alive
+        while True:
+            try:
+                self.__queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if not self.__thread.is_alive():
+                    return False
+
+    def flush(self):
+        # wait until every queued line is written, then flush all sinks
+        if self.__queue is not None and self.__thread.is_alive():
+            marker = _LogFlush()
+            if self.__put(marker):
+                while not marker.done.wait(0.1):
+                    if not self.__thread.is_alive():
+                        break
+                else:
+                    return
+        for sink in ([sys.stdout] if self.echo else []) + self.__sinks:
+            if hasattr(sink, 'flush'):
+                sink.flush()
+
+    def close(self):
+        if not self.__thread is None and self.__thread.is_alive():
+            self.flush()
+            self.__queue.put(_LOG_STOP)
+            self.__thread.join()
+        else:
+            self.flush()
+        if not self.__file is None:
+            self.__sinks.remove(self.__file)
+            self.__file.close()
+            self.__file = None
 
     def __del__(self):
-        self.__file.close()
\ No newline at end of file
+        self.close()
@@ -0,0 +1,257 @@
+import random
+import numpy as _np
+from .event import RandomEvent
+from .player import PlayerManager
+from .utils import GameplayError, Logger
+
+# The turn evaluation of Game (PlayerManager + RandomEvent) on arrays of shape
+# (games, players). Player p of every game is the p-th enrolled player of a
+# freshly created Game.
+#
+# Besides the scores, the engine keeps the position of every player in
+# PlayerManager.player_list, because ties are resolved by that order:
+# evaluate_playing_score sorts by (playing score desc, points asc, list order)
+# since default_score_cmp never returns a negative value for full ties, and
+# evaluate_bet_score stable-sorts by points twice (before and after the rewards).
+
+# rank_to_score rules by index; 0 is PlayerManager.default_rank_to_score
+_RANK_RULES = ['default_rank_to_score', 'winner_takes_all', 'normal_distribution']
+
+class GameBatch:
+    def __init__(self, games:int, players:int, game_type='arcaea', turns=5, seeds=None):
+        if players < 2:
+            raise GameplayError("At least two players are needed!")
+        self.games = games
+        self.players = players
+        self.turns = turns
+        # the same event list, in the same order, as RandomEvent draws from
+        self.event_names = [event.__name__ for event in
+            RandomEvent(PlayerManager(), Logger.headless(), game_type).event]
+        self.__event_index = {name: i for i, name in enumerate(self.event_names)}
+        if seeds is None:
+            seeds = range(games)
+        self.rngs = [random.Random(seed) for seed in seeds]
+        if len(self.rngs) != games:
+            raise GameplayError(f'Expected {games} seeds, got {len(self.rngs)}')
+        self.__rank_points = self.__build_rank_points(players)
+        self.reset_round(turns)
+
+    def reset_round(self, turns:int):
+        self.turns = turns
+        self.cur_turn = 1
+        self.scores = _np.zeros((self.games, self.players), dtype=_np.int64)
+        # order[g, p]: position of player p in player_list
+        self.order = _np.tile(_np.arange(self.players), (self.games, 1))
+        self.double_event = _np.zeros(self.games, dtype=bool)
+
+    @property
+    def finished(self):
+        return self.cur_turn > self.turns
+
+    @staticmethod
+    def __build_rank_points(n):
+        # points for rank i (0 = best) under each rank rule, see PlayerManager
+        # and RandomEvent's *_rank_to_score
+        rank = _np.arange(n)
+        default = _np.maximum((n+1)//2 - rank, 0)
+        winner_takes_all = _np.zeros(n, dtype=_np.int64)
+        winner_takes_all[0] = (n+1)//2
+        if n % 2 == 0:
+            normal = n//2 - _np.minimum(_np.abs(rank - n//2), _np.abs(rank - (n//2-1)))
+        else:
+            normal = n//2 - _np.abs(rank - n//2)
+        return _np.stack([default, winner_takes_all, normal]).astype(_np.int64)
+
+    def draw_events(self):
+        # (games, 2) event indexes, -1 when a game only draws one event
+        events = _np.full((self.games, 2), -1, dtype=_np.int64)
+        names = self.event_names
+        for g, rng in enumerate(self.rngs):
+            if self.double_event[g]:
+                events[g] = [self.__event_index[name] for name in rng.sample(names, 2)]
+            else:
+                events[g, 0] = self.__event_index[rng.choice(names)]
+        return events
+
+    def __mask(self, events, slot, name):
+        return events[:, slot] == self.__event_index.get(name, -2)
+
+    def __lowest_get_n(self, mask):
+        lowest = self.scores == self.scores.min(axis=1, keepdims=True)
+        self.scores += (lowest & mask[:, None]) * self.players
+
+    def play_turn(self, targets, stakes, playing_scores, events=None):
+        # targets[g, p]: index of the player p bets on, -1 for no bet
+        # stakes[g, p]: stake (clamped to [1, n] like Game.bet)
+        # playing_scores[g, p]: score of the quest
+        # events: result of draw_events(), drawn here when not given
+        if self.finished:
+            raise GameplayError('The game is over')
+        if events is None:
+            events = self.draw_events()
+        G, n = self.games, self.players
+        rows = _np.arange(G)[:, None]
+        targets = _np.asarray(targets, dtype=_np.int64)
+        playing_scores = _np.asarray(playing_scores, dtype=_np.int64)
+        betting = targets >= 0
+        stakes = _np.where(betting, _np.clip(stakes, 1, n), 0)
+        if (targets == _np.arange(n)).any():
+            raise GameplayError('Cannot bet oneself')
+
+        # draw_event: immediate effects and the flags of the turn
+        double_reward = _np.zeros(G, dtype=bool)
+        bet_failed_deduct = _np.ones(G, dtype=bool)
+        betted_deduct = _np.ones(G, dtype=bool)
+        rank_rule = _np.zeros(G, dtype=_np.int64)
+        next_double = _np.zeros(G, dtype=bool)
+        for slot in range(2):
+            mask = self.__mask(events, slot, 'absolute_zero')
+            self.scores = _np.where(mask[:, None], _np.maximum(self.scores, 0), self.scores)
+            self.__lowest_get_n(self.__mask(events, slot, 'poverty_relief'))
+            double_reward |= self.__mask(events, slot, 'bonus_time')
+            bet_failed_deduct &= ~self.__mask(events, slot, 'risk_aversion')
+            betted_deduct &= ~self.__mask(events, slot, 'no_need_to_hesitate')
+            for rule in (1, 2):
+                rank_rule[self.__mask(events, slot, _RANK_RULES[rule])] = rule
+            next_double |= self.__mask(events, slot, 'see_you_next_time')
+        self.double_event = next_double
+
+        # preprocess_bet_score
+        safe_targets = _np.where(betting, targets, 0)
+        bet_count = _np.zeros((G, n), dtype=_np.int64)
+        _np.add.at(bet_count, (_np.broadcast_to(rows, (G, n))[betting], targets[betting]), 1)
+        self.scores -= bet_count * betted_deduct[:, None]
+        # PlayerManager leaves betted at None for players nobody bet on
+        betted = _np.where(betted_deduct[:, None] & (bet_count > 0), bet_count, -1)
+
+        # evaluate_playing_score
+        ranked = _np.lexsort((self.order, self.scores, -playing_scores), axis=1)
+        rank = _np.empty_like(ranked)
+        rank[rows, ranked] = _np.arange(n)
+        self.scores += self.__rank_points[rank_rule[:, None], rank]
+        self.order = rank
+
+        # evaluate_bet_score
+        self.order = self.__stable_order_by_score()
+        max_score = self.scores.max(axis=1, keepdims=True)
+        success = betting & (self.scores[rows, safe_targets] == max_score)
+        reward = _np.where(success, stakes * (1 + double_reward[:, None]), 0)
+        reward -= _np.where(betting & ~success & bet_failed_deduct[:, None], stakes, 0)
+        self.scores += reward
+        self.order = self.__stable_order_by_score()
+
+        # evaluate_end_event, in the order the events were drawn
+        for slot in range(2):
+            self.__traffic_collision(self.__mask(events, slot, 'traffic_collision'), targets, betting)
+            self.__popular_player(self.__mask(events, slot, 'popular_player'), betted)
+            self.__lowest_get_n(self.__mask(events, slot, 'be_patient'))
+
+        self.cur_turn += 1
+        return events
+
+    def __stable_order_by_score(self):
+        position = _np.lexsort((self.order, -self.scores), axis=1)
+        order = _np.empty_like(position)
+        order[_np.arange(self.games)[:, None], position] = _np.arange(self.players)
+        return order
+
+    def __traffic_collision(self, mask, targets, betting):
+        if not mask.any():
+            return
+        G, n = self.games, self.players
+        rows = _np.broadcast_to(_np.arange(G)[:, None], (G, n))
+        count = _np.zeros((G, n), dtype=_np.int64)
+        _np.add.at(count, (rows[betting], targets[betting]), 1)
+        most = count.max(axis=1, keepdims=True)
+        own = _np.where(betting, count[rows, _np.where(betting, targets, 0)], 0)
+        hit = betting & (own == most) & mask[:, None]
+        self.scores -= _np.where(hit, own - 1, 0)
+
+    def __popular_player(self, mask, betted):
+        if not mask.any():
+            return
+        most = betted.max(axis=1, keepdims=True)
+        hit = (betted == most) & (most >= 0) & mask[:, None]
+        self.scores += _np.where(hit, 2 * most, 0)
+
+    def winners(self):
+        # (games, players) bool, True for every player with the highest score
+        return self.scores == self.scores.max(axis=1, keepdims=True)
+
+
+def random_inputs(rng:_np.random.Generator, games:int, players:int, score_levels=None):
+    # random bets (about half of the players bet) and playing scores; score_levels
+    # limits the number of distinct scores to provoke ties
+    offset = rng.integers(1, players, size=(games, players))
+    targets = (_np.arange(players) + offset) % players
+    targets = _np.where(rng.random((games, players)) < 0.5, targets, -1)
+    stakes = rng.integers(1, players + 2, size=(games, players))
+    if score_levels:
+        scores = 9000000 + 10000 * rng.integers(0, score_levels, size=(games, players))
+    else:
+        scores = rng.integers(9000000, 10000001, size=(games, players))
+    return targets, stakes, scores
+
+
+def check_against_game(games=200, players=6, turns=5, game_type='arcaea', seed=0, score_levels=3):
+    # differential check: play the same seeds and inputs through Game and GameBatch
+    # and compare the drawn events and the final scores of every game
+    from .game import Game
+    rng = _np.random.default_rng(seed)
+    seeds = rng.integers(0, 1 << 62, size=games).tolist()
+    inputs = [random_inputs(rng, games, players, score_levels) for _ in range(turns)]
+
+    batch = GameBatch(games, players, game_type, turns, seeds)
+    batch_events = [batch.play_turn(*turn_inputs) for turn_inputs in inputs]
+
+    game = Game(game_type, turns=turns, logger=Logger.headless())
+    game.enable_all()
+    game.add_quest([])
+    ids = [f'p{i:03d}' for i in range(players)]
+    for g in range(games):
+        # re-enroll: a new round of Game keeps the player order of the last one
+        for player in list(game.players):
+            game.remove(player.id)
+        for id in ids:
+            game.enroll(id)
+        game.seed(seeds[g])
+        game.reset_round(turns)
+        game.start()
+        for t, (targets, stakes, scores) in enumerate(inputs):
+            events = game.draw_event()
+            expected = [batch.event_names[e] for e in batch_events[t][g] if e >= 0]
+            if events != expected:
+                raise AssertionError(f'game {g} turn {t+1}: events {events} != {expected}')
+            game.draw_quest()
+            game.verify()
+            for p, id in enumerate(ids):
+                target = int(targets[g, p])
+                game.bet(id, ids[target] if target >= 0 else None, int(stakes[g, p]))
+            for p, id in enumerate(ids):
+                game.play(id, int(scores[g, p]))
+            game.evaluate_preprocess()
+            game.evaluate_score()
+            game.evaluate_bet()
+            game.end_turn()
+        final = {player.id: player.score for player in game.players}
+        expected = dict(zip(ids, batch.scores[g].tolist()))
+        if final != expected:
+            raise AssertionError(f'game {g}: scores {final} != {expected}')
+    return games
+
+
+if __name__ == '__main__':
+    import time
+    for players in (2, 3, 4, 6, 9, 12):
+        for score_levels in (2, 5, None):
+            check_against_game(games=300, players=players, score_levels=score_levels, seed=players)
+    print('GameBatch matches Game')
+
+    games, players, turns = 100000, 8, 5
+    batch = GameBatch(games, players, turns=turns)
+    rng = _np.random.default_rng(0)
+    start = time.perf_counter()
+    while not batch.finished:
+        batch.play_turn(*random_inputs(rng, games, players))
+    elapsed = time.perf_counter() - start
+    print(f'{games} games x {turns} turns x {players} players in {elapsed:.2f}s ({games/elapsed:.0f} games/s)')
@@ -1,4 +1,5 @@
 from bet_game import Game
+from bet_game.utils import Logger
 
 regular_quests = [
     '7', 1.0,       # weights of random
@@ -16,7 +17,8 @@ regular_quests = [
 ]
 
 turns = 5
-game = Game('arcaea', turns=turns)
+# interactive shell: write log lines synchronously so they show up before the prompt
+game = Game('arcaea', turns=turns, logger=Logger(threaded=False))
 game.enable('core')
 game.enable('rei')
 game.enable('yugamu')
@@ -32,6 +34,15 @@ game.enable('ftr')
 
 game.add_quest(regular_quests)
 
+def weight(level, w:float):
+    game.set_quest_weight(level, w)
+
+def ban(song:str):
+    game.ban_quest(song)
+
+def unban(song:str):
+    game.unban_quest(song)
+
 def reset(turn:int):
     game.reset_round(turn)
 
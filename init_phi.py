@@ -1,4 +1,5 @@
 from bet_game import Game
+from bet_game.utils import Logger
 
 regular_quests = [
     '7', 0.0,
@@ -14,13 +15,23 @@ regular_quests = [
 ]
 
 turns = 5
-game = Game('phigros', turns=turns)
+# interactive shell: write log lines synchronously so they show up before the prompt
+game = Game('phigros', turns=turns, logger=Logger(threaded=False))
 game.enable_all()
 game.disable('hd')
 game.disable('ez')
 
 game.add_quest(regular_quests)
 
+def weight(level, w:float):
+    game.set_quest_weight(level, w)
+
+def ban(song:str):
+    game.ban_quest(song)
+
+def unban(song:str):
+    game.unban_quest(song)
+
 def reset(turn:int):
     game.reset_round(turn)
 
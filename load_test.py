@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import random
+import time
+from bet_game.server import LobbyServer, LobbyClient
+
+regular_quests = [
+    '8', 1.0,
+    '9', 2.0,
+    '9+', 2.0,
+    '10', 1.0,
+]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values) * q))]
+
+async def run_lobby(client:LobbyClient, args, rng:random.Random, latencies:list):
+    async def request(cmd, lobby=None, *params):
+        start = time.perf_counter()
+        result = await client.request(cmd, lobby, *params)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    lobby = await request('create', None, args.game_type, args.turns, rng.randrange(1 << 30))
+    await request('enable_all', lobby)
+    await request('add_quest', lobby, regular_quests if args.game_type == 'arcaea' else [])
+    players = [f'p{i:04d}' for i in range(args.players)]
+    for player in players:
+        await request('enroll', lobby, player)
+
+    for _ in range(args.games):
+        await request('reset_round', lobby, args.turns)
+        await request('start', lobby)
+        for _ in range(args.turns):
+            await request('draw_event', lobby)
+            await request('draw_quest', lobby)
+            await request('verify', lobby)
+            await asyncio.gather(*[
+                request('bet', lobby, player, rng.choice([p for p in players if p != player] + [None]), rng.randint(1, 3))
+                for player in players])
+            await asyncio.gather(*[
+                request('play', lobby, player, rng.randrange(9000000, 10000000, 10000))
+                for player in players])
+            await request('result', lobby)
+    await request('close', lobby)
+
+async def main(args):
+    server = None
+    if args.port is None:
+        server = await LobbyServer().serve('127.0.0.1', 0)
+        host, port = server.sockets[0].getsockname()[:2]
+    else:
+        host, port = args.host, args.port
+
+    rng = random.Random(args.seed)
+    clients = [await LobbyClient.connect(host, port) for _ in range(args.connections)]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_lobby(clients[i % len(clients)], args, random.Random(rng.randrange(1 << 30)), latencies)
+        for i in range(args.lobbies)])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.close()
+    if server:
+        server.close()
+        await server.wait_closed()
+
+    games = args.lobbies * args.games
+    print(f'{args.lobbies} lobbies x {args.games} game(s) x {args.turns} turns, {args.players} players')
+    print(f'{len(latencies)} requests in {elapsed:.2f}s: {len(latencies)/elapsed:.0f} requests/s, {games/elapsed:.1f} games/s')
+    print(f'latency p50 {percentile(latencies, 0.5)*1000:.2f}ms '
+        f'p99 {percentile(latencies, 0.99)*1000:.2f}ms max {max(latencies)*1000:.2f}ms')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test for the bet_game lobby server on localhost')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='connect to a running server instead of starting one')
+    parser.add_argument('--game-type', default='arcaea')
+    parser.add_argument('--lobbies', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
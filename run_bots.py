@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import time
+from bet_game.bot import BotDriver, POLICIES
+
+regular_quests = [
+    '8', 1.0,
+    '9', 2.0,
+    '9+', 2.0,
+    '10', 1.0,
+]
+
+async def main(args):
+    driver = BotDriver(args.policies, args.game_type, turns=args.turns,
+        quests=regular_quests if args.game_type == 'arcaea' else [])
+    start = time.perf_counter()
+    winners = await driver.run(args.games, args.players, concurrency=args.concurrency, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    wins = {}
+    for winner in winners:
+        for id in winner.split(', '):
+            wins[id] = wins.get(id, 0) + 1
+    print(f'{args.games} games x {args.turns} turns, {args.players} bots ({", ".join(args.policies)}) '
+        f'in {elapsed:.2f}s ({args.games/elapsed:.1f} games/s)')
+    print('wins: ' + ', '.join(f'{id} {n}' for id, n in sorted(wins.items())))
+    print(driver.report())
+    if args.output:
+        driver.instrumentation.export_json(args.output)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bot-filled games on in-process lobbies, with per-phase latency')
+    parser.add_argument('--game-type', default='arcaea')
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--policies', nargs='+', default=['random', 'greedy', 'ev'], choices=sorted(POLICIES))
+    parser.add_argument('--concurrency', type=int, default=100, help='games played at the same time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the latency histograms as JSON')
+    asyncio.run(main(parser.parse_args()))
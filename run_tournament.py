@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+from bet_game.bot import Bot, BotDriver, POLICIES
+from bet_game.tournament import Tournament, FORMATS
+
+regular_quests = [
+    '8', 1.0,
+    '9', 2.0,
+    '9+', 2.0,
+    '10', 1.0,
+]
+
+async def main(args):
+    if args.resume and os.path.exists(args.checkpoint):
+        tournament = Tournament.load(args.checkpoint)
+        print(f'resumed {tournament.name} at round {tournament.round}, {len(tournament.pending)} match(es) pending')
+    else:
+        tournament = Tournament([f'bot{i:03d}' for i in range(args.entrants)], args.format,
+            rounds=args.rounds, match_size=args.match_size, group_size=args.group_size,
+            game_type=args.game_type, turns=args.turns,
+            quests=regular_quests if args.game_type == 'arcaea' else [], seed=args.seed,
+            checkpoint=args.checkpoint)
+    # every entrant keeps its policy for the whole tournament
+    policies = {id: args.policies[i % len(args.policies)] for i, id in enumerate(tournament.entrants)}
+    driver = BotDriver(args.policies, tournament.game_type, tournament.turns)
+
+    async def play(lobby, match):
+        rng = random.Random(tournament.match_seed(match))
+        await driver.play_lobby(lobby, [Bot(id, policies[id], rng.randrange(1 << 30)) for id in match.players])
+
+    start = time.perf_counter()
+    champion = await tournament.run(play, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - start
+    tournament.close()
+    print(tournament)
+    print(f'champion: {champion}, {len(tournament.matches)} matches in {elapsed:.2f}s')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bot tournament over concurrent lobbies, checkpointed round by round')
+    parser.add_argument('--format', default='swiss', choices=FORMATS)
+    parser.add_argument('--entrants', type=int, default=32)
+    parser.add_argument('--rounds', type=int, help='swiss rounds, log2 of the entrants by default')
+    parser.add_argument('--match-size', type=int, default=2, help='players per swiss game')
+    parser.add_argument('--group-size', type=int, default=4, help='players per round robin group')
+    parser.add_argument('--game-type', default='arcaea')
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--policies', nargs='+', default=['random', 'greedy', 'ev'], choices=sorted(POLICIES))
+    parser.add_argument('--concurrency', type=int, default=16, help='games played at the same time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--checkpoint', default='tournament.jsonl')
+    parser.add_argument('--resume', action='store_true', help='continue the tournament of the checkpoint')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,34 @@
+import argparse
+from bet_game.simulation import Simulation, Strategy, RandomBetStrategy, LeaderBetStrategy
+
+regular_quests = [
+    '7', 1.0,
+    '8', 2.0,
+    '9', 3.0,
+    '9+', 3.0,
+    '10', 2.0,
+    '10+', 1.0,
+    '11', 0.0,
+    '12', 0.0,
+]
+
+strategies = {
+    'cautious': Strategy(skill=9850000, spread=80000),
+    'gambler': RandomBetStrategy(skill=9800000, spread=120000, p_bet=0.9, max_stake=6),
+    'follower': LeaderBetStrategy(skill=9800000, spread=100000, stake=2),
+    'casual': RandomBetStrategy(skill=9600000, spread=200000, p_bet=0.5, max_stake=2),
+    'pro': LeaderBetStrategy(skill=9950000, spread=40000, stake=1),
+    'newbie': RandomBetStrategy(skill=9300000, spread=300000, p_bet=0.3, max_stake=3),
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of bet on me games')
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    simulation = Simulation(strategies, 'arcaea', turns=args.turns, quests=regular_quests,
+        enable=['core', 'rei', 'yugamu', 'prelude', 'vs', 'ftr'])
+    print(simulation.run(args.games, seed=args.seed, workers=args.workers).report())